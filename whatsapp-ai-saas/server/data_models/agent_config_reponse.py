@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Literal, Optional
 from datetime import datetime
 
 # Base fields shared by Create, Update, and Response
@@ -12,6 +12,7 @@ class AgentConfigurationBase(BaseModel):
     voice_accent: Optional[str] = Field(None, max_length=100)
     preferred_languages: str = Field(default="en", max_length=100)
     conversation_tone: str = Field(default="professional", max_length=50)
+    stream_replies: bool = False
 
 # Request Model for Creating
 class AgentConfigurationCreate(AgentConfigurationBase):
@@ -28,6 +29,7 @@ class AgentConfigurationUpdate(BaseModel):
     voice_accent: Optional[str] = Field(None, max_length=100)
     preferred_languages: Optional[str] = Field(None, max_length=100)
     conversation_tone: Optional[str] = Field(None, max_length=50)
+    stream_replies: Optional[bool] = None
 
 # Response Model (Output)
 class AgentConfigurationResponse(AgentConfigurationBase):
@@ -37,4 +39,10 @@ class AgentConfigurationResponse(AgentConfigurationBase):
     updated_at: Optional[datetime] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# Tenant-wide knowledge ingestion setting (tenants.knowledge_chunking)
+class KnowledgeChunkingSettings(BaseModel):
+    tenant_id: int
+    # local: structural chunks, no LLM call; llm: LLM refinement of each file/page
+    knowledge_chunking: Literal["local", "llm"] = "local"
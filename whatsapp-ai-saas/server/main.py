@@ -1,4 +1,6 @@
 
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
@@ -12,6 +14,11 @@ from database import Base, engine
 import os
 from fastapi.staticfiles import StaticFiles
 from settings import settings
+from services.tenant_resolver import warm_tenant_cache
+from services.exotel_client import get_exotel_client
+from services.rag import rag as rag_service
+from services.crawler import get_browser_pool
+from services.page_fetcher import get_page_fetcher
 from utils.responses import ( # Import global handlers
     http_exception_handler, 
     validation_exception_handler
@@ -19,7 +26,27 @@ from utils.responses import ( # Import global handlers
 
 
 
-app = FastAPI(title="WhatsApp AI Agent SaaS", version="1.0")
+# Load the embedding model in the background after startup instead of at import
+RAG_WARMUP = os.getenv("RAG_WARMUP", "true").lower() == "true"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await warm_tenant_cache()
+    except Exception as e:
+        print(f"[Startup] Tenant cache warmup failed, resolving on demand: {e}")
+    rag_warmup = asyncio.create_task(rag_service.executor.run(rag_service.warmup)) if RAG_WARMUP else None
+    yield
+    if rag_warmup is not None and not rag_warmup.done():
+        rag_warmup.cancel()
+    await get_exotel_client().aclose()
+    await get_browser_pool().close()
+    await get_page_fetcher().aclose()
+    rag_service.executor.shutdown()
+
+
+app = FastAPI(title="WhatsApp AI Agent SaaS", version="1.0", lifespan=lifespan)
 Instrumentator().instrument(app).expose(app)
 
 
@@ -78,4 +105,5 @@ app.include_router(salesforce.router)  # Add Salesforce routes
 
 @app.get("/healthz")
 def healthz():
-    return {"ok": True}
+    # rag_ready turns true once the embedding model is loaded; the API serves before that
+    return {"ok": True, "rag_ready": rag_service.ready}
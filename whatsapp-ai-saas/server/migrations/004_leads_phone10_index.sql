@@ -0,0 +1,4 @@
+-- server/migrations/004_leads_phone10_index.sql
+-- Sender → lead lookups match on the last 10 digits of the stored phone.
+CREATE INDEX IF NOT EXISTS idx_leads_tenant_phone10
+  ON leads (tenant_id, right(regexp_replace(phone, '\D', '', 'g'), 10));
@@ -0,0 +1,4 @@
+-- server/migrations/006_agent_stream_replies.sql
+-- Per-tenant opt-in for streaming replies in segments.
+ALTER TABLE agent_configurations
+  ADD COLUMN IF NOT EXISTS stream_replies BOOLEAN NOT NULL DEFAULT false;
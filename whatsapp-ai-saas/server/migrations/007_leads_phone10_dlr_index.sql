@@ -0,0 +1,5 @@
+-- server/migrations/007_leads_phone10_dlr_index.sql
+-- Delivery reports carry no tenant, so the DLR worker matches leads on the
+-- last 10 digits alone and takes the most recently created one.
+CREATE INDEX IF NOT EXISTS idx_leads_phone10
+  ON leads (right(regexp_replace(phone, '\D', '', 'g'), 10), created_at DESC);
@@ -0,0 +1,5 @@
+-- server/migrations/008_tenant_knowledge_chunking.sql
+-- How knowledge files/URLs are chunked for RAG: 'local' (structural, no LLM)
+-- or 'llm' (LLM refinement, the previous behaviour).
+ALTER TABLE tenants
+  ADD COLUMN IF NOT EXISTS knowledge_chunking VARCHAR(16) NOT NULL DEFAULT 'local';
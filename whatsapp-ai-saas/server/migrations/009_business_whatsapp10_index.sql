@@ -0,0 +1,8 @@
+-- server/migrations/009_business_whatsapp10_index.sql
+-- Receiver → tenant lookups match on the last 10 digits of the stored
+-- number, whatever its formatting ("+91 98765 43210", "919876543210").
+CREATE INDEX IF NOT EXISTS idx_business_profiles_whatsapp10
+  ON business_profiles (right(regexp_replace(business_whatsapp, '\D', '', 'g'), 10));
+
+-- The plain btree from an earlier 005 migration never serves that lookup
+DROP INDEX IF EXISTS ix_business_profiles_business_whatsapp;
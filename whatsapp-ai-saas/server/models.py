@@ -21,6 +21,7 @@ class Tenant(Base):
     plan = Column(String, default="starter")
     rag_enabled = Column(Boolean, default=False)
     rag_updated_at = Column(DateTime)
+    knowledge_chunking = Column(String(16), nullable=False, default="local", server_default="local")  # local|llm
     created_at = Column(DateTime, server_default=func.now())
 
 class User(Base):
@@ -130,7 +131,7 @@ class BusinessProfile(Base):
     id = Column(BigInteger, primary_key=True, index=True)
     tenant_id = Column(Integer, ForeignKey("tenants.id", ondelete="CASCADE"), nullable=False, index=True)
     business_name = Column(Text, nullable=False)
-    business_whatsapp = Column(Text, nullable=False)  
+    business_whatsapp = Column(Text, nullable=False)
     personal_number   = Column(Text, nullable=True)  
     language      = Column(String(15), nullable=False, default="en")
     business_type = Column(Text)
@@ -139,6 +140,14 @@ class BusinessProfile(Base):
     created_at    = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     updated_at    = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
 
+    __table_args__ = (
+        # Matches receiver lookups by the last 10 digits of the number
+        Index(
+            "idx_business_profiles_whatsapp10",
+            func.right(func.regexp_replace(business_whatsapp, r"\D", "", "g"), 10),
+        ),
+    )
+
 
 # -------------------------------
 # Items
@@ -215,6 +224,7 @@ class AgentConfiguration(Base):
     voice_accent = Column(String(100), nullable=True)
     preferred_languages = Column(String(100), nullable=False, default="en")
     conversation_tone = Column(String(50), default="professional")
+    stream_replies = Column(Boolean, nullable=False, default=False)  # send replies segment by segment as they generate
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -312,6 +322,18 @@ class Lead(Base):
 
     __table_args__ = (
         UniqueConstraint("tenant_id", "phone", name="uq_tenant_phone"),
+        # Matches lookups by the last 10 digits of the sender's number
+        Index(
+            "idx_leads_tenant_phone10",
+            "tenant_id",
+            func.right(func.regexp_replace(phone, r"\D", "", "g"), 10),
+        ),
+        # Delivery reports match on the number alone, newest lead first
+        Index(
+            "idx_leads_phone10",
+            func.right(func.regexp_replace(phone, r"\D", "", "g"), 10),
+            created_at.desc(),
+        ),
     )
 
 class Workflow(Timestamp,Base):
@@ -6,10 +6,12 @@ from typing import List
 from deps import get_db 
 from models import AgentConfiguration, Tenant 
 from utils.responses import StandardResponse 
+from utils.prompt_cache import invalidate_tenant_prompt
 from data_models.agent_config_reponse import (
     AgentConfigurationCreate, 
     AgentConfigurationUpdate, 
-    AgentConfigurationResponse
+    AgentConfigurationResponse,
+    KnowledgeChunkingSettings,
 )
 
 router = APIRouter(
@@ -50,6 +52,7 @@ def create_agent_config(
         db.add(new_config)
         db.commit()
         db.refresh(new_config)
+        invalidate_tenant_prompt(new_config.tenant_id)
         return StandardResponse(
             data=new_config, 
             message="Agent configuration created successfully."
@@ -140,10 +143,54 @@ def update_agent_config(
     try:
         db.commit()
         db.refresh(existing_config)
+        invalidate_tenant_prompt(existing_config.tenant_id)
         return StandardResponse(
             data=existing_config, 
             message="Agent configuration updated successfully."
         )
     except Exception as e:
         db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# 5. Knowledge chunking mode (tenant-wide)
+@router.get("/knowledge_chunking", response_model=StandardResponse[KnowledgeChunkingSettings])
+def get_knowledge_chunking(
+    tenant_id: int,
+    db: Session = Depends(get_db)
+):
+    tenant = db.query(Tenant).filter(Tenant.id == tenant_id).first()
+    if not tenant:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Tenant with ID {tenant_id} does not exist."
+        )
+    return StandardResponse(
+        data=KnowledgeChunkingSettings(tenant_id=tenant.id, knowledge_chunking=tenant.knowledge_chunking or "local"),
+        message="Knowledge chunking mode retrieved successfully."
+    )
+
+
+@router.put("/knowledge_chunking", response_model=StandardResponse[KnowledgeChunkingSettings])
+def update_knowledge_chunking(
+    settings_in: KnowledgeChunkingSettings,
+    db: Session = Depends(get_db)
+):
+    """Choose how uploaded files and web pages are chunked: locally ("local") or by LLM refinement ("llm")."""
+    tenant = db.query(Tenant).filter(Tenant.id == settings_in.tenant_id).first()
+    if not tenant:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Tenant with ID {settings_in.tenant_id} does not exist."
+        )
+
+    tenant.knowledge_chunking = settings_in.knowledge_chunking
+    try:
+        db.commit()
+        return StandardResponse(
+            data=settings_in,
+            message="Knowledge chunking mode updated successfully."
+        )
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
@@ -7,6 +7,8 @@ from deps import get_db
 from models import BusinessProfile, User 
 from data_models.bussiness_profile_models import BusinessProfileOut, BusinessProfileCreate, BusinessProfileUpdate
 from utils.enums import Onboarding
+from utils.prompt_cache import invalidate_tenant_prompt
+from services.tenant_resolver import invalidate_business_number
 
 router = APIRouter(
     prefix="/business_profile", 
@@ -58,6 +60,8 @@ def create_business_profile(
         user.onboarding_process = Onboarding.COMPLETED
     db.commit()
     db.refresh(profile)
+    invalidate_tenant_prompt(profile.tenant_id)
+    invalidate_business_number(profile.business_whatsapp)
     return profile
 
 
@@ -96,6 +100,7 @@ def update_business_profile(
     if not profile:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Business Profile not found for update")
 
+    old_whatsapp = profile.business_whatsapp
     # Update logic
     update_data = updates.model_dump(exclude_unset=True)
     for key, value in update_data.items():
@@ -103,4 +108,6 @@ def update_business_profile(
         
     db.commit()
     db.refresh(profile)
+    invalidate_tenant_prompt(profile.tenant_id)
+    invalidate_business_number(old_whatsapp, profile.business_whatsapp)
     return profile
\ No newline at end of file
@@ -9,6 +9,7 @@ from deps import get_db
 from models import Campaign, Lead, Template
 from data_models.campaign_req_res import CampaignListResponse, CampaignDetailResponse, CampaignStatusUpdate
 from services.campaigns import CampaignService, process_campaign_run_erp
+from services.campaign_dispatch import set_campaign_paused
 
 router = APIRouter(prefix="/campaigns", tags=["Campaigns"])
 
@@ -87,7 +88,7 @@ async def create_campaign(
 
     # 3. Handle Execution
     if run_immediate:
-        background_tasks.add_task(CampaignService.process_campaign_run, campaign_id)
+        background_tasks.add_task(CampaignService.process_campaign_run, new_campaign.id)
         return {"success": True, "message": "Campaign created and execution started", "id": new_campaign.id}
     
     return {"success": True, "message": "Campaign created in Draft mode", "id": new_campaign.id}
@@ -161,6 +162,7 @@ def change_campaign_status(
              
         camp.status = "Running"
         db.commit()
+        set_campaign_paused(campaign_id, False)
         # Trigger sending logic
         background_tasks.add_task(CampaignService.process_campaign_run, campaign_id)
         message = "Campaign started successfully"
@@ -168,6 +170,8 @@ def change_campaign_status(
     elif payload.action == "pause":
         camp.status = "Paused"
         db.commit()
+        # Running dispatches watch this flag instead of re-reading the row
+        set_campaign_paused(campaign_id, True)
         message = "Campaign paused"
     
     return {"success": True, "message": message, "current_status": camp.status}
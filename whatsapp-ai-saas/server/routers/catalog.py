@@ -1,6 +1,6 @@
 # server/routers/catalog.py
 import io
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, Form, HTTPException
 from fastapi.responses import StreamingResponse, JSONResponse
 from sqlalchemy import text
 from sqlalchemy.orm import Session
@@ -13,6 +13,7 @@ from settings import settings
 from deps import get_db
 from data_models.catalog_models import BulkUpload, CatalogOut, CatalogCreate, CatalogUpdate
 from utils.media import save_image      
+from services.catalog_sync import remove_catalog_items, sync_catalog
 
 router = APIRouter(prefix="/catalog", tags=["catalog"])
 
@@ -52,6 +53,7 @@ def csv_template():
 @router.post("/add", response_model=CatalogOut)
 def create_catalog_item(
     payload: CatalogCreate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     item = BusinessCatalog(
@@ -69,10 +71,12 @@ def create_catalog_item(
     db.add(item)
     db.commit()
     db.refresh(item)
+    background_tasks.add_task(sync_catalog, item.tenant_id, [item.id])
     return item
 
 @router.post("/add_with_media", response_model=CatalogOut)
 def create_catalog_item_with_image(
+    background_tasks: BackgroundTasks,
     item_type: str = Form(...),
     name: str = Form(...),
     tenant_id: int = Form(...),
@@ -102,11 +106,13 @@ def create_catalog_item_with_image(
     db.add(item)
     db.commit()
     db.refresh(item)
+    background_tasks.add_task(sync_catalog, item.tenant_id, [item.id])
     return item
 
 @router.put("/update", response_model=CatalogOut)
 def update_catalog_item(
     payload: CatalogUpdate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     item = db.query(BusinessCatalog).filter(
@@ -118,11 +124,13 @@ def update_catalog_item(
         setattr(item, k, v)
     db.commit()
     db.refresh(item)
+    background_tasks.add_task(sync_catalog, item.tenant_id, [item.id])
     return item
 
 @router.delete("/delete")
 def delete_catalog_item(
     item_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
 ):
     item = db.query(BusinessCatalog).filter(
@@ -130,13 +138,16 @@ def delete_catalog_item(
     ).first()
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
+    tenant_id = item.tenant_id
     db.delete(item)
     db.commit()
+    background_tasks.add_task(remove_catalog_items, tenant_id, [item_id])
     return {"ok": True}
 
 @router.post("/bulk-upload")
 def bulk_upload(
     payload: BulkUpload,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     if not payload.items:
@@ -150,12 +161,19 @@ def bulk_upload(
 
     # Bulk insert
     db.add_all(catalog_objects)
+    db.flush()
+    ids_by_tenant = {}
+    for obj in catalog_objects:
+        ids_by_tenant.setdefault(obj.tenant_id, []).append(obj.id)
     db.commit()
 
+    for tenant_id, ids in ids_by_tenant.items():
+        background_tasks.add_task(sync_catalog, tenant_id, ids)
     return {"created": len(catalog_objects)}
 
 @router.post("/CSV_upload")
 async def import_catalog_file(
+    background_tasks: BackgroundTasks,
     tenant_id: int = Form(...),
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
@@ -226,8 +244,12 @@ async def import_catalog_file(
     # --- Bulk insert ---
     for item in validated_items:
         db.add(item)
+    db.flush()
+    new_ids = [item.id for item in validated_items]
     db.commit()
 
+    # Embed only the new rows instead of re-sending the whole catalog
+    background_tasks.add_task(sync_catalog, tenant_id, new_ids)
     return {"ok": True, "created": len(validated_items)}
 
 
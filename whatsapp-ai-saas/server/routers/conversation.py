@@ -105,7 +105,7 @@ async def test_agent(
 ):
     if phone_number is None:
         phone_number = str(tenant_id)
-    get_conversation = get_history(sender = phone_number, tenant_id=tenant_id)
+    get_conversation = await get_history(sender = phone_number, tenant_id=tenant_id)
     await append_user(sender= phone_number, content=query)
    #get_conversation = get_history(sender = str(phone_number), tenant_id=tenant_id)
    #model_reply = await llm.llm_model_reply(tenant_id,get_conversation)
@@ -199,7 +199,7 @@ async def template_msg_send(request: TemplateMsgRequest):
     """
    
 
-    success = send_template_with_media(
+    success = await send_template_with_media(
         to_number=request.to_number,
         from_number=request.from_number,
         template_name=request.template_name,
@@ -14,6 +14,8 @@ from models import AgentConfiguration, BusinessCatalog, BusinessProfile , Item,
 from data_models.onboarding_response_model import AgentConfigurationBase, ReviewResponse ,AgentConfigurationResponse, StatusResponse
 from data_models.request_model import BusinessTypeRequest
 from utils.enums import Onboarding
+from utils.prompt_cache import invalidate_tenant_prompt
+from services.tenant_resolver import invalidate_business_number
 import re
 import models
 
@@ -64,11 +66,13 @@ def upsert_business_profile(
     ).first()
 
     if existing_profile:
+        old_whatsapp = existing_profile.business_whatsapp
         existing_profile.business_name = business_name
         existing_profile.personal_number = personal_number
         existing_profile.business_whatsapp = business_whatsapp
         # keep existing_profile.language as-is (or set to language if desired)
         db.commit()
+        invalidate_business_number(old_whatsapp, business_whatsapp)
         return {
             "ok": True,
             "message": "Business profile updated successfully",
@@ -84,6 +88,7 @@ def upsert_business_profile(
     )
     db.add(business_profile)
     db.commit()
+    invalidate_business_number(business_whatsapp)
     return {
         "ok": True,
         "message": "Business profile created successfully",
@@ -136,6 +141,7 @@ def update_business_type(
     profile.business_category = req.business_category
     db.commit()
     db.refresh(profile)
+    invalidate_tenant_prompt(req.tenant_id)
 
     # --- RETURN STRUCTURED RESPONSE (no response_model required) ---
     return {
@@ -304,6 +310,7 @@ async def set_workflow(
 
     db.commit()
     db.refresh(workflow)
+    invalidate_tenant_prompt(tenant_id)
 
     return {"ok": True}
 
@@ -498,6 +505,7 @@ def upsert_agent_configuration(
         db.commit()
         db.refresh(new_config)
         result = new_config
+    invalidate_tenant_prompt(config.tenant_id)
     
     background_tasks.add_task(add_catalog_to_rag, tenant_id=config.tenant_id)
     
@@ -574,18 +582,6 @@ async def get_review(
             )
             
 
-def get_tanant_id_from_receiver(receiver: str) -> int:
-    db = SessionLocal()
-    try:
-        business_profile = db.query(BusinessProfile).filter(BusinessProfile.business_whatsapp == receiver).first()
-        if business_profile:
-            return business_profile.tenant_id
-        else: return 1
-    except Exception as e:
-        print(f"Error fetching : {e}")
-    finally:
-        db.close()
-
 @router.get("/get_workflows_by_email")
 def get_workflows_by_email(
     email: str,
@@ -1,10 +1,12 @@
 # server/routers/rag.py
-from typing import List
-from fastapi import APIRouter
+import json
+from typing import Dict, List, Optional
+from fastapi import APIRouter, HTTPException
 from fastapi.params import Depends
 from requests import Session
 from services import llm
 from services.rag import rag
+from services.catalog_sync import sync_catalog
 from deps import get_db
 from models import BusinessCatalog
 from utils.responses import StandardResponse
@@ -23,9 +25,39 @@ async def add_doc(tenant_id: int, doc_id: str, text: str, source_url: str | None
     }])
     return {"ok": True}
 
+def _parse_filter(raw: Optional[str], name: str) -> Optional[Dict]:
+    """Filters arrive as JSON-encoded query params, e.g. where={"language":"en"}."""
+    if not raw:
+        return None
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"'{name}' must be a JSON object")
+    if not isinstance(value, dict):
+        raise HTTPException(status_code=400, detail=f"'{name}' must be a JSON object")
+    return value
+
 @router.get("/search")
-async def search(tenant_id: int, q: str, n: int = 6):
-    return {"results": await rag.search(tenant_id, q, k=n)}
+async def search(tenant_id: int, q: str, n: int = 6, where: Optional[str] = None, where_document: Optional[str] = None):
+    return {"results": await rag.search(
+        tenant_id, q, k=n,
+        where=_parse_filter(where, "where"),
+        where_document=_parse_filter(where_document, "where_document"),
+    )}
+
+@router.get("/hybrid_search")
+async def hybrid_search(tenant_id: int, q: str, n: int = 6, where: Optional[str] = None, where_document: Optional[str] = None):
+    return {"results": await rag.hybrid_search(
+        tenant_id, q, k=n,
+        where=_parse_filter(where, "where"),
+        where_document=_parse_filter(where_document, "where_document"),
+    )}
+
+@router.post("/search_batch")
+async def search_batch(tenant_id: int, queries: List[str], n: int = 6):
+    """Search several queries in one batched embedding + index call; results follow `queries` order."""
+    results = await rag.search_many(tenant_id, queries, k=n)
+    return {"results": [{"query": q, "results": r} for q, r in zip(queries, results)]}
 
 @router.get("/query")
 async def query_raw(tenant_id: int, q: str, n: int = 6):
@@ -62,46 +94,29 @@ async def add_catalog(
     if not catalog_ids:
         return {"ok": True, "message": "No catalog IDs provided"}
 
-    # Fetch catalog items from DB
-    catalogs = db.query(BusinessCatalog).filter(
+    # Group the requested ids by tenant; each tenant syncs only its changed rows
+    rows = db.query(BusinessCatalog.id, BusinessCatalog.tenant_id).filter(
         BusinessCatalog.id.in_(catalog_ids)
     ).all()
 
-    if not catalogs:
+    if not rows:
         return {"ok": True, "message": "No catalogs found for provided IDs"}
 
-    # Prepare documents for RAG
-    documents = []
-    for catalog in catalogs:
-        txt = (
-                f"Name: {catalog.name}\n"
-                f"Description: {catalog.description or 'Not available'}\n"
-                f"Category: {catalog.category or 'Uncategorized'}\n"
-                f"Type: {catalog.item_type or 'Unknown'}\n"
-                f"Price: {catalog.price if catalog.price is not None else 'N/A'} {catalog.currency or 'USD'}\n"
-                f"Discount: {catalog.discount if catalog.discount is not None else '0%'}\n"
-                f"Source URL: {catalog.source_url or 'N/A'}\n"
-                f"Image URL: {catalog.image_url or 'N/A'}\n"
-                f"Created: {catalog.created_at.strftime('%Y-%m-%d %H:%M') if catalog.created_at else 'Unknown'}\n"
-                f"Updated: {catalog.updated_at.strftime('%Y-%m-%d %H:%M') if catalog.updated_at else 'Unknown'}"
-            )
-        
-        documents.append({
-            "id": str(catalog.id),  # RAG systems usually expect string IDs
-            "text": txt,
-            "source_url": catalog.source_url,
-            "version": "1.0",  # You can make this dynamic if needed
-            "language": "en",  # Adjust based on tenant or catalog metadata
-        })
-
-    # Add to RAG system
-    tenant_id = catalogs[0].tenant_id  # Assuming all have same tenant_id
-    await rag.add_documents(tenant_id, documents)
+    ids_by_tenant: Dict[int, List[int]] = {}
+    for row in rows:
+        ids_by_tenant.setdefault(row.tenant_id, []).append(row.id)
+
+    added = unchanged = 0
+    for tenant_id, ids in ids_by_tenant.items():
+        result = await rag.executor.run(sync_catalog, tenant_id, ids)
+        added += result.upserted
+        unchanged += result.unchanged
 
     return {
         "ok": True,
-        "added_count": len(documents),
-        "tenant_id": tenant_id,
+        "added_count": added,
+        "unchanged_count": unchanged,
+        "tenant_id": rows[0].tenant_id,
         "catalog_ids": catalog_ids
     }
 
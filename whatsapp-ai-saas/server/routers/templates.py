@@ -9,6 +9,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 from utils.enums import TemplateStatusEnum
 from models import Tenant
+from utils.prompt_cache import invalidate_tenant_prompt
 
 
 router = APIRouter(prefix="/templates", tags=["Templates"])
@@ -48,6 +49,7 @@ def create_template(template_in: TemplateCreate, db: Session = Depends(get_db)):
         db.add(template)
         db.commit()
         db.refresh(template)
+        invalidate_tenant_prompt(template.tenant_id)
 
         response_data = TemplateResponse(
             id=template.id,
@@ -135,6 +137,7 @@ def update_template(
     try:
         db.commit()
         db.refresh(template)
+        invalidate_tenant_prompt(template.tenant_id)
         response_data = TemplateResponse(
             id=template.id,
             tenant_id=template.tenant_id,
@@ -183,8 +186,10 @@ def delete_template(template_id: int, db: Session = Depends(get_db)):
         )
 
     try:
+        tenant_id = template.tenant_id
         db.delete(template)
         db.commit()
+        invalidate_tenant_prompt(tenant_id)
         return build_response(
             success=True,
             message="Template deleted successfully"
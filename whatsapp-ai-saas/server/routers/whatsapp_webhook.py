@@ -1,19 +1,73 @@
-from fastapi import APIRouter, Depends, Request
+import json
+import os
+import time
+from fastapi import APIRouter, Request
 from fastapi.responses import Response
-from sqlalchemy import desc
-from services.ai_model import process_message_background
-import asyncio
-from fastapi import Request
-from fastapi.responses import Response
-from models import Lead
-from sqlalchemy.orm import Session
-from deps import get_db
 from datetime import datetime, timezone
+from redis.exceptions import RedisError
+from utils.redis_client import get_async_redis
 
 router = APIRouter(tags=["webhooks"])
 
+# Inbound Exotel messages are only parsed and appended to this stream here;
+# workers/webhook_worker.py consumes it and runs the AI pipeline.
+EXOTEL_QUEUE_KEY = os.getenv("EXOTEL_QUEUE", "wa_exotel_inbound")
+# Delivery reports go to their own stream, applied in batches by workers/dlr_worker.py
+EXOTEL_DLR_QUEUE_KEY = os.getenv("EXOTEL_DLR_QUEUE", "wa_exotel_dlr")
+EXOTEL_QUEUE_MAXLEN = int(os.getenv("EXOTEL_QUEUE_MAXLEN", "100000"))
+# Exotel retries callbacks it did not see acknowledged; message ids seen within this window are not re-queued
+EXOTEL_DEDUPE_KEY = os.getenv("EXOTEL_DEDUPE_KEY", "wa_exotel_seen")
+EXOTEL_DEDUPE_TTL = int(os.getenv("EXOTEL_DEDUPE_TTL", str(24 * 3600)))
+
+
+async def enqueue_incoming_message(message: dict, sender: str, receiver: str, user_input: str, content: dict) -> str:
+    """
+    XADD a parsed incoming message for the webhook worker. Returns the stream
+    entry id, or "" when the same Exotel message id was already queued.
+    """
+    event_id = message.get("sid") or f"{sender}:{message.get('timestamp') or int(time.time() * 1000)}"
+    r = get_async_redis()
+    seen_key = f"{EXOTEL_DEDUPE_KEY}:{event_id}"
+    if not await r.set(seen_key, "1", nx=True, ex=EXOTEL_DEDUPE_TTL):
+        return ""
+    payload = {
+        "sender": sender,
+        "receiver": receiver,
+        "text": user_input,
+        "content": content,
+        "timestamp": message.get("timestamp", ""),
+    }
+    try:
+        return await r.xadd(
+            EXOTEL_QUEUE_KEY,
+            {"event_id": event_id, "payload": json.dumps(payload, separators=(',', ':'))},
+            maxlen=EXOTEL_QUEUE_MAXLEN,
+            approximate=True,
+        )
+    except RedisError:
+        # Let Exotel's retry of this callback enqueue it
+        await r.delete(seen_key)
+        raise
+
+
+async def enqueue_dlr(message: dict) -> str:
+    """XADD a delivery report for the DLR worker. Returns the stream entry id."""
+    payload = {
+        "to": message.get("to", ""),
+        "status": message.get("exo_detailed_status", ""),
+        "description": message.get("description", ""),
+        "received_at": datetime.now(timezone.utc).isoformat(),
+    }
+    r = get_async_redis()
+    return await r.xadd(
+        EXOTEL_DLR_QUEUE_KEY,
+        {"event_id": message.get("sid", ""), "payload": json.dumps(payload, separators=(',', ':'))},
+        maxlen=EXOTEL_QUEUE_MAXLEN,
+        approximate=True,
+    )
+
 @router.post("/whatsapp_webhook")
-async def whatsapp_webhook(request: Request,db: Session = Depends(get_db)):
+async def whatsapp_webhook(request: Request):
     print("=" * 60)
     print("[WEBHOOK] New request received from Exotel")
     
@@ -62,72 +116,34 @@ async def whatsapp_webhook(request: Request,db: Session = Depends(get_db)):
                     print(f"[EXOTEL PARSED] Text: {user_input!r}")
                     print(f"[EXOTEL PARSED] Content Type: {content_type}")
                     
-                    # Process message in background
+                    # Hand off to the webhook worker; nothing heavy runs in the API process
                     if sender and user_input:
-                        # Schedule background processing
-                        asyncio.create_task(process_message_background(sender, receiver, user_input, content))
+                        try:
+                            entry_id = await enqueue_incoming_message(message, sender, receiver, user_input, content)
+                            if entry_id:
+                                print(f"[EXOTEL QUEUED] Stream entry: {entry_id}")
+                            else:
+                                print(f"[EXOTEL] Duplicate delivery of {message.get('sid')}, already queued")
+                        except RedisError as e:
+                            # Not acked -> Exotel retries the callback instead of the message being lost
+                            print(f"[ERROR] Failed to enqueue message from {sender}: {e}")
+                            return Response(content="", media_type="text/plain", status_code=503)
 
                 # --- CASE 2: DELIVERY REPORT (DLR) ---
                 elif callback_type == 'dlr':
-                    recipient_phone = message.get('to', '') # e.g., +918377843261
-                    detailed_status = message.get('exo_detailed_status', '') # e.g., EX_MESSAGE_SENT or ..._ERROR
-                    description = message.get('description', '')
-                    
-                    # Safely handle empty phone numbers to avoid slicing errors
-                    search_phone = recipient_phone[-10:] if recipient_phone else ""
-                    
                     template_category = message.get('template_category', '').lower()
-                    
+
                     if template_category not in ['marketing', 'utility']:
                         print(f"[DLR] Skipping status update. Category '{template_category}' is not marketing or utility.")
                         return Response(content="", media_type="text/plain", status_code=200)
 
-                    if search_phone:
-                        # 1. Find the most recent Lead by Phone Number
-                        lead = db.query(Lead).filter(
-                            Lead.phone.like(f"%{search_phone}")
-                        ).order_by(desc(Lead.created_at)).first()
-
-                        if lead:
-                            print(f"[DB] Found Lead ID: {lead.id} for Phone: {recipient_phone}")
-                            
-                            # Initialize tags if not present
-                            # Copy to a new list to ensure SQLAlchemy detects the JSON mutation
-                            current_tags = list(lead.tags) if lead.tags else []
-
-                            # Get current UTC timestamp in ISO format
-                            now = datetime.now(timezone.utc).isoformat()
-
-                            # Track statuses of interest
-                            success_statuses = ['SENT', 'DELIVERED', 'READ', 'SEEN']
-                            existing_statuses = {item.get('status') for item in current_tags if isinstance(item, dict)}
-
-                            # Check for Success
-                            matched_success = [s for s in success_statuses if s in detailed_status]
-                            
-                            if matched_success:
-                                print(f"[STATUS] Marking as Success: {detailed_status}")
-                                lead.status = "Success"
-
-                                # Add new status entries to tags (avoid duplicates)
-                                for s in matched_success:
-                                    if s not in existing_statuses:
-                                        current_tags.append({"status": s, "timestamp": now})
-                            else:
-                                print(f"[STATUS] Marking as Failed: {description}")
-                                lead.status = "Failed"
-                                current_summary = lead.summary or ""
-                                new_summary = f"{current_summary} | Failed: {description}".strip(" |")
-                                lead.summary = new_summary
-
-                            # Re-assign tags to trigger SQLAlchemy update
-                            lead.tags = current_tags
-
-                            # Commit changes
-                            db.commit()
-                            db.refresh(lead)
-                        else:
-                            print(f"[DB] No lead found for phone number: {recipient_phone}")
+                    # Applied to the lead in batches by workers/dlr_worker.py
+                    if message.get('to'):
+                        try:
+                            await enqueue_dlr(message)
+                        except RedisError as e:
+                            print(f"[ERROR] Failed to enqueue DLR for {message.get('to')}: {e}")
+                            return Response(content="", media_type="text/plain", status_code=503)
 
                 else:
                     print(f"[EXOTEL] Skipping/Unhandled callback type: {callback_type}")
@@ -138,14 +154,14 @@ async def whatsapp_webhook(request: Request,db: Session = Depends(get_db)):
         print("[ERROR] Unexpected content type, expected JSON")
     
     # IMPORTANT: Return 200 OK immediately
-    # Don't process the message here, do it in background
+    # Messages are processed by workers/webhook_worker.py from the stream
     return Response(content="", media_type="text/plain", status_code=200)
 
 
 
 
 @router.post("/callback_webhook")
-async def callback_webhook(request: Request, db: Session = Depends(get_db)):
+async def callback_webhook(request: Request):
     print("=" * 60)
     print("[WEBHOOK] New request received from Exotel")
     
@@ -164,82 +180,13 @@ async def callback_webhook(request: Request, db: Session = Depends(get_db)):
                 
                 # --- CASE 1: DELIVERY REPORT (DLR) ---
                 if callback_type == 'dlr':
-                    recipient_phone = message.get('to', '') # e.g., +918377843261
-                    detailed_status = message.get('exo_detailed_status', '') # e.g., EX_MESSAGE_SENT or ..._ERROR
-                    description = message.get('description', '')
-                    search_phone = recipient_phone[-10:]
-                    # 1. Find the most recent Lead by Phone Number
-                    # We use order_by(desc) to get the latest lead if duplicates exist
-                    lead = db.query(Lead).filter(
-                            Lead.phone.like(f"%{search_phone}")
-                        ).order_by(desc(Lead.created_at)).first()
-
-                    # if lead:
-                    #     print(f"[DB] Found Lead ID: {lead.id} for Phone: {recipient_phone}")
-                        
-                    #     # 2. Check for Failure
-                    #     # We check if 'ERROR' or 'FAILED' is in the status string
-                        
-                    #     # 3. Check for Success (Sent, Delivered, Read)
-                    #     if any(s in detailed_status for s in ['SENT', 'DELIVERED', 'READ','SEEN']):
-                    #         print(f"[STATUS] Marking as Success: {detailed_status}")
-                            
-                    #         # You can set this to "Success" or keep it granular (Sent/Delivered)
-                    #         # Per your request, setting to "Success"
-                    #         lead.status = "Success"
-                    #     else:
-                    #         print(f"[STATUS] Marking as Failed: {description}")
-                            
-                    #         lead.status = "Failed"
-                    #         # Append failure reason to summary
-                    #         current_summary = lead.pitch if lead.pitch else ""
-                    #         # Format: "Old Summary | Failed: Reason"
-                    #         new_summary = f"{current_summary} | Failed: {description}".strip(" |")
-                    #         lead.pitch = new_summary 
-                            
-                    #     # Commit changes
-                    #     db.commit()
-                    #     db.refresh(lead)
-                    # else:
-                    #     print(f"[DB] No lead found for phone number: {recipient_phone}")
-
-                    if lead:
-                        print(f"[DB] Found Lead ID: {lead.id} for Phone: {recipient_phone}")
-                        
-                        # Initialize tags if not present
-                        if lead.tags is None:
-                            lead.tags = []
-
-                        # Get current UTC timestamp in ISO format
-                        now = datetime.now(timezone.utc).isoformat()
-
-                        # Track statuses of interest
-                        success_statuses = ['SENT', 'DELIVERED', 'READ', 'SEEN']
-                        existing_statuses = {item.get('status') for item in lead.tags if isinstance(item, dict)}
-
-                        # Check for Success
-                        matched_success = [s for s in success_statuses if s in detailed_status]
-                        
-                        if matched_success:
-                            print(f"[STATUS] Marking as Success: {detailed_status}")
-                            lead.status = "Success"
-
-                            # Add new status entries to tags (avoid duplicates)
-                            for s in matched_success:
-                                if s not in existing_statuses:
-                                    lead.tags.append({"status": s, "timestamp": now})
-                        else:
-                            print(f"[STATUS] Marking as Failed: {description}")
-                            lead.status = "Failed"
-                            current_summary = lead.pitch or ""
-                            new_summary = f"{current_summary} | Failed: {description}".strip(" |")
-                            lead.pitch = new_summary
-
-                        # Commit changes
-                        db.commit()
-                        db.refresh(lead)
-                    else:
-                        print(f"[DB] No lead found for phone number: {recipient_phone}")
+                    # Applied to the lead in batches by workers/dlr_worker.py
+                    if message.get('to'):
+                        try:
+                            await enqueue_dlr(message)
+                        except RedisError as e:
+                            print(f"[ERROR] Failed to enqueue DLR for {message.get('to')}: {e}")
+                            return Response(content="", media_type="text/plain", status_code=503)
 
                 # --- CASE 2: INCOMING MESSAGE ---
                 elif callback_type == 'incoming_message':
@@ -0,0 +1,93 @@
+# server/scripts/bench_html_parse.py
+"""
+Micro-benchmark for crawler HTML processing.
+
+Compares the previous ingest_worker implementation (clean_text,
+extract_links and extract_images each parsing the page with BeautifulSoup's
+html.parser) with utils.html_extract.parse_page on every backend available.
+
+Save some pages first (e.g. `curl -s https://example.com/ > pages/home.html`)
+and run from server/:
+
+    python -m scripts.bench_html_parse pages/ --repeat 5
+"""
+import argparse
+import glob
+import os
+import re
+import statistics
+import time
+from urllib.parse import urljoin, urlparse
+
+from utils.html_extract import HTML_BACKEND, parse_page
+
+
+def legacy_process(base_url: str, html: str):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    links = []
+    for tag in soup.find_all("a", href=True):
+        link = urljoin(base_url, tag["href"])
+        if urlparse(link).netloc == urlparse(base_url).netloc:
+            links.append(link)
+
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "noscript", "svg", "head", "meta", "link"]):
+        tag.decompose()
+    for img in soup.find_all("img"):
+        alt = img.get("alt", "").strip()
+        src = img.get("src", "")
+        img.replace_with(f"[Image: {alt} | {src}]" if alt else f"[Image: {src}]")
+    text = re.sub(r"\s+", " ", soup.get_text(separator=" ", strip=True))
+
+    soup = BeautifulSoup(html, "html.parser")
+    images = [urljoin(base_url, img["src"]) for img in soup.find_all("img", src=True)]
+    return text, links, images
+
+
+def _time(fn, pages, repeat):
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for url, html in pages:
+            fn(url, html)
+        runs.append((time.perf_counter() - started) / len(pages) * 1000)
+    return statistics.median(runs)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark crawler HTML processing")
+    parser.add_argument("corpus", help="Directory of saved .html pages")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--base-url", default="https://example.com/", help="URL the pages are resolved against")
+    args = parser.parse_args()
+
+    pages = []
+    for path in sorted(glob.glob(os.path.join(args.corpus, "**", "*.htm*"), recursive=True)):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            pages.append((args.base_url, f.read()))
+    if not pages:
+        raise SystemExit(f"No .html files under {args.corpus}")
+    size_kb = sum(len(html) for _, html in pages) / len(pages) / 1024
+    print(f"{len(pages)} pages, {size_kb:.0f} KiB average")
+
+    baseline = _time(legacy_process, pages, args.repeat)
+    print(f"{'legacy (3x html.parser)':<28} {baseline:8.2f} ms/page")
+    backends = ["html.parser"] + (["lxml"] if HTML_BACKEND == "lxml" else [])
+    for backend in backends:
+        ms = _time(lambda u, h: parse_page(u, h, backend=backend), pages, args.repeat)
+        print(f"{'parse_page (' + backend + ')':<28} {ms:8.2f} ms/page  {baseline / ms:5.1f}x")
+
+    # Output parity with the legacy implementation
+    mismatches = 0
+    for url, html in pages:
+        text, links, images = legacy_process(url, html)
+        page = parse_page(url, html)
+        if (page.links, page.images) != (links, images) or page.text != text:
+            mismatches += 1
+    print(f"parity: {len(pages) - mismatches}/{len(pages)} pages identical to legacy output")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# server/services/agent_tools.py
+"""
+Tool execution for the chat agent.
+
+TOOL_REGISTRY maps each tool name in utils.tool_schemas.TOOLS to an async
+handler and a timeout. `run_tool_calls` executes every call from one model
+turn concurrently and always returns one `tool` message per call: errors
+and timeouts are reported to the model as JSON instead of raising.
+"""
+import asyncio
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services.catalog_sync import CATALOG_KIND
+from services.rag import rag
+from services.rag_query_cache import filter_key
+from services.salesforce import SalesforceService
+from utils.sessions import remember_snippets
+from utils.universal_validator import universal_validator
+
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "15"))
+PNR_TOOL_TIMEOUT_SECONDS = float(os.getenv("PNR_TOOL_TIMEOUT_SECONDS", "25"))
+RAG_TOOL_K = 4
+# Fuse keyword (BM25) and vector rankings so SKU names, codes and prices match exactly
+RAG_HYBRID_SEARCH = os.getenv("RAG_HYBRID_SEARCH", "true").lower() == "true"
+
+
+@dataclass
+class ToolContext:
+    sender: str
+    tenant_id: Optional[int]
+    # find_rag_info results fetched in one batch for the current turn, by (query, filters)
+    rag_prefetch: Dict[Tuple[str, str], List[Dict[str, Any]]] = field(default_factory=dict)
+    # Fills rag_prefetch while the turn's other tools already run
+    rag_prefetch_task: Optional["asyncio.Task"] = None
+
+
+ToolHandler = Callable[[ToolContext, dict], Awaitable[str]]
+
+
+def _error(message: str) -> str:
+    return json.dumps({"error": message})
+
+
+def _rag_where(args: dict) -> Optional[dict]:
+    """Metadata filter for find_rag_info's optional catalog_only / language arguments."""
+    conditions = []
+    if args.get("catalog_only"):
+        conditions.append({"kind": CATALOG_KIND})
+    language = (args.get("language") or "").strip().lower()
+    if language:
+        conditions.append({"language": language})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+async def find_rag_info(ctx: ToolContext, args: dict) -> str:
+    query = args.get("query")
+    where = _rag_where(args)
+    print(f"[RAG TOOL] Query: {query} | Filter: {where}")
+    if not query:
+        return _error("Missing query. Ask the user what they are looking for.")
+
+    if ctx.rag_prefetch_task is not None:
+        # Shielded: one call timing out must not cancel the batch the others wait on
+        await asyncio.shield(ctx.rag_prefetch_task)
+    result = ctx.rag_prefetch.get((query, filter_key(where)))
+    if result is None:
+        search = rag.hybrid_search if RAG_HYBRID_SEARCH else rag.search
+        result = await search(tenant_id=ctx.tenant_id, query=query, k=RAG_TOOL_K, where=where)
+    if result:
+        # Keep the snippets with the session so follow-up turns can answer without a new search
+        await remember_snippets(ctx.sender, [r["text"] for r in result[:RAG_TOOL_K]])
+    return json.dumps(result)
+
+
+async def validate_items(ctx: ToolContext, args: dict) -> str:
+    items = args.get("items", [])
+    print(f"[UNIVERSAL VALIDATOR TOOL] Items: {items}")
+    if not items:
+        return _error("No items to validate.")
+    return await asyncio.to_thread(universal_validator, json.dumps(items))
+
+
+async def get_pnr_details(ctx: ToolContext, args: dict) -> str:
+    pnr_no = args.get("pnr_no")
+    passenger_name = (args.get("passenger_name") or "").strip()
+    print(f"[PNR TOOL] Checking PNR: {pnr_no} for Name: {passenger_name}")
+
+    if not pnr_no or not passenger_name:
+        return _error("Missing PNR or passenger name. Ask the user for their name before checking.")
+
+    try:
+        pnr_data = await SalesforceService().get_pnr_details(pnr=pnr_no)
+    except Exception as e:
+        # Catch API or 401/500 errors from Salesforce service
+        return _error(f"Failed to retrieve PNR: {str(e)}")
+
+    # Let the LLM do the fuzzy passenger-name match instead of hardcoded matching
+    return json.dumps({
+        "system_instruction_to_llm": (
+            f"Here is the data for PNR {pnr_no}. "
+            f"SECURITY CHECK: Evaluate if the user's provided name '{passenger_name}' roughly matches "
+            "any of the passengers' first or last names in the data below. "
+            "You should ignore minor spelling mistakes or typos. "
+            "If it is a reasonable match, answer the user's question using this data. "
+            "If the name does NOT match at all, DO NOT reveal any booking details. "
+            "Instead, politely inform the user that the name does not match the PNR records."
+        ),
+        "pnr_data": pnr_data,
+    })
+
+
+TOOL_REGISTRY: Dict[str, Tuple[ToolHandler, float]] = {
+    "find_rag_info": (find_rag_info, TOOL_TIMEOUT_SECONDS),
+    "universal_validator": (validate_items, TOOL_TIMEOUT_SECONDS),
+    "get_pnr_details": (get_pnr_details, PNR_TOOL_TIMEOUT_SECONDS),
+}
+
+
+async def _run_one(ctx: ToolContext, tool_call) -> dict:
+    name = tool_call.function.name
+    entry = TOOL_REGISTRY.get(name)
+    if entry is None:
+        content = _error("unknown_tool")
+    else:
+        handler, timeout = entry
+        try:
+            args = json.loads(tool_call.function.arguments or "{}")
+            content = await asyncio.wait_for(handler(ctx, args), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"[TOOLS] {name} timed out after {timeout}s")
+            content = _error(f"{name} timed out")
+        except Exception as e:
+            print(f"[TOOLS] {name} failed: {e}")
+            content = _error(f"{name} failed: {str(e)}")
+    return {"role": "tool", "tool_call_id": tool_call.id, "name": name, "content": content}
+
+
+async def _prefetch_rag(ctx: ToolContext, tool_calls) -> None:
+    """Resolve all find_rag_info queries of a turn with one batched search per filter."""
+    groups: Dict[str, Tuple[Optional[dict], List[str]]] = {}
+    for tc in tool_calls:
+        if tc.function.name != "find_rag_info":
+            continue
+        try:
+            args = json.loads(tc.function.arguments or "{}")
+        except ValueError:
+            continue
+        query, where = args.get("query"), _rag_where(args)
+        queries = groups.setdefault(filter_key(where), (where, []))[1]
+        if query and query not in queries:
+            queries.append(query)
+    if sum(len(queries) for _, queries in groups.values()) < 2:
+        return
+    search_many = rag.hybrid_search_many if RAG_HYBRID_SEARCH else rag.search_many
+    try:
+        batches = await asyncio.wait_for(
+            asyncio.gather(*(search_many(ctx.tenant_id, queries, k=RAG_TOOL_K, where=where)
+                             for where, queries in groups.values())),
+            timeout=TOOL_TIMEOUT_SECONDS,
+        )
+    except Exception as e:
+        # Each call falls back to its own search
+        print(f"[TOOLS] batched RAG search failed: {e}")
+        return
+    for (fkey, (_, queries)), results in zip(groups.items(), batches):
+        ctx.rag_prefetch.update(((q, fkey), r) for q, r in zip(queries, results))
+
+
+async def run_tool_calls(ctx: ToolContext, tool_calls) -> List[dict]:
+    """
+    Run one turn's tool calls concurrently; results keep the calls' order.
+    The batched RAG prefetch runs alongside them, so only find_rag_info waits for it.
+    """
+    ctx.rag_prefetch_task = asyncio.create_task(_prefetch_rag(ctx, tool_calls))
+    try:
+        return list(await asyncio.gather(*(_run_one(ctx, tc) for tc in tool_calls)))
+    finally:
+        ctx.rag_prefetch_task.cancel()
+        ctx.rag_prefetch_task = None
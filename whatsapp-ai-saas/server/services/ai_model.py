@@ -1,58 +1,104 @@
 import asyncio
 import json
+import os
 import re
+import time
 from fastapi.responses import Response
 from typing import Optional
 from services.rag import rag
-from services.llm import client
-from utils.gpt_helpers import extract_gpt_reply
-from utils.sessions import get_history, append_user, append_assistant
+from services.llm import client, stream_chat
+from services.metrics import first_response_seconds
+from utils.gpt_helpers import extract_gpt_reply, clean_reply_text
+from utils.prompt_cache import tenant_streams_replies
+from utils.reply_segmenter import ReplySegmenter
+from utils.sessions import get_history, get_snippets, append_user, append_assistant
+from utils.context_builder import build_context
 # LLM tool schema (LLM decides when to call)
 from utils.tool_schemas import TOOLS
 # External API call with hardcoded brandName
 # from app.services.tickets import (get_all_tickets, get_ticket_details, get_ticket_status_external, create_ticket_external)
-from services.exotel_api import send_reply_via_exotel_api
+from services.exotel_api import send_reply_via_exotel_api, send_chat_state
 from services.process_media import process_media_message
 #from utils.log import append_media_log, append_usage
-from routers.onboarding import get_tanant_id_from_receiver
-from utils.universal_validator import universal_validator
-from services.salesforce import SalesforceService
+from services.tenant_resolver import resolve_tenant_id
+from services.agent_tools import ToolContext, run_tool_calls
 
+MAX_TOOL_ROUNDS = int(os.getenv("MAX_TOOL_ROUNDS", "3"))
+# Cap on each agent completion, streamed or not; unset/0 leaves it to the model's default
+AGENT_MAX_TOKENS = int(os.getenv("AGENT_MAX_TOKENS", "0")) or None
+# Formatting guidance for replies composed from tool results
+TOOL_RESULT_STYLE = {
+    "role": "system",
+    "content": "Rewrite the tool results for the end user in the same language/style they used also add new line in proper formate,Use *single asterisk* for bold.Use relevant emojis in your responses to improve readability"
+}
 
-async def process_message_background(sender, receiver, user_input, content):
-    """Process the message in the background and send reply via Exotel API"""
-    try:
-        print(f"[BACKGROUND] Processing message from {sender}: {user_input}")
-        
-        # Your existing message processing logic here
-        # Ensure session exists / not expired
-        tenant_id = get_tanant_id_from_receiver(receiver)
-        get_history(sender,tenant_id)
-        
-        # Handle media content if needed
-        content_type = content.get('type', '')
-        if content_type in ['image', 'audio']:
-            # Extract media URL and process accordingly
-            media_url = None
-            if content_type == 'image':
-                image_data = content.get('image', {})
-                media_url = image_data.get('url', '') or image_data.get('link', '')
-                #asyncio.create_task(append_media_log(sender, media_url, content_type))
-            elif content_type == 'audio':
-                audio_data = content.get('audio', {})
-                media_url = audio_data.get('url', '') or audio_data.get('link', '')
-                #asyncio.create_task(append_media_log(sender, media_url, content_type))
 
-            if media_url:
-                await process_media_message(sender, content_type, media_url, user_input)
-            else:
-                await append_user(sender, user_input or "Hi")
+async def process_message(sender, receiver, user_input, content):
+    """
+    Run the AI pipeline for one inbound message and send the reply via Exotel.
+    Errors propagate so the stream worker can leave the entry pending for retry.
+    """
+    print(f"[BACKGROUND] Processing message from {sender}: {user_input}")
+    started = time.monotonic()
+
+    tenant_id = await resolve_tenant_id(receiver)
+    if tenant_id is None:
+        print(f"[BACKGROUND] Dropping message from {sender}: receiver {receiver} has no tenant")
+        return None
+
+    # Ensure session exists / not expired
+    await get_history(sender,tenant_id)
+
+    # Handle media content if needed
+    content_type = content.get('type', '')
+    if content_type in ['image', 'audio']:
+        # Extract media URL and process accordingly
+        media_url = None
+        if content_type == 'image':
+            image_data = content.get('image', {})
+            media_url = image_data.get('url', '') or image_data.get('link', '')
+            #asyncio.create_task(append_media_log(sender, media_url, content_type))
+        elif content_type == 'audio':
+            audio_data = content.get('audio', {})
+            media_url = audio_data.get('url', '') or audio_data.get('link', '')
+            #asyncio.create_task(append_media_log(sender, media_url, content_type))
+
+        if media_url:
+            await process_media_message(sender, content_type, media_url, user_input)
         else:
             await append_user(sender, user_input or "Hi")
+    else:
+        await append_user(sender, user_input or "Hi")
 
+    if not tenant_streams_replies(tenant_id):
         # Call intelligence model to get AI response
         ai_reply = await intelligence_model(sender,tenant_id)
-        send_reply_via_exotel_api(receiver, sender, ai_reply)
+        await send_reply_via_exotel_api(receiver, sender, ai_reply)
+        first_response_seconds.observe(time.monotonic() - started)
+        return ai_reply
+
+    # Streaming: each completed segment is sent while the rest is generating
+    await send_chat_state(receiver, sender, "typing")
+    segments_sent = 0
+
+    async def deliver(segment):
+        nonlocal segments_sent
+        if segments_sent == 0:
+            first_response_seconds.observe(time.monotonic() - started)
+        segments_sent += 1
+        await send_reply_via_exotel_api(receiver, sender, segment)
+
+    ai_reply = await intelligence_model(sender, tenant_id, on_segment=deliver)
+    if segments_sent == 0 and ai_reply:
+        # Nothing was streamed (fallback or error reply)
+        await deliver(ai_reply)
+    return ai_reply
+
+
+async def process_message_background(sender, receiver, user_input, content):
+    """Process the message in the background and send reply via Exotel API"""
+    try:
+        await process_message(sender, receiver, user_input, content)
         return Response(content='', media_type="text/plain", status_code=200)
         
     except Exception as e:
@@ -94,150 +140,69 @@ async def process_message_background(sender, receiver, user_input, content):
 #         return error_reply
 
 
-async def intelligence_model(sender,tenant_id):
-    try:
-        decision =await client.chat.completions.create(
-            model="gpt-4o",
-            temperature=0.2,
-            tools=TOOLS,
-            tool_choice="auto",
-            messages=get_history(sender,tenant_id),
-        )
+async def intelligence_model(sender,tenant_id, on_segment=None):
+    """
+    Ask the model for a reply, running any tool calls it makes and feeding the
+    results back until it answers in text (at most MAX_TOOL_ROUNDS tool turns).
 
-        choice = decision.choices[0]
-        tool_calls = getattr(choice.message, "tool_calls", None)
-        usage = getattr(decision, "usage", None)
-        #asyncio.create_task(append_usage(sender, usage.total_tokens, "token"))
-        if tool_calls:
-            tool_msgs = []
-            for tc in tool_calls:
-                name = tc.function.name
-                args = json.loads(tc.function.arguments or "{}")
+    With `on_segment`, completions are streamed and each finished segment of
+    the reply is awaited through it as soon as it is complete.
+    """
+    try:
+        ctx = ToolContext(sender=sender, tenant_id=tenant_id)
+        # Bounded prompt: system prompt + session snippets + the recent turns that fit
+        messages = build_context(await get_history(sender,tenant_id), await get_snippets(sender))
+        segmenter = None
+        if on_segment is not None:
+            async def send_segment(segment):
+                segment = clean_reply_text(segment)
+                if segment:
+                    await on_segment(segment)
+            segmenter = ReplySegmenter(send_segment)
 
-                # derive phone number from WhatsApp sender (digits only)
-                phone_number = re.sub(r"\D", "", sender) if sender else ""
-                phone_number = phone_number[-10:] if len(phone_number) >= 10 else phone_number
-                
-                if name == "find_rag_info":
-                    query = args.get("query")
-                    print(f"[RAG TOOL] Query: {query}")
-                    if not query:
-                        ai_reply = extract_gpt_reply(choice) or (
-                                "I can help you with your query. Could you tell me more?"
-                            )
-                        append_assistant(sender, ai_reply)
-                        return ai_reply
+        ai_reply = ""
+        for round_no in range(MAX_TOOL_ROUNDS + 1):
+            # Out of tool rounds: make the model answer with what it has
+            allow_tools = round_no < MAX_TOOL_ROUNDS
+            if segmenter is not None:
+                turn = await stream_chat(
+                    messages,
+                    segmenter.feed,
+                    provider="openai",
+                    model="gpt-4o",
+                    temperature=0.2,
+                    max_tokens=AGENT_MAX_TOKENS,
+                    tools=TOOLS,
+                    tool_choice="auto" if allow_tools else "none",
+                )
+                # Send text the model wrote before (or instead of) calling tools
+                await segmenter.flush()
+                tool_calls, text, assistant_msg = turn.tool_calls, turn.text, turn.assistant_message()
+            else:
+                decision = await client.chat.completions.create(
+                    model="gpt-4o",
+                    temperature=0.2,
+                    **({"max_tokens": AGENT_MAX_TOKENS} if AGENT_MAX_TOKENS else {}),
+                    tools=TOOLS,
+                    tool_choice="auto" if allow_tools else "none",
+                    messages=messages,
+                )
+                choice = decision.choices[0]
+                usage = getattr(decision, "usage", None)
+                #asyncio.create_task(append_usage(sender, usage.total_tokens, "token"))
+                tool_calls, text, assistant_msg = getattr(choice.message, "tool_calls", None), extract_gpt_reply(choice), choice.message
+            if not tool_calls:
+                ai_reply = clean_reply_text(text)
+                break
 
-                    # Call your external API
-                    rag_context = ""
-                    result = await rag.search(tenant_id=tenant_id, query=query, k=4)
-                    if result:
-                        snippets = [
-                                f"• {r['text']}" for r in result[:4]
-                            ]
-                        rag_context = "\n".join(snippets)
-                    get_history(sender,tenant_id).append({"role": "system", "content": rag_context})  
-                    tool_msgs.append({
-                        "role": "tool",
-                        "tool_call_id": tc.id,
-                        "name": name,
-                        "content": json.dumps(result)
-                    })
-                elif name == "universal_validator":
-                    items = args.get("items", [])
-                    print(f"[UNIVERSAL VALIDATOR TOOL] Items: {items}")
-                    if not items:
-                        ai_reply = extract_gpt_reply(choice) or (
-                                "I can help you with your query. Could you tell me more?"
-                            )
-                        append_assistant(sender, ai_reply)
-                        return ai_reply
+            print(f"[BACKGROUND] Tool round {round_no + 1}: {[tc.function.name for tc in tool_calls]}")
+            tool_msgs = await run_tool_calls(ctx, tool_calls)
+            messages = messages + [assistant_msg] + tool_msgs + ([TOOL_RESULT_STYLE] if round_no == 0 else [])
 
-                    result = universal_validator(json.dumps(items))
-                    tool_msgs.append({
-                        "role": "tool",
-                        "tool_call_id": tc.id,
-                        "name": name,
-                        "content": result
-                    })
-                # --- New PNR Handler ---
-                elif name == "get_pnr_details":
-                    pnr_no = args.get("pnr_no")
-                    passenger_name = args.get("passenger_name", "").strip()
-                    print(f"[PNR TOOL] Checking PNR: {pnr_no} for Name: {passenger_name}")
-                    
-                    if not pnr_no or not passenger_name:
-                        tool_msgs.append({
-                            "role": "tool",
-                            "tool_call_id": tc.id,
-                            "name": name,
-                            "content": json.dumps({"error": "Missing PNR or passenger name. Ask the user for their name before checking."})
-                        })
-                    else:
-                        try:
-                            # Fetch data using the Salesforce Service without hardcoded python name matching
-                            service = SalesforceService()
-                            pnr_data = await service.get_pnr_details(pnr=pnr_no)
-                            
-                            # Wrap the response with instructions for the LLM to do fuzzy name matching
-                            wrapped_response = {
-                                "system_instruction_to_llm": (
-                                    f"Here is the data for PNR {pnr_no}. "
-                                    f"SECURITY CHECK: Evaluate if the user's provided name '{passenger_name}' roughly matches "
-                                    "any of the passengers' first or last names in the data below. "
-                                    "You should ignore minor spelling mistakes or typos. "
-                                    "If it is a reasonable match, answer the user's question using this data. "
-                                    "If the name does NOT match at all, DO NOT reveal any booking details. "
-                                    "Instead, politely inform the user that the name does not match the PNR records."
-                                ),
-                                "pnr_data": pnr_data
-                            }
-                            
-                            tool_msgs.append({
-                                "role": "tool",
-                                "tool_call_id": tc.id,
-                                "name": name,
-                                "content": json.dumps(wrapped_response)
-                            })
-                            
-                        except Exception as e:
-                            # Catch API or 401/500 errors from Salesforce service
-                            tool_msgs.append({
-                                "role": "tool",
-                                "tool_call_id": tc.id,
-                                "name": name,
-                                "content": json.dumps({"error": f"Failed to retrieve PNR: {str(e)}"})
-                            })
-                                 
-                else:
-                    tool_msgs.append({
-                        "role": "tool",
-                        "tool_call_id": tc.id,
-                        "name": name,
-                        "content": json.dumps({"error": "unknown_tool"})
-                    })
-                    
-            # Refinement pass
-            refined =await client.chat.completions.create(
-                model="gpt-4o",
-                temperature=0.2,
-                messages=get_history(sender) + [choice.message] + tool_msgs + [{
-                    "role": "system",
-                    "content": "Rewrite the tool results for the end user in the same language/style they used also add new line in proper formate,Use *single asterisk* for bold.Use relevant emojis in your responses to improve readability"
-                }],
-            )
-            usage = getattr(refined, "usage", None)
-            # asyncio.create_task(append_usage(sender, usage.total_tokens, "token"))
-            print(f"[BACKGROUND] Refinement usage: {usage.total_tokens}")
-            ai_reply = extract_gpt_reply(refined.choices[0])
-        else:
-            # No tool call: just use the model's text reply
-            ai_reply = extract_gpt_reply(choice) or (
-                "I can help you with your query. Could you tell me more?"
-            )
+        ai_reply = ai_reply or "I can help you with your query. Could you tell me more?"
 
         # Save assistant reply to history
-        append_assistant(sender, ai_reply)
+        await append_assistant(sender, ai_reply)
         print(f"[BACKGROUND] AI Reply: {ai_reply!r}")
         return ai_reply
         
@@ -0,0 +1,301 @@
+# server/services/campaign_dispatch.py
+"""
+Campaign dispatch engine.
+
+Streams a campaign's pending leads in keyset-paginated batches and sends
+each batch with CAMPAIGN_CONCURRENCY concurrent Exotel requests. Every send
+first takes a token from a Redis token bucket keyed by the sender number,
+so all campaigns (in any process) that share a WhatsApp number stay under
+CAMPAIGN_SEND_RATE messages/second together. Lead and recipient statuses
+are written back with one UPDATE per batch.
+
+Pausing sets a Redis flag (see `set_campaign_paused`) that the run polls
+every CAMPAIGN_PAUSE_POLL_S seconds; unsent leads keep their status and are
+picked up when the campaign is started again. A start that arrives while the
+paused run is still finishing its batch finds the run lock held and returns;
+the paused run re-checks the flag after releasing the lock and carries on
+dispatching in its place.
+"""
+import asyncio
+import os
+import re
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from deps import SessionLocal
+from models import BusinessProfile, Campaign, Template
+from services.exotel_api import send_template_with_media
+from services.metrics import campaign_sends_total
+from utils.redis_client import get_async_redis, get_sync_redis
+
+CAMPAIGN_BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", "500"))
+CAMPAIGN_CONCURRENCY = int(os.getenv("CAMPAIGN_CONCURRENCY", "50"))
+# Messages/second allowed per sender number, and the burst the bucket can hold
+CAMPAIGN_SEND_RATE = float(os.getenv("CAMPAIGN_SEND_RATE", "50"))
+CAMPAIGN_SEND_BURST = int(os.getenv("CAMPAIGN_SEND_BURST", "50"))
+CAMPAIGN_PAUSE_POLL_S = float(os.getenv("CAMPAIGN_PAUSE_POLL_S", "1"))
+DEFAULT_SENDER_NUMBER = os.getenv("CAMPAIGN_DEFAULT_SENDER", "918448690360")
+
+# A run holds this lock so a quick pause/start cannot start a second sender for the same leads
+CAMPAIGN_LOCK_TTL = int(os.getenv("CAMPAIGN_LOCK_TTL", "600"))
+
+PAUSE_KEY = "wa_campaign_paused:{}"
+RUN_LOCK_KEY = "wa_campaign_running:{}"
+BUCKET_KEY = "wa_send_bucket:{}"
+
+# Release / extend the run lock only while it still holds this run's token
+_LOCK_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+_LOCK_EXTEND_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Returns 0 when a token was taken, otherwise the milliseconds until one is available
+_TOKEN_BUCKET_LUA = """
+redis.replicate_commands()
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return wait
+"""
+
+
+def set_campaign_paused(campaign_id: int, paused: bool) -> None:
+    """Raise or clear the pause flag a running dispatch polls."""
+    r = get_sync_redis()
+    if paused:
+        r.set(PAUSE_KEY.format(campaign_id), "1")
+    else:
+        r.delete(PAUSE_KEY.format(campaign_id))
+
+
+class SenderRateLimiter:
+    """Redis token bucket per sender number, shared across processes."""
+
+    def __init__(self, rate: float = CAMPAIGN_SEND_RATE, burst: int = CAMPAIGN_SEND_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._script = get_async_redis().register_script(_TOKEN_BUCKET_LUA)
+
+    async def acquire(self, sender_number: str) -> None:
+        key = BUCKET_KEY.format(sender_number)
+        while True:
+            wait_ms = await self._script(keys=[key], args=[self.rate, self.burst])
+            if not wait_ms:
+                return
+            await asyncio.sleep(int(wait_ms) / 1000)
+
+
+@dataclass
+class CampaignPlan:
+    campaign_id: int
+    sender_number: str
+    default_pitch: Optional[str]
+    template_body: str
+    template_name: Optional[str]
+    media_url: Optional[str]
+    media_type: Optional[str]
+    language: str
+
+
+def _load_plan(campaign_id: int) -> Optional[CampaignPlan]:
+    db = SessionLocal()
+    try:
+        campaign = db.query(Campaign).filter(Campaign.id == campaign_id).first()
+        if not campaign or campaign.status not in ["Running", "Created"]: # Allow running from Created if immediate
+            return None
+        tmpl = db.query(Template).filter(Template.id == campaign.template_id).first() if campaign.template_id else None
+        profile = db.query(BusinessProfile).filter(BusinessProfile.tenant_id == campaign.tenant_id).first()
+        return CampaignPlan(
+            campaign_id=campaign.id,
+            sender_number=profile.business_whatsapp if profile else DEFAULT_SENDER_NUMBER,
+            default_pitch=campaign.default_pitch,
+            template_body=(tmpl.body if tmpl else "") or "",
+            template_name=tmpl.name if tmpl else None,
+            media_url=tmpl.media_link if tmpl else None,
+            media_type=tmpl.media_type if tmpl else None,
+            language=tmpl.language if tmpl else "en",
+        )
+    finally:
+        db.close()
+
+
+def _fetch_batch(campaign_id: int, after_id: int, limit: int) -> List[Tuple[int, str, Optional[str]]]:
+    db = SessionLocal()
+    try:
+        rows = db.execute(text("""
+            SELECT id, phone, name FROM leads
+            WHERE campaign_id = :cid AND status IN ('New', 'Pending') AND id > :after
+            ORDER BY id
+            LIMIT :limit
+        """), {"cid": campaign_id, "after": after_id, "limit": limit}).all()
+        return [(r.id, r.phone, r.name) for r in rows]
+    finally:
+        db.close()
+
+
+def _write_results(plan: CampaignPlan, results: List[Tuple[int, str, str]]) -> None:
+    """One UPDATE ... FROM (VALUES ...) for the batch's leads, one for their recipients."""
+    if not results:
+        return
+    params: Dict[str, object] = {"pitch": plan.default_pitch}
+    values = []
+    for i, (lead_id, status, summary) in enumerate(results):
+        values.append(f"(CAST(:id{i} AS BIGINT), :st{i}, :su{i})")
+        params.update({f"id{i}": lead_id, f"st{i}": status, f"su{i}": summary})
+    sent_ids = [lead_id for lead_id, status, _ in results if status == "Sent"]
+
+    db = SessionLocal()
+    try:
+        db.execute(text(f"""
+            UPDATE leads AS l
+            SET status = v.status,
+                summary = v.summary,
+                pitch = COALESCE(NULLIF(l.pitch, ''), :pitch),
+                updated_at = now()
+            FROM (VALUES {", ".join(values)}) AS v(id, status, summary)
+            WHERE l.id = v.id
+        """), params)
+        if sent_ids:
+            db.execute(text("""
+                UPDATE campaign_recipients
+                SET send_status = 'Sent', send_at = :now
+                WHERE campaign_id = :cid AND lead_id = ANY(:ids)
+            """), {"now": datetime.now(timezone.utc), "cid": plan.campaign_id, "ids": sent_ids})
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _finish(campaign_id: int) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(text("""
+            UPDATE campaigns SET status = 'Completed', updated_at = now()
+            WHERE id = :cid AND status IN ('Running', 'Created')
+        """), {"cid": campaign_id})
+        db.commit()
+    finally:
+        db.close()
+
+
+class CampaignDispatcher:
+    def __init__(self, limiter: Optional[SenderRateLimiter] = None, concurrency: int = CAMPAIGN_CONCURRENCY):
+        self.limiter = limiter or SenderRateLimiter()
+        self.concurrency = concurrency
+
+    async def _send_one(self, plan: CampaignPlan, lead: Tuple[int, str, Optional[str]]) -> Tuple[int, str, str]:
+        lead_id, phone, name = lead
+        if not plan.template_body:
+            return lead_id, "Failed", "Error: No content available template"
+        try:
+            cust_name = name if name else "Sir/Madam"
+            body = plan.template_body.replace("{{name}}", f"{{{{{cust_name}}}}}")
+            body_params = re.findall(r'\{\{([^}]*)\}\}', body)
+            await self.limiter.acquire(plan.sender_number)
+            success = await send_template_with_media(
+                to_number=phone,
+                from_number=plan.sender_number,
+                template_name=plan.template_name,
+                media_url=plan.media_url,
+                body_params=body_params,
+                language=plan.language,
+                media_type=plan.media_type,
+            )
+            if success:
+                campaign_sends_total.labels(campaign_id=str(plan.campaign_id), template=plan.template_name or "").inc()
+                return lead_id, "Sent", f"Template Message: {body}..."
+            return lead_id, "Failed", ""
+        except Exception as e:
+            return lead_id, "Failed", f"Exception: {str(e)}"
+
+    async def run(self, campaign_id: int) -> Dict[str, int]:
+        """Send every pending lead of a Running campaign; returns sent/failed counts."""
+        counts = {"sent": 0, "failed": 0}
+        r = get_async_redis()
+        while True:
+            paused = await self._run_once(r, campaign_id, counts)
+            # Started again while this run was finishing its last batch: that start
+            # saw our lock and returned, so keep dispatching on its behalf
+            if not paused or await r.exists(PAUSE_KEY.format(campaign_id)):
+                return counts
+            print(f"[CAMPAIGN {campaign_id}] resumed while pausing; continuing")
+
+    async def _run_once(self, r, campaign_id: int, counts: Dict[str, int]) -> bool:
+        """One locked dispatch pass; returns True if it stopped because of a pause."""
+        plan = await asyncio.to_thread(_load_plan, campaign_id)
+        if plan is None:
+            return False
+
+        lock_key = RUN_LOCK_KEY.format(campaign_id)
+        token = uuid.uuid4().hex
+        if not await r.set(lock_key, token, nx=True, ex=CAMPAIGN_LOCK_TTL):
+            print(f"[CAMPAIGN {campaign_id}] already being dispatched; skipping")
+            return False
+        release = r.register_script(_LOCK_RELEASE_LUA)
+        extend = r.register_script(_LOCK_EXTEND_LUA)
+        paused = asyncio.Event()
+
+        async def watch_pause():
+            while not paused.is_set():
+                if await r.exists(PAUSE_KEY.format(campaign_id)):
+                    paused.set()
+                    return
+                await asyncio.sleep(CAMPAIGN_PAUSE_POLL_S)
+
+        watcher = asyncio.create_task(watch_pause())
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def guarded(lead):
+            async with semaphore:
+                if paused.is_set():
+                    return None
+                return await self._send_one(plan, lead)
+
+        try:
+            after_id = 0
+            while not paused.is_set():
+                batch = await asyncio.to_thread(_fetch_batch, campaign_id, after_id, CAMPAIGN_BATCH_SIZE)
+                if not batch:
+                    await asyncio.to_thread(_finish, campaign_id)
+                    break
+                after_id = batch[-1][0]
+                await extend(keys=[lock_key], args=[token, CAMPAIGN_LOCK_TTL])
+                results = [res for res in await asyncio.gather(*(guarded(lead) for lead in batch)) if res]
+                await asyncio.to_thread(_write_results, plan, results)
+                for _, status, _ in results:
+                    counts["sent" if status == "Sent" else "failed"] += 1
+                print(f"[CAMPAIGN {campaign_id}] batch up to lead {after_id}: {counts}")
+        finally:
+            watcher.cancel()
+            await release(keys=[lock_key], args=[token])
+
+        print(f"[CAMPAIGN {campaign_id}] {'paused' if paused.is_set() else 'finished'}: {counts}")
+        return paused.is_set()
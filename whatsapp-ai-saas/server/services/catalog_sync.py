@@ -0,0 +1,151 @@
+# server/services/catalog_sync.py
+"""
+Incremental BusinessCatalog → RAG sync.
+
+Each catalog row is stored in the tenant collection under its id with a
+`fingerprint` (updated_at + hash of the rendered text) in its metadata.
+A sync compares fingerprints and only upserts rows whose fingerprint
+changed, and deletes vectors of rows that no longer exist, so the embedding
+and write cost follows the size of the change rather than the catalog.
+
+The catalog router calls `sync_catalog(tenant_id, item_ids)` /
+`remove_catalog_items` after each write; `sync_catalog(tenant_id)` without
+ids reconciles the whole catalog (onboarding, /rag/add_catalog). Vectors
+written by the old full re-index carry the row id but no `kind`; the full
+sync treats them as stored without a fingerprint, so live rows are rewritten
+with the current metadata and rows deleted since are removed.
+These functions are blocking; run them in a thread or as a sync
+BackgroundTask.
+"""
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from database import SessionLocal
+from models import BusinessCatalog
+from services.rag import rag
+
+CATALOG_KIND = "catalog"
+CATALOG_SYNC_BATCH = int(os.getenv("CATALOG_SYNC_BATCH", "500"))
+
+
+@dataclass
+class CatalogSyncResult:
+    upserted: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+
+
+def catalog_text(catalog: BusinessCatalog) -> str:
+    return (
+        f"Name: {catalog.name}\n"
+        f"Description: {catalog.description or 'Not available'}\n"
+        f"Category: {catalog.category or 'Uncategorized'}\n"
+        f"Type: {catalog.item_type or 'Unknown'}\n"
+        f"Price: {catalog.price if catalog.price is not None else 'N/A'} {catalog.currency or 'USD'}\n"
+        f"Discount: {catalog.discount if catalog.discount is not None else '0%'}\n"
+        f"Source URL: {catalog.source_url or 'N/A'}\n"
+        f"Image URL: {catalog.image_url or 'N/A'}\n"
+        f"Created: {catalog.created_at.strftime('%Y-%m-%d %H:%M') if catalog.created_at else 'Unknown'}\n"
+        f"Updated: {catalog.updated_at.strftime('%Y-%m-%d %H:%M') if catalog.updated_at else 'Unknown'}"
+    )
+
+
+def catalog_fingerprint(catalog: BusinessCatalog, text: str) -> str:
+    updated = catalog.updated_at.isoformat() if catalog.updated_at else ""
+    return f"{updated}:{hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}"
+
+
+def _catalog_metadata(catalog: BusinessCatalog, fingerprint: str) -> Dict[str, object]:
+    return {
+        "kind": CATALOG_KIND,
+        "catalog_id": catalog.id,
+        "fingerprint": fingerprint,
+        "source_url": catalog.source_url or "",
+        "version": "1.0",
+        "language": "en",
+    }
+
+
+def _load_rows(tenant_id: int, item_ids: Optional[List[int]]) -> List[BusinessCatalog]:
+    db = SessionLocal()
+    try:
+        q = db.query(BusinessCatalog).filter(BusinessCatalog.tenant_id == tenant_id)
+        if item_ids is not None:
+            q = q.filter(BusinessCatalog.id.in_(item_ids))
+        return q.all()
+    finally:
+        db.close()
+
+
+def _legacy_catalog_ids(part) -> List[str]:
+    """Catalog vectors from before the incremental sync: row id, version "1.0", no `kind`."""
+    existing = part.get(where={"version": "1.0"}, include=["metadatas"])
+    return [
+        doc_id
+        for doc_id, meta in zip(existing.get("ids") or [], existing.get("metadatas") or [])
+        if doc_id.isdigit() and "kind" not in (meta or {})
+    ]
+
+
+def _stored_fingerprints(part, item_ids: Optional[List[int]]) -> Dict[str, Optional[str]]:
+    if item_ids is not None:
+        existing = part.get(ids=[str(i) for i in item_ids], include=["metadatas"])
+    else:
+        existing = part.get(where={"kind": CATALOG_KIND}, include=["metadatas"])
+    stored = {
+        doc_id: (meta or {}).get("fingerprint")
+        for doc_id, meta in zip(existing.get("ids") or [], existing.get("metadatas") or [])
+    }
+    if item_ids is None:
+        for doc_id in _legacy_catalog_ids(part):
+            stored.setdefault(doc_id, None)
+    return stored
+
+
+def sync_catalog(tenant_id: int, item_ids: Optional[Iterable[int]] = None) -> CatalogSyncResult:
+    """
+    Reconcile the tenant's catalog vectors with business_catalog.
+    With `item_ids`, only those rows are checked (ids that no longer exist are deleted).
+    """
+    item_ids = [int(i) for i in item_ids] if item_ids is not None else None
+    result = CatalogSyncResult()
+    if item_ids == []:
+        return result
+
+    rows = _load_rows(tenant_id, item_ids)
+    part = rag._partition(tenant_id, write=True)
+    stored = _stored_fingerprints(part, item_ids)
+
+    ids, texts, metadatas = [], [], []
+    for row in rows:
+        text = catalog_text(row)
+        fingerprint = catalog_fingerprint(row, text)
+        if stored.get(str(row.id)) == fingerprint:
+            result.unchanged += 1
+            continue
+        ids.append(str(row.id))
+        texts.append(text)
+        metadatas.append(_catalog_metadata(row, fingerprint))
+
+    for i in range(0, len(ids), CATALOG_SYNC_BATCH):
+        rag._upsert(part, ids[i:i + CATALOG_SYNC_BATCH], texts[i:i + CATALOG_SYNC_BATCH], metadatas[i:i + CATALOG_SYNC_BATCH])
+    result.upserted = len(ids)
+
+    live = {str(row.id) for row in rows}
+    removed = [doc_id for doc_id in stored if doc_id not in live]
+    if removed:
+        rag._delete(part, removed)
+    result.deleted = len(removed)
+
+    print(f"[CATALOG SYNC] tenant={tenant_id} upserted={result.upserted} "
+          f"deleted={result.deleted} unchanged={result.unchanged}")
+    return result
+
+
+def remove_catalog_items(tenant_id: int, item_ids: Iterable[int]) -> None:
+    """Drop the vectors of deleted catalog rows."""
+    ids = [str(i) for i in item_ids]
+    if ids:
+        rag._delete(rag._partition(tenant_id, write=True), ids)
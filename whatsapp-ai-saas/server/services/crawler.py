@@ -0,0 +1,306 @@
+# server/services/crawler.py
+"""
+Concurrent same-site crawler used by workers/ingest_worker.py.
+
+- BrowserPool: one long-lived headless Chromium with CRAWL_CONCURRENCY
+  reusable pages, instead of a new browser process per URL.
+- Crawler: an asyncio frontier of canonicalised URLs (seen-set behind a
+  Bloom filter) drained by CRAWL_CONCURRENCY fetchers, with at most one
+  request start per CRAWL_DOMAIN_DELAY seconds per host. Fetched pages go
+  through `process` (parse: text + links) and then `extract` (LLM) in
+  separate stages, so page N is being extracted while N+1..N+k download.
+"""
+import asyncio
+import hashlib
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "6"))
+CRAWL_EXTRACT_CONCURRENCY = int(os.getenv("CRAWL_EXTRACT_CONCURRENCY", "4"))
+# Minimum gap between two request starts to the same host
+CRAWL_DOMAIN_DELAY = float(os.getenv("CRAWL_DOMAIN_DELAY", "0.25"))
+CRAWL_PAGE_TIMEOUT_MS = int(os.getenv("CRAWL_PAGE_TIMEOUT_MS", "30000"))
+
+_TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "yclid", "mc_cid", "mc_eid", "ref", "_ga"}
+_SKIP_EXTENSIONS = (
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".svg", ".ico", ".pdf", ".zip", ".mp4", ".mp3",
+    ".css", ".js", ".xml", ".json", ".woff", ".woff2", ".ttf",
+)
+
+
+def canonicalize_url(url: str) -> Optional[str]:
+    """
+    Normalised form used for de-duplication: lower-case scheme/host, no
+    default port, fragment or tracking parameters, sorted query, and no
+    trailing slash except on the root. None for non-HTTP(S) links.
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https") or not parts.hostname:
+        return None
+    host = parts.hostname.lower()
+    port = parts.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    path = parts.path or "/"
+    if len(path) > 1 and path.endswith("/"):
+        path = path.rstrip("/") or "/"
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in _TRACKING_PARAMS
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def crawlable(url: str) -> bool:
+    return not urlsplit(url).path.lower().endswith(_SKIP_EXTENSIONS)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing of one blake2b digest)."""
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.001):
+        import math
+
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class SeenURLs:
+    """Exact seen-set with a Bloom filter in front, so most new URLs skip the set lookup."""
+
+    def __init__(self, capacity: int = 100_000):
+        self._bloom = BloomFilter(capacity)
+        self._urls = set()
+
+    def add(self, url: str) -> bool:
+        """Record `url`; False if it was already seen."""
+        if url in self._bloom and url in self._urls:
+            return False
+        self._bloom.add(url)
+        self._urls.add(url)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._urls)
+
+
+class BrowserPool:
+    """One Chromium process with `size` reusable pages, started on first fetch."""
+
+    def __init__(self, size: int = CRAWL_CONCURRENCY):
+        self.size = size
+        self._playwright = None
+        self._browser = None
+        self._pages: Optional[asyncio.Queue] = None
+        self._start_lock = asyncio.Lock()
+
+    async def _start(self) -> None:
+        from playwright.async_api import async_playwright
+
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(
+            headless=True,
+            args=[
+                "--no-sandbox",
+                "--disable-setuid-sandbox",
+                "--disable-dev-shm-usage",
+                "--disable-gpu",
+            ]
+        )
+        context = await self._browser.new_context()
+        # Images, fonts and media are not needed to read the DOM
+        await context.route(
+            "**/*",
+            lambda route: route.abort()
+            if route.request.resource_type in ("image", "font", "media")
+            else route.continue_(),
+        )
+        self._pages = asyncio.Queue()
+        for _ in range(self.size):
+            self._pages.put_nowait(await context.new_page())
+        print(f"[CRAWLER] browser started with {self.size} pages")
+
+    async def fetch(self, url: str) -> str:
+        async with self._start_lock:
+            if self._browser is None or not self._browser.is_connected():
+                await self._start()
+        page = await self._pages.get()
+        try:
+            # DOM is enough; networkidle waits on analytics/long-polling for seconds
+            await page.goto(url, wait_until="domcontentloaded", timeout=CRAWL_PAGE_TIMEOUT_MS)
+            try:
+                await page.wait_for_load_state("networkidle", timeout=3000)
+            except Exception:
+                pass
+            return await page.content()
+        except Exception:
+            # A crashed or wedged page is replaced instead of being handed out again
+            try:
+                context = page.context
+                if not page.is_closed():
+                    await page.close()
+                page = await context.new_page()
+            except Exception as e:
+                print(f"[CRAWLER] could not replace page: {e}")
+            raise
+        finally:
+            self._pages.put_nowait(page)
+
+    async def close(self) -> None:
+        async with self._start_lock:
+            if self._browser is not None:
+                await self._browser.close()
+            if self._playwright is not None:
+                await self._playwright.stop()
+            self._browser = self._playwright = self._pages = None
+
+
+_browser_pool: Optional[BrowserPool] = None
+
+
+def get_browser_pool() -> BrowserPool:
+    global _browser_pool
+    if _browser_pool is None:
+        _browser_pool = BrowserPool()
+    return _browser_pool
+
+
+@dataclass
+class CrawledPage:
+    url: str
+    html: str
+    text: str = ""
+    links: List[str] = field(default_factory=list)
+    data: Dict[str, Any] = field(default_factory=dict)
+
+
+class Crawler:
+    """
+    Crawl from `start_url` within its host.
+
+    fetch(url) -> html; process(page) fills page.text/page.links (sync, run in
+    a thread); extract(page) -> list of results. The crawl stops after
+    `max_pages` pages or once `stop_after` results were extracted.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Awaitable[str]],
+        process: Callable[[CrawledPage], None],
+        extract: Callable[[CrawledPage], Awaitable[List[Any]]],
+        max_pages: int = 100,
+        stop_after: Optional[int] = None,
+        concurrency: int = CRAWL_CONCURRENCY,
+        extract_concurrency: int = CRAWL_EXTRACT_CONCURRENCY,
+        domain_delay: float = CRAWL_DOMAIN_DELAY,
+    ):
+        self.fetch = fetch
+        self.process = process
+        self.extract = extract
+        self.max_pages = max_pages
+        self.stop_after = stop_after
+        self.concurrency = concurrency
+        self.extract_concurrency = extract_concurrency
+        self.domain_delay = domain_delay
+        self._next_slot: Dict[str, float] = {}
+        self._slot_lock = asyncio.Lock()
+
+    async def _polite(self, url: str) -> None:
+        host = urlsplit(url).netloc
+        async with self._slot_lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = start + self.domain_delay
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def run(self, start_url: str) -> List[Any]:
+        start = canonicalize_url(start_url)
+        if not start:
+            return []
+        host = urlsplit(start).netloc
+        seen = SeenURLs()
+        seen.add(start)
+        frontier: asyncio.Queue = asyncio.Queue()
+        frontier.put_nowait(start)
+        parsed: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results: List[Any] = []
+        done = asyncio.Event()
+        scheduled = 1  # URLs handed to fetchers (bounded by max_pages)
+        stats = {"fetched": 0, "failed": 0}
+
+        async def fetcher():
+            nonlocal scheduled
+            while True:
+                url = await frontier.get()
+                try:
+                    await self._polite(url)
+                    html = await self.fetch(url)
+                    page = CrawledPage(url=url, html=html)
+                    await asyncio.to_thread(self.process, page)
+                    stats["fetched"] += 1
+                    for link in page.links:
+                        link = canonicalize_url(link)
+                        if (link and scheduled < self.max_pages and urlsplit(link).netloc == host
+                                and crawlable(link) and seen.add(link)):
+                            scheduled += 1
+                            frontier.put_nowait(link)
+                    await parsed.put(page)
+                except Exception as e:
+                    stats["failed"] += 1
+                    print(f"[CRAWLER] {url} failed: {e}")
+                finally:
+                    frontier.task_done()
+
+        async def extractor():
+            while True:
+                page = await parsed.get()
+                try:
+                    found = await self.extract(page)
+                    results.extend(found or [])
+                    if self.stop_after is not None and len(results) >= self.stop_after:
+                        done.set()
+                except Exception as e:
+                    print(f"[CRAWLER] extract failed for {page.url}: {e}")
+                finally:
+                    parsed.task_done()
+
+        async def drained():
+            await frontier.join()
+            await parsed.join()
+            done.set()
+
+        started = time.monotonic()
+        tasks = [asyncio.create_task(fetcher()) for _ in range(self.concurrency)]
+        tasks += [asyncio.create_task(extractor()) for _ in range(self.extract_concurrency)]
+        watcher = asyncio.create_task(drained())
+        try:
+            await done.wait()
+        finally:
+            for task in tasks + [watcher]:
+                task.cancel()
+            await asyncio.gather(*tasks, watcher, return_exceptions=True)
+        print(f"[CRAWLER] {start}: {stats['fetched']} pages, {stats['failed']} failed, "
+              f"{len(results)} results in {time.monotonic() - started:.1f}s")
+        return results[: self.stop_after] if self.stop_after is not None else results
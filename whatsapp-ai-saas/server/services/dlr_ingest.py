@@ -0,0 +1,112 @@
+# server/services/dlr_ingest.py
+"""
+Batched application of Exotel delivery reports (DLRs) to leads.
+
+The webhook only appends DLRs to a Redis stream; workers/dlr_worker.py
+reads them in batches and calls `apply_dlr_batch`. DLRs for the same phone
+are coalesced first (last status wins, success tags are merged, failure
+reasons are appended in order) and the whole batch is written with one
+UPDATE ... FROM (VALUES ...). Leads are matched on the last 10 digits of
+their phone through the idx_leads_phone10 functional index, taking the most
+recently created lead per number as before.
+"""
+import json
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List
+
+from sqlalchemy import text
+
+from deps import SessionLocal
+
+SUCCESS_STATUSES = ['SENT', 'DELIVERED', 'READ', 'SEEN']
+
+
+@dataclass
+class LeadDelivery:
+    """Net effect of a batch's DLRs on one phone number."""
+    phone10: str
+    status: str = ""
+    tags: List[dict] = field(default_factory=list)
+    failures: List[str] = field(default_factory=list)
+
+
+def normalize_phone10(phone: str) -> str:
+    return "".join(ch for ch in phone or "" if ch.isdigit())[-10:]
+
+
+def coalesce_dlrs(reports: Iterable[dict]) -> Dict[str, LeadDelivery]:
+    """Fold DLR payloads (in stream order) into one LeadDelivery per phone."""
+    merged: Dict[str, LeadDelivery] = {}
+    for report in reports:
+        phone10 = normalize_phone10(report.get("to", ""))
+        if not phone10:
+            continue
+        delivery = merged.setdefault(phone10, LeadDelivery(phone10))
+        detailed_status = report.get("status", "")
+        matched_success = [s for s in SUCCESS_STATUSES if s in detailed_status]
+        if matched_success:
+            delivery.status = "Success"
+            seen = {t["status"] for t in delivery.tags}
+            for s in matched_success:
+                if s not in seen:
+                    delivery.tags.append({"status": s, "timestamp": report.get("received_at")})
+        else:
+            delivery.status = "Failed"
+            delivery.failures.append(f"Failed: {report.get('description', '')}")
+    return merged
+
+
+def apply_dlr_batch(reports: List[dict]) -> int:
+    """Apply a batch of DLR payloads in one statement; returns the number of leads updated."""
+    merged = coalesce_dlrs(reports)
+    if not merged:
+        return 0
+
+    now = datetime.now(timezone.utc).isoformat()
+    params: Dict[str, object] = {}
+    values = []
+    for i, d in enumerate(merged.values()):
+        for tag in d.tags:
+            tag["timestamp"] = tag["timestamp"] or now
+        values.append(f"(:p{i}, :st{i}, CAST(:tg{i} AS JSONB), :fl{i})")
+        params.update({
+            f"p{i}": d.phone10,
+            f"st{i}": d.status,
+            f"tg{i}": json.dumps(d.tags),
+            f"fl{i}": " | ".join(d.failures),
+        })
+
+    db = SessionLocal()
+    try:
+        result = db.execute(text(rf"""
+            WITH v(phone10, status, new_tags, failures) AS (VALUES {", ".join(values)}),
+            target AS (
+                SELECT DISTINCT ON (v.phone10) l.id, v.status, v.new_tags, v.failures
+                FROM v
+                JOIN leads l ON right(regexp_replace(l.phone, '\D', '', 'g'), 10) = v.phone10
+                ORDER BY v.phone10, l.created_at DESC
+            )
+            UPDATE leads AS l
+            SET status = t.status,
+                tags = CAST(
+                    COALESCE(CAST(l.tags AS JSONB), '[]') || COALESCE((
+                        SELECT jsonb_agg(e)
+                        FROM jsonb_array_elements(t.new_tags) AS e
+                        WHERE NOT COALESCE(CAST(l.tags AS JSONB), '[]')
+                              @> jsonb_build_array(jsonb_build_object('status', e->>'status'))
+                    ), '[]')
+                AS JSON),
+                summary = CASE WHEN t.failures = '' THEN l.summary
+                               ELSE btrim(concat_ws(' | ', l.summary, t.failures), ' |') END,
+                updated_at = now()
+            FROM target t
+            WHERE l.id = t.id
+        """), params)
+        db.commit()
+        return result.rowcount
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,149 @@
+# server/services/embeddings.py
+"""
+Content-addressed embedding cache for RAG ingestion.
+
+Chunk text is normalised (NFC, collapsed whitespace) and hashed together
+with the embedding model name; vectors are stored in a local SQLite file
+under that key. Only chunks missing from the store are sent to the
+embedding function, in batches of RAG_EMBED_BATCH_SIZE, so re-indexing
+unchanged content costs a lookup instead of a model pass.
+
+The embedding function is Chroma's default, i.e. the same one collections
+use for `query_texts`, so cached document vectors and query vectors always
+come from the same model.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from prometheus_client import Counter
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "/data/chroma")
+EMBED_CACHE_PATH = os.getenv("RAG_EMBED_CACHE_PATH", os.path.join(CHROMA_PATH, "embedding_cache.sqlite3"))
+EMBED_BATCH_SIZE = int(os.getenv("RAG_EMBED_BATCH_SIZE", "64"))
+# Part of every cache key; change it whenever the embedding function changes
+EMBED_MODEL = "chroma-default:all-MiniLM-L6-v2"
+
+# Stay under SQLite's bound-parameter limit on older builds
+_SQLITE_MAX_VARS = 900
+_WHITESPACE = re.compile(r"\s+")
+
+embedding_cache_total = Counter(
+    "rag_embedding_cache_total", "RAG chunk embedding cache lookups", ["result"]
+)
+
+EmbedFn = Callable[[List[str]], Sequence[Sequence[float]]]
+
+
+def normalize_text(text: str) -> str:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+def content_key(normalized: str, model: str = EMBED_MODEL) -> str:
+    return hashlib.sha256(f"{model}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """SQLite key → float32 vector store, safe to share between threads."""
+
+    def __init__(self, path: str = EMBED_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        keys = list(keys)
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for i in range(0, len(keys), _SQLITE_MAX_VARS):
+                chunk = keys[i:i + _SQLITE_MAX_VARS]
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, vectors: Dict[str, Sequence[float]]) -> None:
+        if not vectors:
+            return
+        rows = [(key, len(vec), array("f", vec).tobytes()) for key, vec in vectors.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, dim, vec) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+
+class CachedEmbedder:
+    def __init__(
+        self,
+        embed_fn: Optional[EmbedFn] = None,
+        store: Optional[EmbeddingStore] = None,
+        model: str = EMBED_MODEL,
+        batch_size: int = EMBED_BATCH_SIZE,
+    ):
+        self._embed_fn = embed_fn
+        self._store = store
+        self.model = model
+        self.batch_size = batch_size
+
+    @property
+    def embed_fn(self) -> EmbedFn:
+        if self._embed_fn is None:
+            from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+            self._embed_fn = DefaultEmbeddingFunction()
+        return self._embed_fn
+
+    @property
+    def store(self) -> EmbeddingStore:
+        if self._store is None:
+            self._store = EmbeddingStore()
+        return self._store
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """Vectors for `texts` in order; only uncached chunks reach the model."""
+        normalized = [normalize_text(t) for t in texts]
+        keys = [content_key(t, self.model) for t in normalized]
+        text_by_key = dict(zip(keys, normalized))
+
+        vectors = self.store.get_many(text_by_key)
+        missing = [k for k in text_by_key if k not in vectors]
+        embedding_cache_total.labels(result="hit").inc(len(text_by_key) - len(missing))
+        embedding_cache_total.labels(result="miss").inc(len(missing))
+
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i + self.batch_size]
+            computed = self.embed_fn([text_by_key[k] for k in batch])
+            fresh = {k: [float(x) for x in vec] for k, vec in zip(batch, computed)}
+            self.store.put_many(fresh)
+            vectors.update(fresh)
+
+        return [vectors[k] for k in keys]
+
+    def embed_queries(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embed search queries in one batch; queries are not persisted to the store."""
+        return [[float(x) for x in vec] for vec in self.embed_fn([normalize_text(t) for t in texts])]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+
+_embedder: Optional[CachedEmbedder] = None
+
+
+def get_embedder() -> CachedEmbedder:
+    """Return the process-wide CachedEmbedder."""
+    global _embedder
+    if _embedder is None:
+        _embedder = CachedEmbedder()
+    return _embedder
@@ -3,10 +3,10 @@ from typing import Any, Dict, List, Optional
 from fastapi import Depends, Request
 from fastapi.responses import JSONResponse
 from requests import Session
-import requests
 from deps import get_db
 from dotenv import load_dotenv
 import services.llm as llm
+from services.exotel_client import get_exotel_client
 from models import AgentConfiguration, BusinessProfile, Template, Workflow
 
 
@@ -18,7 +18,7 @@ EXOTEL_SUBDOMAIN = os.getenv("EXOTEL_SUBDOMAIN")
 EXOTEL_SEND_SMS_URL = os.getenv("EXOTEL_SEND_SMS_URL")
 
 
-def send_reply_via_exotel_api(from_number, to_number, message):
+async def send_reply_via_exotel_api(from_number, to_number, message):
     """Send WhatsApp message using Exotel API with correct authentication"""
     try:
         payload = {
@@ -36,26 +36,23 @@ def send_reply_via_exotel_api(from_number, to_number, message):
             }
         }
         
-        # Use basic auth correctly (as shown in Exotel documentation)
-        auth = (EXOTEL_API_KEY, EXOTEL_API_TOKEN)
-        headers = {"Content-Type": "application/json"}
-        
         print(f"[EXOTEL API] Sending reply: {message}")
         print(f"[EXOTEL API] From: {from_number} To: {to_number}")
-        print(f"[EXOTEL API] URL: {EXOTEL_SEND_SMS_URL}")
-        print(f"[EXOTEL API] Auth Key: {EXOTEL_API_KEY[:5]}... Token: {EXOTEL_API_TOKEN[:5]}...")  # Log first 5 chars for debugging
         
-        response = requests.post(EXOTEL_SEND_SMS_URL, json=payload, headers=headers, auth=auth, timeout=30)
+        response = await get_exotel_client().post(payload)
         print(f"[EXOTEL API] Response Status: {response.status_code}")
         print(f"[EXOTEL API] Response Body: {response.text}")
         
         if response.status_code not in [200, 201, 202]:
             print(f"[EXOTEL API] Error: {response.text}")
+            return False
+        return True
             
     except Exception as e:
         print(f"[EXOTEL API] Failed to send message: {e}")
         import traceback
         traceback.print_exc()
+        return False
 
 async def send_whatsapp_message(
     to_number: str,
@@ -109,18 +106,9 @@ async def send_whatsapp_message(
         }
 
         # 3. Send Request
-        auth = (EXOTEL_API_KEY, EXOTEL_API_TOKEN)
-        headers = {"Content-Type": "application/json"}
-        
         print(f"[EXOTEL API] Sending {message_type} to {to_number}")
         
-        response = requests.post(
-            EXOTEL_SEND_SMS_URL, 
-            json=payload, 
-            headers=headers, 
-            auth=auth, 
-            timeout=30
-        )
+        response = await get_exotel_client().post(payload)
         
         if response.status_code in [200, 201, 202]:
             return True
@@ -156,12 +144,9 @@ async def send_chat_state(from_number, to_number, state="typing"):
             }
         }
         
-        auth = (EXOTEL_API_KEY, EXOTEL_API_TOKEN)
-        headers = {"Content-Type": "application/json"}
-        
-        # We use a short timeout (5s) because this is a cosmetic feature; 
-        # we don't want to block the main thread if it fails.
-        requests.post(EXOTEL_SEND_SMS_URL, json=payload, headers=headers, auth=auth, timeout=5)
+        # We use a short timeout (5s) and no retries because this is a cosmetic feature;
+        # we don't want to hold up the reply if it fails.
+        await get_exotel_client().post(payload, timeout=5, retry=False)
         print(f"[EXOTEL API] Sent chat state '{state}' to {to_number}")
             
     except Exception as e:
@@ -178,7 +163,7 @@ async def whatsapp_msg_send_api(request: Request):
         if not all([from_number, to_number, message]):
             return {"status": "error", "message": "Missing required fields"}
         
-        send_reply_via_exotel_api(from_number, to_number, message)
+        await send_reply_via_exotel_api(from_number, to_number, message)
         return {"status": "success", "message": "Message sent"}
         
     except Exception as e:
@@ -186,7 +171,7 @@ async def whatsapp_msg_send_api(request: Request):
         return {"status": "error", "message": str(e)}
 
 
-def send_reply_via_exotel_api_template(
+async def send_reply_via_exotel_api_template(
     to_number: str,
     from_number: str,
     template_name: str,
@@ -235,16 +220,12 @@ def send_reply_via_exotel_api_template(
             ]
         }
 
-        # Endpoint per Exotel docs
-        headers = {"Content-Type": "application/json"}
-        auth = (EXOTEL_API_KEY, EXOTEL_API_TOKEN)
-
         print(f"[EXOTEL WA] POST {EXOTEL_SEND_SMS_URL}")
         print(f"[EXOTEL WA] To: {to_number} | From: {EXOTEL_SEND_SMS_URL}")
         print(f"[EXOTEL WA] Template: {template_name} | Lang: {language}")
         print(f"[EXOTEL WA] Params: {params}")
 
-        resp = requests.post(EXOTEL_SEND_SMS_URL, json=payload, headers=headers, auth=auth, timeout=30)
+        resp = await get_exotel_client().post(payload)
         msg = f"""Hi {params[0]}
                   Welcome to {params[1]} !
                   How can I assist you today?
@@ -296,7 +277,7 @@ async def whatsapp_msg_send_api_via_template(request: Request):
             )
 
         # Send via Exotel
-        result = send_reply_via_exotel_api_template(
+        result = await send_reply_via_exotel_api_template(
             to_number=to_number,
             from_number=from_number,
             template_name=template_name,
@@ -439,7 +420,7 @@ async def whatsapp_msg_send_api_bulk(
             name = recipient.get("name") or "Sir/Madam"
             full_params = [name] + paramsList
 
-            result = send_reply_via_exotel_api_template(
+            result = await send_reply_via_exotel_api_template(
                 to_number=to_number,
                 from_number=from_number,
                 template_name=template_name,
@@ -476,7 +457,61 @@ async def whatsapp_msg_send_api_bulk(
             content={"status": "error", "message": "Internal server error"}
         )
     
-def send_template_with_media(
+def _template_with_media_payload(
+    to_number: str,
+    from_number: str,
+    template_name: str,
+    media_url: str,
+    body_params: List[str],
+    language: str,
+    media_type: str,
+) -> Dict[str, Any]:
+    # 1. Construct Components
+    components = []
+
+    # --- Header Component (Media) ---
+    if media_url:
+        components.append({
+            "type": "header",
+            "parameters": [
+                {
+                    "type": media_type,
+                    media_type: {
+                        "link": media_url
+                    }
+                }
+            ]
+        })
+
+    # --- Body Component (Text Placeholders) ---
+    if body_params:
+        # Convert all params to text parameters
+        parameters = [{"type": "text", "text": str(p)} for p in body_params]
+        components.append({
+            "type": "body",
+            "parameters": parameters
+        })
+
+    # 2. Construct Payload
+    return {
+        "whatsapp": {
+            "messages": [{
+                "from": from_number,
+                "to": to_number,
+                "content": {
+                    "type": "template",
+                    "template": {
+                        "name": template_name,
+                        "language": {"code": language},
+                        "components": components
+                    }
+                }
+            }]
+        }
+    }
+
+
+async def send_template_with_media(
     to_number: str,
     from_number: str,
     template_name: str,
@@ -489,65 +524,44 @@ def send_template_with_media(
     Send a WhatsApp template message that includes a Media Header and Body Parameters.
     """
     try:
-        # 1. Construct Components
-        components = []
-
-        # --- Header Component (Media) ---
-        if media_url:
-            components.append({
-                "type": "header",
-                "parameters": [
-                    {
-                        "type": media_type,
-                        media_type: {
-                            "link": media_url
-                        }
-                    }
-                ]
-            })
-
-        # --- Body Component (Text Placeholders) ---
-        if body_params:
-            # Convert all params to text parameters
-            parameters = [{"type": "text", "text": str(p)} for p in body_params]
-            components.append({
-                "type": "body",
-                "parameters": parameters
-            })
-
-        # 2. Construct Payload
-        payload = {
-            "whatsapp": {
-                "messages": [{
-                    "from": from_number,
-                    "to": to_number,
-                    "content": {
-                        "type": "template",
-                        "template": {
-                            "name": template_name,
-                            "language": {"code": language},
-                            "components": components
-                        }
-                    }
-                }]
-            }
-        }
+        payload = _template_with_media_payload(
+            to_number, from_number, template_name, media_url, body_params, language, media_type
+        )
 
         # 3. Send Request
-        auth = (EXOTEL_API_KEY, EXOTEL_API_TOKEN)
-        headers = {"Content-Type": "application/json"}
-        
         print(f"[EXOTEL API] Sending Template: {template_name} to {to_number}")
         print(f"[EXOTEL API] Media: {media_url}")
         print(f"[EXOTEL API] Body Params: {body_params}")
 
-        response = requests.post(
-            EXOTEL_SEND_SMS_URL, 
-            json=payload, 
-            headers=headers, 
-            auth=auth, 
-            timeout=30
+        response = await get_exotel_client().post(payload)
+
+        print(f"[EXOTEL API] Response: {response.status_code} - {response.text}")
+        return response.status_code in [200, 201, 202]
+
+    except Exception as e:
+        print(f"[EXOTEL API] Error sending template: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def send_template_with_media_sync(
+    to_number: str,
+    from_number: str,
+    template_name: str,
+    media_url: str,
+    body_params: List[str],
+    language: str = "en",
+    media_type: str = "image"
+):
+    """Blocking `send_template_with_media` for sync callers (e.g. campaign runs in the threadpool)."""
+    try:
+        payload = _template_with_media_payload(
+            to_number, from_number, template_name, media_url, body_params, language, media_type
         )
+        print(f"[EXOTEL API] Sending Template: {template_name} to {to_number}")
+
+        response = get_exotel_client().post_sync(payload)
 
         print(f"[EXOTEL API] Response: {response.status_code} - {response.text}")
         return response.status_code in [200, 201, 202]
@@ -556,4 +570,4 @@ def send_template_with_media(
         print(f"[EXOTEL API] Error sending template: {e}")
         import traceback
         traceback.print_exc()
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,172 @@
+# server/services/exotel_client.py
+"""
+Pooled HTTP transport for the Exotel WhatsApp API.
+
+One httpx.AsyncClient per process keeps TLS connections alive across sends
+(HTTP/2 when the `h2` package is installed), so a send costs one request
+instead of a fresh TCP+TLS handshake, and never blocks the event loop.
+Sync callers (campaign runs in the threadpool) share a pooled httpx.Client
+with the same retry policy.
+
+Only sends Exotel cannot have acted on are retried: 429 and 503 responses,
+and failures to connect or to get a pooled connection. They back off with
+full jitter, honouring Retry-After when Exotel sends it. Other 5xx, read
+timeouts and dropped connections are not retried: the message may already
+have been accepted, and a retry would deliver it twice.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EXOTEL_API_KEY = os.getenv("EXOTEL_API_KEY")
+EXOTEL_API_TOKEN = os.getenv("EXOTEL_API_TOKEN")
+EXOTEL_SEND_SMS_URL = os.getenv("EXOTEL_SEND_SMS_URL")
+
+EXOTEL_TIMEOUT = float(os.getenv("EXOTEL_TIMEOUT", "30"))
+EXOTEL_CONNECT_TIMEOUT = float(os.getenv("EXOTEL_CONNECT_TIMEOUT", "5"))
+EXOTEL_MAX_CONNECTIONS = int(os.getenv("EXOTEL_MAX_CONNECTIONS", "100"))
+EXOTEL_MAX_KEEPALIVE = int(os.getenv("EXOTEL_MAX_KEEPALIVE", "20"))
+EXOTEL_KEEPALIVE_EXPIRY = float(os.getenv("EXOTEL_KEEPALIVE_EXPIRY", "60"))
+EXOTEL_MAX_RETRIES = int(os.getenv("EXOTEL_MAX_RETRIES", "3"))
+EXOTEL_BACKOFF_BASE = float(os.getenv("EXOTEL_BACKOFF_BASE", "0.5"))
+EXOTEL_BACKOFF_MAX = float(os.getenv("EXOTEL_BACKOFF_MAX", "8"))
+EXOTEL_HTTP2 = os.getenv("EXOTEL_HTTP2", "true").lower() == "true"
+
+# Rejected before processing; 500/502/504 may come back after the message was queued
+RETRY_STATUSES = {429, 503}
+# Failures where the request cannot have reached Exotel
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def _http2_available() -> bool:
+    if not EXOTEL_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class ExotelClient:
+    def __init__(
+        self,
+        url: Optional[str] = EXOTEL_SEND_SMS_URL,
+        api_key: Optional[str] = EXOTEL_API_KEY,
+        api_token: Optional[str] = EXOTEL_API_TOKEN,
+        timeout: float = EXOTEL_TIMEOUT,
+        max_retries: int = EXOTEL_MAX_RETRIES,
+    ):
+        self.url = url
+        self.auth = (api_key or "", api_token or "")
+        self.timeout = httpx.Timeout(timeout, connect=EXOTEL_CONNECT_TIMEOUT)
+        self.limits = httpx.Limits(
+            max_connections=EXOTEL_MAX_CONNECTIONS,
+            max_keepalive_connections=EXOTEL_MAX_KEEPALIVE,
+            keepalive_expiry=EXOTEL_KEEPALIVE_EXPIRY,
+        )
+        self.http2 = _http2_available()
+        self.max_retries = max_retries
+        self._async: Optional[httpx.AsyncClient] = None
+        self._sync: Optional[httpx.Client] = None
+        self._sync_lock = threading.Lock()
+
+    # --- clients ---
+    def _client_kwargs(self) -> Dict[str, Any]:
+        return {
+            "auth": self.auth,
+            "timeout": self.timeout,
+            "limits": self.limits,
+            "http2": self.http2,
+            "headers": {"Content-Type": "application/json"},
+        }
+
+    def async_client(self) -> httpx.AsyncClient:
+        if self._async is None or self._async.is_closed:
+            self._async = httpx.AsyncClient(**self._client_kwargs())
+        return self._async
+
+    def sync_client(self) -> httpx.Client:
+        with self._sync_lock:
+            if self._sync is None or self._sync.is_closed:
+                self._sync = httpx.Client(**self._client_kwargs())
+            return self._sync
+
+    async def aclose(self) -> None:
+        if self._async is not None:
+            await self._async.aclose()
+            self._async = None
+        if self._sync is not None:
+            self._sync.close()
+            self._sync = None
+
+    # --- retry policy ---
+    def _backoff(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), EXOTEL_BACKOFF_MAX)
+        return random.uniform(0, min(EXOTEL_BACKOFF_MAX, EXOTEL_BACKOFF_BASE * (2 ** attempt)))
+
+    def _should_retry(self, attempt: int, response: Optional[httpx.Response], retry: bool = True) -> bool:
+        if not retry or attempt >= self.max_retries:
+            return False
+        return response is None or response.status_code in RETRY_STATUSES
+
+    # --- sends ---
+    async def post(self, payload: Dict[str, Any], timeout: Optional[float] = None, retry: bool = True) -> httpx.Response:
+        """POST `payload` to the send endpoint; raises httpx.HTTPError once retries are exhausted."""
+        client = self.async_client()
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = await client.post(self.url, json=payload, timeout=timeout or self.timeout)
+            except RETRY_ERRORS as e:
+                if not self._should_retry(attempt, None, retry):
+                    raise
+                print(f"[EXOTEL CLIENT] {type(e).__name__} on attempt {attempt + 1}, retrying")
+            else:
+                if not self._should_retry(attempt, response, retry):
+                    return response
+                print(f"[EXOTEL CLIENT] HTTP {response.status_code} on attempt {attempt + 1}, retrying")
+            await asyncio.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    def post_sync(self, payload: Dict[str, Any], timeout: Optional[float] = None, retry: bool = True) -> httpx.Response:
+        """Blocking variant of `post` for code running outside the event loop."""
+        client = self.sync_client()
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = client.post(self.url, json=payload, timeout=timeout or self.timeout)
+            except RETRY_ERRORS as e:
+                if not self._should_retry(attempt, None, retry):
+                    raise
+                print(f"[EXOTEL CLIENT] {type(e).__name__} on attempt {attempt + 1}, retrying")
+            else:
+                if not self._should_retry(attempt, response, retry):
+                    return response
+                print(f"[EXOTEL CLIENT] HTTP {response.status_code} on attempt {attempt + 1}, retrying")
+            time.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+
+_client: Optional[ExotelClient] = None
+
+
+def get_exotel_client() -> ExotelClient:
+    """Return the process-wide ExotelClient."""
+    global _client
+    if _client is None:
+        _client = ExotelClient()
+    return _client
@@ -188,7 +188,8 @@ async def _process_pdf_and_update_rag(source: KnowledgeSource) -> str:
     documents = response_obj.get("document", [])
     # 2. Update RAG system with the URL content
     metadatas= [(d.get("metadata" ,{})) for d in documents]
-    await rag.add_documents_rag(source.tenant_id, documents,metadatas)
+    # Replaces what an earlier ingest of this source stored
+    await rag.replace_source_documents(source.tenant_id, source.id, documents, metadatas)
 
     return response_obj
 
@@ -209,6 +210,7 @@ async def _process_url_and_update_rag(source: KnowledgeSource) -> str:
     documents = response_obj.get("document", [])
     # 2. Update RAG system with the URL content
     metadatas= [(d.get("metadata" ,{})) for d in documents]
-    await rag.add_documents_rag(source.tenant_id, documents,metadatas)
+    # Replaces what an earlier ingest of this source stored
+    await rag.replace_source_documents(source.tenant_id, source.id, documents, metadatas)
 
     return response_obj
\ No newline at end of file
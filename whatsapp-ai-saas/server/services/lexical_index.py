@@ -0,0 +1,220 @@
+# server/services/lexical_index.py
+"""
+Per-tenant on-disk keyword index (SQLite FTS5) kept next to each Chroma
+collection.
+
+RAGService writes every chunk here as well as to Chroma, so exact tokens
+that dense retrieval handles poorly (SKU names, PNR-like codes, prices) can
+be matched with BM25 and fused with the vector ranking (see
+RAGService.hybrid_search). One file per tenant keeps a tenant purge to a
+single unlink.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "/data/chroma")
+LEXICAL_INDEX_DIR = os.getenv("RAG_LEXICAL_DIR", os.path.join(CHROMA_PATH, "lexical"))
+# Open tenant databases kept around; least recently used ones are closed
+LEXICAL_MAX_OPEN = int(os.getenv("RAG_LEXICAL_MAX_OPEN", "64"))
+
+# Keep "AB-123", "SKU_9" and similar codes as single tokens
+_TOKENIZER = "unicode61 remove_diacritics 2 tokenchars '-_'"
+_QUERY_TOKEN = re.compile(r"[\w][\w\-]*", re.UNICODE)
+_MAX_QUERY_TOKENS = 32
+
+
+def _fts_query(query: str) -> str:
+    """OR of the query's tokens, each quoted so FTS5 operators in user text are inert."""
+    tokens = list(dict.fromkeys(t.lower() for t in _QUERY_TOKEN.findall(query or "")))[:_MAX_QUERY_TOKENS]
+    return " OR ".join('"' + t.replace('"', '""') + '"' for t in tokens)
+
+
+_COMPARATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def _where_sql(where: Dict[str, Any], params: List[Any]) -> str:
+    """Translate a Chroma metadata `where` filter to SQL over chunks.metadata."""
+    clauses = []
+    for key, cond in where.items():
+        if key in ("$and", "$or"):
+            parts = [_where_sql(sub, params) for sub in cond]
+            clauses.append("(" + (" AND " if key == "$and" else " OR ").join(parts) + ")")
+            continue
+        field = "json_extract(c.metadata, ?)"
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        for op, value in cond.items():
+            params.append(f'$."{key}"')
+            if op in _COMPARATORS:
+                clauses.append(f"{field} {_COMPARATORS[op]} ?")
+                params.append(value)
+            elif op in ("$in", "$nin"):
+                values = list(value) or [None]
+                clauses.append(f"{field} {'IN' if op == '$in' else 'NOT IN'} ({','.join('?' * len(values))})")
+                params.extend(values)
+            else:
+                raise ValueError(f"Unsupported where operator: {op}")
+    return " AND ".join(clauses) or "1"
+
+
+def _where_document_sql(where_document: Dict[str, Any], params: List[Any]) -> str:
+    """Translate a Chroma `where_document` filter ($contains / $not_contains) to SQL over the chunk text."""
+    clauses = []
+    for op, value in where_document.items():
+        if op in ("$and", "$or"):
+            parts = [_where_document_sql(sub, params) for sub in value]
+            clauses.append("(" + (" AND " if op == "$and" else " OR ").join(parts) + ")")
+        elif op in ("$contains", "$not_contains"):
+            clauses.append(f"instr(f.text, ?) {'>' if op == '$contains' else '='} 0")
+            params.append(value)
+        else:
+            raise ValueError(f"Unsupported where_document operator: {op}")
+    return " AND ".join(clauses) or "1"
+
+
+class _TenantDB:
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, doc_id TEXT UNIQUE NOT NULL, metadata TEXT)"
+        )
+        self.conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(text, tokenize=\"{_TOKENIZER}\")"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+
+class LexicalIndex:
+    def __init__(self, root: str = LEXICAL_INDEX_DIR, max_open: int = LEXICAL_MAX_OPEN):
+        self.root = root
+        self.max_open = max_open
+        self._open: "OrderedDict[str, _TenantDB]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, tenant_id) -> str:
+        return os.path.join(self.root, f"tenant-{tenant_id}.sqlite3")
+
+    def exists(self, tenant_id) -> bool:
+        return os.path.exists(self._path(tenant_id))
+
+    def _db(self, tenant_id) -> _TenantDB:
+        key = str(tenant_id)
+        with self._lock:
+            db = self._open.get(key)
+            if db is None:
+                os.makedirs(self.root, exist_ok=True)
+                db = _TenantDB(self._path(key))
+                self._open[key] = db
+                while len(self._open) > self.max_open:
+                    _, old = self._open.popitem(last=False)
+                    with old.lock:
+                        old.conn.close()
+            self._open.move_to_end(key)
+            return db
+
+    def is_complete(self, tenant_id) -> bool:
+        """Whether the index holds every chunk of the tenant's collection (set after a backfill)."""
+        if not self.exists(tenant_id):
+            return False
+        db = self._db(tenant_id)
+        with db.lock:
+            row = db.conn.execute("SELECT value FROM meta WHERE key = 'complete'").fetchone()
+        return bool(row)
+
+    def mark_complete(self, tenant_id) -> None:
+        db = self._db(tenant_id)
+        with db.lock:
+            db.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('complete', '1')")
+            db.conn.commit()
+
+    def upsert(self, tenant_id, ids: Sequence[str], texts: Sequence[str],
+               metadatas: Optional[Sequence[Dict[str, Any]]] = None) -> None:
+        if not ids:
+            return
+        metadatas = metadatas or [{}] * len(ids)
+        db = self._db(tenant_id)
+        with db.lock:
+            cur = db.conn.cursor()
+            for doc_id, text, meta in zip(ids, texts, metadatas):
+                row = cur.execute("SELECT id FROM chunks WHERE doc_id = ?", (doc_id,)).fetchone()
+                if row:
+                    cur.execute("DELETE FROM chunks_fts WHERE rowid = ?", (row[0],))
+                    cur.execute("UPDATE chunks SET metadata = ? WHERE id = ?", (json.dumps(meta or {}), row[0]))
+                    rowid = row[0]
+                else:
+                    cur.execute("INSERT INTO chunks (doc_id, metadata) VALUES (?, ?)", (doc_id, json.dumps(meta or {})))
+                    rowid = cur.lastrowid
+                cur.execute("INSERT INTO chunks_fts (rowid, text) VALUES (?, ?)", (rowid, text or ""))
+            db.conn.commit()
+
+    def delete(self, tenant_id, ids: Sequence[str]) -> None:
+        if not ids or not self.exists(tenant_id):
+            return
+        db = self._db(tenant_id)
+        with db.lock:
+            cur = db.conn.cursor()
+            for doc_id in ids:
+                row = cur.execute("SELECT id FROM chunks WHERE doc_id = ?", (doc_id,)).fetchone()
+                if row:
+                    cur.execute("DELETE FROM chunks_fts WHERE rowid = ?", (row[0],))
+                    cur.execute("DELETE FROM chunks WHERE id = ?", (row[0],))
+            db.conn.commit()
+
+    def drop(self, tenant_id) -> None:
+        """Remove the tenant's index file (namespace purge)."""
+        key = str(tenant_id)
+        with self._lock:
+            db = self._open.pop(key, None)
+        if db is not None:
+            with db.lock:
+                db.conn.close()
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(self._path(key) + suffix)
+            except FileNotFoundError:
+                pass
+
+    def search(self, tenant_id, query: str, k: int, where: Optional[Dict[str, Any]] = None,
+               where_document: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        BM25-ranked matches as [{id, text, metadata, score}] (lower score is better).
+        `where` / `where_document` take the same filters as Chroma and are applied in SQL.
+        """
+        match = _fts_query(query)
+        if not match or not self.exists(tenant_id):
+            return []
+        params: List[Any] = [match]
+        filters = ""
+        if where:
+            filters += " AND " + _where_sql(where, params)
+        if where_document:
+            filters += " AND " + _where_document_sql(where_document, params)
+        params.append(k)
+        db = self._db(tenant_id)
+        with db.lock:
+            rows: List[Tuple] = db.conn.execute(
+                f"""
+                SELECT c.doc_id, f.text, c.metadata, bm25(chunks_fts) AS score
+                FROM chunks_fts AS f JOIN chunks AS c ON c.id = f.rowid
+                WHERE chunks_fts MATCH ?{filters}
+                ORDER BY score
+                LIMIT ?
+                """,
+                params,
+            ).fetchall()
+        return [
+            {"id": doc_id, "text": text, "metadata": json.loads(meta or "{}"), "score": score}
+            for doc_id, text, meta, score in rows
+        ]
+
+
+lexical_index = LexicalIndex()
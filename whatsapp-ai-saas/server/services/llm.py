@@ -1,5 +1,7 @@
-import os, logging
-from typing import Dict, Any, List
+import os, json, logging
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Dict, Any, List, Awaitable, Callable, Optional
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
 load_dotenv()
@@ -9,6 +11,8 @@ client = AsyncOpenAI()
 PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
 MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
 TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.3"))
+# Reply length cap shared by the streaming and non-streaming reply paths
+REPLY_MAX_TOKENS = int(os.getenv("LLM_REPLY_MAX_TOKENS", "300"))
 
 # --- OpenAI ---
 # if PROVIDER == "openai":
@@ -66,14 +70,14 @@ async def generate_reply(tenant_id: str, query: str, docs: Dict[str, Any]) -> st
                 messages=[{"role": "system", "content": "You are a WhatsApp business assistant."},
                           {"role": "user", "content": prompt}],
                 temperature=TEMPERATURE,
-                max_tokens=300,
+                max_tokens=REPLY_MAX_TOKENS,
             )
             return resp["choices"][0]["message"]["content"].strip()
 
         elif PROVIDER == "anthropic":
             resp = await anthropic_client.messages.create(
                 model=MODEL,
-                max_tokens=300,
+                max_tokens=REPLY_MAX_TOKENS,
                 temperature=TEMPERATURE,
                 messages=[{"role": "user", "content": prompt}],
             )
@@ -190,3 +194,152 @@ async def llm_model_reply(tenant_id: str, message_obj: any) -> str:
         logger.exception(f"[LLM] Failed for tenant={tenant_id}: {e}")
         return "Sorry, I'm facing issues. Please contact the business owner directly."
     
+
+
+# --- Streaming ---
+
+@dataclass
+class StreamedTurn:
+    """Result of one streamed completion: the full text plus any tool calls (OpenAI only)."""
+    text: str = ""
+    tool_calls: List[Any] = field(default_factory=list)
+
+    def assistant_message(self) -> Dict[str, Any]:
+        """The assistant turn to send back to the model alongside tool results."""
+        msg: Dict[str, Any] = {"role": "assistant", "content": self.text or None}
+        if self.tool_calls:
+            msg["tool_calls"] = [
+                {"id": tc.id, "type": "function",
+                 "function": {"name": tc.function.name, "arguments": tc.function.arguments}}
+                for tc in self.tool_calls
+            ]
+        return msg
+
+
+def _split_system(messages: List[Dict[str, Any]]):
+    """Anthropic/Gemini take the system prompt separately and only user/assistant turns."""
+    system_parts, turns = [], []
+    for m in messages:
+        role, content = m.get("role"), m.get("content") or ""
+        if role == "system":
+            system_parts.append(content)
+        elif role in ("user", "assistant"):
+            turns.append({"role": role, "content": content})
+    return "\n\n".join(p for p in system_parts if p), turns
+
+
+async def stream_chat(
+    messages: List[Dict[str, Any]],
+    on_text: Optional[Callable[[str], Awaitable[None]]] = None,
+    *,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    tools: Optional[List[Dict[str, Any]]] = None,
+    tool_choice: str = "auto",
+) -> StreamedTurn:
+    """
+    Stream a chat completion, awaiting `on_text(delta)` for each text fragment
+    as it arrives. Tool calling is only supported for the OpenAI provider; the
+    streamed tool-call deltas are reassembled into `StreamedTurn.tool_calls`.
+    `max_tokens=None` leaves the reply length to the provider's default, as
+    the non-streaming agent call does. `provider` may be "openai" (its client always exists) or the configured
+    LLM_PROVIDER; the other providers' clients are only set up when selected.
+    Errors propagate to the caller.
+    """
+    provider = (provider or PROVIDER).lower()
+    if provider not in ("openai", PROVIDER):
+        raise ValueError(f"LLM provider {provider!r} is not configured (LLM_PROVIDER={PROVIDER})")
+    model = model or MODEL
+    temperature = TEMPERATURE if temperature is None else temperature
+    turn = StreamedTurn()
+    parts: List[str] = []
+
+    async def emit(delta: str):
+        if delta:
+            parts.append(delta)
+            if on_text is not None:
+                await on_text(delta)
+
+    if provider == "openai":
+        kwargs: Dict[str, Any] = {}
+        if tools:
+            kwargs.update(tools=tools, tool_choice=tool_choice)
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            **kwargs,
+        )
+        calls: Dict[int, Dict[str, str]] = {}
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            for tc in getattr(delta, "tool_calls", None) or []:
+                slot = calls.setdefault(tc.index, {"id": "", "name": "", "arguments": ""})
+                if tc.id:
+                    slot["id"] = tc.id
+                if tc.function and tc.function.name:
+                    slot["name"] += tc.function.name
+                if tc.function and tc.function.arguments:
+                    slot["arguments"] += tc.function.arguments
+            await emit(delta.content or "")
+        turn.tool_calls = [
+            SimpleNamespace(id=c["id"], function=SimpleNamespace(name=c["name"], arguments=c["arguments"]))
+            for _, c in sorted(calls.items())
+        ]
+
+    elif provider == "anthropic":
+        system, turns = _split_system(messages)
+        async with anthropic_client.messages.stream(
+            model=model,
+            max_tokens=max_tokens or 4096,  # required by the Messages API
+            temperature=temperature,
+            system=system or None,
+            messages=turns,
+        ) as stream:
+            async for text in stream.text_stream:
+                await emit(text)
+
+    elif provider == "gemini":
+        system, turns = _split_system(messages)
+        gmodel = genai.GenerativeModel(model, system_instruction=system or None)
+        contents = [
+            {"role": "model" if t["role"] == "assistant" else "user", "parts": [t["content"]]}
+            for t in turns
+        ]
+        stream = await gmodel.generate_content_async(
+            contents,
+            generation_config={"temperature": temperature,
+                               **({"max_output_tokens": max_tokens} if max_tokens else {})},
+            stream=True,
+        )
+        async for chunk in stream:
+            await emit(getattr(chunk, "text", "") or "")
+
+    elif provider == "ollama":
+        async with httpx.AsyncClient(timeout=60) as http_client:
+            async with http_client.stream("POST", f"{OLLAMA_URL}/api/chat", json={
+                "model": model,
+                "messages": [{"role": m["role"], "content": m.get("content") or ""} for m in messages],
+                "options": {"temperature": temperature},
+                "stream": True,
+            }) as r:
+                async for line in r.aiter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    await emit(data.get("message", {}).get("content", ""))
+                    if data.get("done"):
+                        break
+
+    else:
+        raise ValueError(f"No LLM provider configured for streaming: {provider}")
+
+    turn.text = "".join(parts)
+    return turn
@@ -0,0 +1,168 @@
+# server/services/page_fetcher.py
+"""
+Static-first page fetching for ingestion.
+
+Most SMB sites are server-rendered, so a plain HTTP GET returns everything a
+headless browser would, at a fraction of the cost. `PageFetcher.fetch`
+first GETs the page through a pooled httpx client and only calls the
+supplied `render` (Playwright / crawl4ai) when `needs_browser` judges the
+static HTML insufficient: little visible text, a JS-app shell, a
+"please enable JavaScript" <noscript>, or product-listing markup with no
+prices in the text.
+
+The outcome is remembered per domain (FETCH_MODE_TTL, shared through
+Redis): a domain is switched to "browser" only when rendering produced
+clearly more text than the static response, so a single thin page doesn't
+send the whole site through the browser; later pages of a "browser" domain
+skip the static attempt.
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from utils.cache import TieredCache
+
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "15"))
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "20"))
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(5 * 1024 * 1024)))
+# Visible text below this (chars) means the page probably renders client-side
+FETCH_MIN_TEXT_CHARS = int(os.getenv("FETCH_MIN_TEXT_CHARS", "600"))
+FETCH_MIN_TEXT_RATIO = float(os.getenv("FETCH_MIN_TEXT_RATIO", "0.02"))
+# Rendered text must exceed static text by this factor to mark the domain "browser"
+FETCH_RENDER_GAIN = float(os.getenv("FETCH_RENDER_GAIN", "1.5"))
+FETCH_MODE_TTL = int(os.getenv("FETCH_MODE_TTL", str(7 * 24 * 3600)))
+FETCH_USER_AGENT = os.getenv(
+    "FETCH_USER_AGENT",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/124.0 Safari/537.36",
+)
+
+MODE_STATIC = "static"
+MODE_BROWSER = "browser"
+
+_INVISIBLE = re.compile(r"<(script|style|noscript|svg|template)\b[^>]*>.*?</\1\s*>", re.I | re.S)
+_TAG = re.compile(r"<[^>]+>")
+_SPACE = re.compile(r"\s+")
+_NOSCRIPT_JS = re.compile(r"<noscript\b[^>]*>[^<]{0,400}?(enable|turn on|requires?)\s+javascript", re.I | re.S)
+_APP_SHELL = re.compile(
+    r"<div[^>]+id=[\"'](root|app|__next|__nuxt|___gatsby)[\"'][^>]*>\s*</div>|\bng-app\b|ng-version=",
+    re.I,
+)
+_PRODUCT_MARKUP = re.compile(
+    r"class=[\"'][^\"']*\b(product[-_]?(card|item|grid|list|tile)|add[-_]to[-_]cart)\b", re.I,
+)
+_PRICE = re.compile(r"(₹|rs\.?|inr|\$|€|£|usd|eur)\s?\d|\d[\d,.]*\s?(₹|rs\.?|inr|usd|eur)\b", re.I)
+_PRODUCT_LD = re.compile(r"application/ld\+json[^>]*>[^<]*\"@type\"\s*:\s*\"(Product|Offer|ItemList)\"", re.I)
+
+
+def visible_text(html: str) -> str:
+    """Cheap tag-stripped text, good enough to judge how much content a page has."""
+    return _SPACE.sub(" ", _TAG.sub(" ", _INVISIBLE.sub(" ", html))).strip()
+
+
+def needs_browser(html: str) -> Tuple[bool, str]:
+    """Whether static `html` is likely missing content a browser would render, and why."""
+    if not html:
+        return True, "empty"
+    text = visible_text(html)
+    if _NOSCRIPT_JS.search(html) and len(text) < FETCH_MIN_TEXT_CHARS * 2:
+        return True, "noscript"
+    if _APP_SHELL.search(html) and len(text) < FETCH_MIN_TEXT_CHARS * 2:
+        return True, "app-shell"
+    if len(text) < FETCH_MIN_TEXT_CHARS:
+        return True, "little-text"
+    if len(text) / max(len(html), 1) < FETCH_MIN_TEXT_RATIO:
+        return True, "low-density"
+    if _PRODUCT_MARKUP.search(html) and not _PRICE.search(text) and not _PRODUCT_LD.search(html):
+        return True, "products-without-prices"
+    return False, "ok"
+
+
+@dataclass
+class FetchResult:
+    url: str
+    html: str
+    rendered: bool
+    reason: str = ""
+
+
+class PageFetcher:
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self.modes = TieredCache("wa_fetch_mode", ttl=FETCH_MODE_TTL, local_ttl=300)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(FETCH_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(max_connections=FETCH_MAX_CONNECTIONS, max_keepalive_connections=FETCH_MAX_CONNECTIONS),
+                follow_redirects=True,
+                headers={
+                    "User-Agent": FETCH_USER_AGENT,
+                    "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.8",
+                    "Accept-Language": "en-IN,en;q=0.9",
+                },
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch_static(self, url: str) -> Optional[str]:
+        """HTML from a plain GET, or None when the response is not a usable HTML page."""
+        try:
+            async with self.client.stream("GET", url) as resp:
+                if resp.status_code >= 400:
+                    return None
+                ctype = resp.headers.get("content-type", "")
+                if ctype and "html" not in ctype.lower():
+                    return None
+                body = bytearray()
+                async for chunk in resp.aiter_bytes():
+                    body += chunk
+                    if len(body) > FETCH_MAX_BYTES:
+                        break
+                return bytes(body).decode(resp.encoding or "utf-8", errors="replace")
+        except httpx.HTTPError as e:
+            print(f"[FETCH] static GET failed for {url}: {e}")
+            return None
+
+    async def fetch(self, url: str, render: Callable[[str], Awaitable[str]]) -> FetchResult:
+        domain = urlsplit(url).netloc.lower()
+        mode = self.modes.get(domain)
+        if mode == MODE_BROWSER:
+            return FetchResult(url, await render(url), True, "domain")
+
+        html = await self.fetch_static(url)
+        if html is not None:
+            escalate, reason = needs_browser(html)
+            if not escalate:
+                if mode != MODE_STATIC:
+                    self.modes.set(domain, MODE_STATIC)
+                return FetchResult(url, html, False, reason)
+        else:
+            reason = "static-failed"
+
+        rendered = await render(url)
+        static_chars = len(visible_text(html)) if html else 0
+        if len(visible_text(rendered)) > max(static_chars * FETCH_RENDER_GAIN, FETCH_MIN_TEXT_CHARS):
+            self.modes.set(domain, MODE_BROWSER)
+        print(f"[FETCH] {url} rendered in browser ({reason})")
+        return FetchResult(url, rendered, True, reason)
+
+
+_page_fetcher: Optional[PageFetcher] = None
+
+
+def get_page_fetcher() -> PageFetcher:
+    global _page_fetcher
+    if _page_fetcher is None:
+        _page_fetcher = PageFetcher()
+    return _page_fetcher
@@ -4,14 +4,26 @@ from typing import List, Dict, Any, Optional
 import os
 import uuid
 import logging
+import threading
 
 from sqlalchemy import func
 from database import SessionLocal
 from sqlalchemy.orm import Session
-from models import BusinessCatalog, Tenant
+from models import Tenant
+from services.embeddings import get_embedder
+from services.rag_query_cache import RAGQueryCache, filter_key
+from services.rag_executor import RAGExecutor
+from services.lexical_index import lexical_index
+from services.rag_storage import TenantPartition, VectorStorage
 
 logger = logging.getLogger(__name__)
 
+# Hybrid search: candidates taken from each ranking, and the RRF damping constant
+RAG_HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "20"))
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+# Chunk metadata naming the KnowledgeSource that produced it
+SOURCE_KEY = "knowledge_source_id"
+
 
 class RAGService:
     """
@@ -23,22 +35,31 @@ class RAGService:
         self.provider = os.getenv("RAG_PROVIDER", "chroma").lower()  # chroma|pinecone|weaviate
         self._client = None  # lazy init
         self._path = os.getenv("CHROMA_PATH", "/data/chroma")  # used by Chroma
+        self.query_cache = RAGQueryCache()
+        # Chroma and the embedding model are blocking; keep them off the event loop
+        self.executor = RAGExecutor()
+        # Dedicated collection per tenant, or tenants packed into shared shards (RAG_STORAGE_MODE)
+        self.storage = VectorStorage(lambda: self.client)
         if self.provider != "chroma":
             logger.warning("RAG_PROVIDER=%s currently not implemented; defaulting to Chroma", self.provider)
-        # Force initialization immediately
+        # Nothing heavy happens at import: the client opens on first use and the
+        # embedding model loads in warmup() (started from the API lifespan) or on the first query.
+        # `ready` turns true whichever of the two loads them first.
+        self._client_lock = threading.Lock()
+        self.ready = False
+
+    def warmup(self) -> None:
+        """Open the client and load the embedding model so the first user doesn't wait. Blocking."""
         try:
-            from chromadb import PersistentClient
-            os.makedirs(self._path, exist_ok=True)
-            self._client = PersistentClient(path=self._path)
-            
-            # Trigger model loading by creating a dummy embedding
-            # This "warms up" the model so the first user doesn't wait
-            self._client.get_or_create_collection("warmup").query(
+            self.client.get_or_create_collection("warmup").query(
                 query_texts=["warmup"], n_results=1
             )
+            get_embedder().embed_queries(["warmup"])
+            self.ready = True
             logger.info("RAG Service & Model warmed up successfully.")
         except Exception as e:
-            logger.error(f"Failed to initialize RAG: {e}")
+            logger.error(f"Failed to warm up RAG: {e}")
+
     # ---------- internal helpers ----------
 
     @property
@@ -47,6 +68,12 @@ class RAGService:
         if self._client is not None:
             return self._client
 
+        with self._client_lock:
+            if self._client is None:
+                self._client = self._open_client()
+        return self._client
+
+    def _open_client(self):
         if self.provider == "chroma" or True:
             try:
                 # New API — no legacy Settings/chroma_db_impl
@@ -58,9 +85,9 @@ class RAGService:
                 ) from e
 
             os.makedirs(self._path, exist_ok=True)
-            self._client = PersistentClient(path=self._path)
+            client = PersistentClient(path=self._path)
             logger.info("Initialized Chroma PersistentClient at %s", self._path)
-            return self._client
+            return client
 
         # In the future: other providers here
         raise NotImplementedError(f"RAG provider '{self.provider}' is not implemented yet.")
@@ -71,10 +98,88 @@ class RAGService:
     def _coll_name(self, tenant_id: str) -> str:
         return self._ns(tenant_id)
 
-    def _get_collection(self, tenant_id: str):
-        """Create or fetch per-tenant collection."""
-        name = self._coll_name(tenant_id)
-        return self.client.get_or_create_collection(name=name)
+    def _partition(self, tenant_id, write: bool = False) -> TenantPartition:
+        """The tenant's chunks: its own collection or its slice of a shared shard."""
+        return self.storage.partition(tenant_id, fresh=write)
+
+    def _upsert(self, part: TenantPartition, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """Write chunks with precomputed vectors so Chroma never re-embeds unchanged text."""
+        embeddings = get_embedder().embed(texts)
+        part.upsert(ids, texts, metadatas, embeddings)
+        self.ready = True
+        lexical_index.upsert(part.tenant_id, ids, texts, metadatas)
+        self.query_cache.bump(part.tenant_id)
+        self.storage.maybe_promote(part)
+
+    def _delete(self, part: TenantPartition, ids: List[str]) -> None:
+        part.delete(ids)
+        lexical_index.delete(part.tenant_id, ids)
+        self.query_cache.bump(part.tenant_id)
+
+    def _ensure_lexical(self, tenant_id, page_size: int = 1000) -> None:
+        """Backfill the keyword index from Chroma for collections created before it existed."""
+        if lexical_index.is_complete(tenant_id):
+            return
+        part = self._partition(tenant_id)
+        offset = 0
+        while True:
+            page = part.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            ids = page.get("ids") or []
+            if not ids:
+                break
+            lexical_index.upsert(tenant_id, ids, page.get("documents") or [], page.get("metadatas") or [])
+            offset += len(ids)
+        lexical_index.mark_complete(tenant_id)
+
+    def _add_sync(self, tenant_id, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        self._upsert(self._partition(tenant_id, write=True), ids, texts, metadatas)
+
+    def _replace_source_sync(self, tenant_id, source_id: int, ids: List[str], texts: List[str],
+                             metadatas: List[Dict[str, Any]]) -> int:
+        """Upsert a knowledge source's chunks, then delete its chunks from earlier ingests that are gone."""
+        part = self._partition(tenant_id, write=True)
+        where = {SOURCE_KEY: source_id}
+        previous = set(part.get(where=where, include=[]).get("ids") or [])
+        metadatas = [{**(m or {}), SOURCE_KEY: source_id} for m in metadatas]
+        if ids:
+            self._upsert(part, ids, texts, metadatas)
+        stale = sorted(previous - set(ids))
+        if stale:
+            # _upsert may have promoted the tenant; re-resolve so the delete hits where the rows are now
+            self._delete(self._partition(tenant_id, write=True), stale)
+        return len(stale)
+
+    def _delete_namespace_sync(self, tenant_id) -> None:
+        try:
+            self.storage.drop(tenant_id)
+        finally:
+            lexical_index.drop(tenant_id)
+            self.query_cache.bump(str(tenant_id))
+
+    def _query_sync(self, tenant_id, queries: List[str], n: int,
+                    query_embeddings: Optional[List[List[float]]] = None,
+                    where: Optional[Dict[str, Any]] = None,
+                    where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        part = self._partition(tenant_id)
+        try:
+            if part.is_empty() and part.shared:
+                # Our cached placement may predate a promotion that emptied the shard
+                part = self._partition(tenant_id, write=True)
+            if part.is_empty():
+                return {"documents": []}
+        except Exception:
+            # Some client versions may not have count() — just attempt query.
+            pass
+
+        # Filters are evaluated inside Chroma, so k is filled from matching chunks only
+        res = part.query(n, query_texts=queries, query_embeddings=query_embeddings,
+                         where=where, where_document=where_document)
+        # Client open and query embedded: loaded lazily without warmup()
+        self.ready = True
+        # Normalize to a predictable shape
+        if not res or not res.get("documents"):
+            return {"documents": []}
+        return res
 
     # ---------- public API ----------
 
@@ -85,7 +190,6 @@ class RAGService:
         if not docs:
             return
 
-        col = self._get_collection(tenant_id)
         ids = [str(d.get("id") or uuid.uuid4()) for d in docs]
         texts = [d["text"] for d in docs]
         metadatas = [
@@ -96,8 +200,7 @@ class RAGService:
             }
             for d in docs
         ]
-        # Chroma client is sync; it's fine to call from async here
-        col.add(ids=ids, documents=texts, metadatas=metadatas)
+        await self.executor.run(self._add_sync, tenant_id, ids, texts, metadatas)
 
     async def add_documents_rag(self, tenant_id: str, docs: List[Dict[str, Any]] ,metadatas: List[Dict[str, Any]] ):
         """
@@ -106,70 +209,145 @@ class RAGService:
         if not docs:
             return
 
-        col = self._get_collection(tenant_id)
         ids = [str(d.get("id") or uuid.uuid4()) for d in docs]
         texts = [d["text"] for d in docs]
-        # Chroma client is sync; it's fine to call from async here
-        col.add(ids=ids, documents=texts, metadatas=metadatas)
+        await self.executor.run(self._add_sync, tenant_id, ids, texts, metadatas)
+
+    async def replace_source_documents(self, tenant_id, source_id: int, docs: List[Dict[str, Any]],
+                                       metadatas: List[Dict[str, Any]]) -> int:
+        """
+        Store the chunks of one KnowledgeSource, removing the ones a previous
+        ingest of it wrote that the new chunks do not replace (edited files
+        get new content-derived ids). Returns the number of stale chunks removed.
+        """
+        ids = [str(d.get("id") or uuid.uuid4()) for d in docs]
+        texts = [d["text"] for d in docs]
+        return await self.executor.run(self._replace_source_sync, tenant_id, source_id, ids, texts, metadatas)
 
     async def delete_namespace(self, tenant_id: str) -> None:
         """
         Hard-delete the tenant collection (GDPR/DPDP). Irreversible.
         """
-        name = self._coll_name(tenant_id)
-        try:
-            self.client.delete_collection(name=name)
-        except Exception as e:
-            # If not found, swallow; otherwise re-raise
-            msg = str(e).lower()
-            if "not found" in msg:
-                return
-            raise
+        await self.executor.run(self._delete_namespace_sync, tenant_id)
 
-    async def query(self, tenant_id: str, query: str, n: int = 6) -> Dict[str, Any]:
+    async def query(self, tenant_id: str, query: str, n: int = 6,
+                    where: Optional[Dict[str, Any]] = None,
+                    where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Returns a Chroma-style result dict:
           { 'ids': [...], 'documents': [[...]], 'metadatas': [[...]], 'distances': [[...]] }
         If empty, returns { 'documents': [] }.
         """
-        col = self._get_collection(tenant_id)
-        try:
-            if getattr(col, "count")() == 0:
-                return {"documents": []}
-        except Exception:
-            # Some client versions may not have count() — just attempt query.
-            pass
-
-        res = col.query(query_texts=[query], n_results=n)
-        # Normalize to a predictable shape
-        if not res or not res.get("documents"):
-            return {"documents": []}
-        return res
+        return await self.executor.run(self._query_sync, tenant_id, [query], n, None, where, where_document)
 
-    async def search(self, tenant_id: int, query: str, k: int = 6) -> List[Dict[str, Any]]:
+    async def search(self, tenant_id: int, query: str, k: int = 6,
+                     where: Optional[Dict[str, Any]] = None,
+                     where_document: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """
         Convenience: returns a simplified list of {text, metadata, score} for top-k.
+        `where` (metadata, e.g. {"language": "hi"} or {"kind": "catalog"}) and
+        `where_document` (e.g. {"$contains": "AC-200"}) are Chroma filters.
+        Results are cached until the tenant's collection changes (see rag_query_cache).
+        """
+        return (await self.search_many(tenant_id, [query], k=k, where=where, where_document=where_document))[0]
+
+    async def search_many(self, tenant_id: int, queries: List[str], k: int = 6,
+                          where: Optional[Dict[str, Any]] = None,
+                          where_document: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        `search` for several queries at once: cache misses are embedded as one
+        batch and sent to Chroma in a single query call. Results keep the order of `queries`.
         """
         tenant_id = str(tenant_id)
-        raw = await self.query(tenant_id, query, n=k)
+        cache = self.query_cache
+        version = await cache.aversion(tenant_id)
+        filters = filter_key(where, where_document)
+        results: List[Optional[List[Dict[str, Any]]]] = [cache.get(tenant_id, version, q, k, filters) for q in queries]
+        pending = list(dict.fromkeys(q for q, r in zip(queries, results) if r is None))
+
+        found: Dict[str, List[Dict[str, Any]]] = {}
+        vectors: Optional[List[List[float]]] = None
+        if pending and cache.semantic:
+            vectors = await self.executor.run(get_embedder().embed_queries, pending)
+            misses, miss_vectors = [], []
+            for q, vec in zip(pending, vectors):
+                hit = cache.get_similar(tenant_id, version, vec, k, filters)
+                if hit is not None:
+                    found[q] = hit
+                else:
+                    misses.append(q)
+                    miss_vectors.append(vec)
+            pending, vectors = misses, miss_vectors
+
+        if pending:
+            raw = await self.executor.run(self._query_sync, tenant_id, pending, k, vectors, where, where_document)
+            for i, q in enumerate(pending):
+                out = self._to_results(raw, i)
+                cache.put(tenant_id, version, q, k, out, vectors[i] if vectors else None, filters)
+                found[q] = out
+
+        return [list(r if r is not None else found[q]) for q, r in zip(queries, results)]
+
+    @staticmethod
+    def _to_results(raw: Dict[str, Any], i: int) -> List[Dict[str, Any]]:
+        """Flatten the `i`-th query of a Chroma result into [{text, metadata, score}]."""
         docs = raw.get("documents") or []
         metas = raw.get("metadatas") or []
         dists = raw.get("distances") or []
+        ids = raw.get("ids") or []
         out: List[Dict[str, Any]] = []
-        if not docs:
+        if not docs or i >= len(docs):
             return out
 
-        # Chroma returns lists-of-lists (per query); we issued a single query, so index 0.
-        docs0 = docs[0] if docs and isinstance(docs[0], list) else docs
-        metas0 = metas[0] if metas and isinstance(metas[0], list) else metas
-        dists0 = dists[0] if dists and isinstance(dists[0], list) else dists
-
-        for i, text in enumerate(docs0):
-            meta = metas0[i] if i < len(metas0) else {}
-            score = dists0[i] if i < len(dists0) else None
-            out.append({"text": text, "metadata": meta, "score": score})
+        # Chroma returns lists-of-lists, one per query text
+        docs_i = docs[i] if isinstance(docs[i], list) else docs
+        metas_i = (metas[i] if i < len(metas) and isinstance(metas[i], list) else metas) or []
+        dists_i = (dists[i] if i < len(dists) and isinstance(dists[i], list) else dists) or []
+        ids_i = (ids[i] if i < len(ids) and isinstance(ids[i], list) else ids) or []
+
+        for j, text in enumerate(docs_i):
+            meta = metas_i[j] if j < len(metas_i) else {}
+            score = dists_i[j] if j < len(dists_i) else None
+            doc_id = ids_i[j] if j < len(ids_i) else None
+            out.append({"id": doc_id, "text": text, "metadata": meta, "score": score})
         return out
 
+    async def hybrid_search(self, tenant_id: int, query: str, k: int = 6,
+                            where: Optional[Dict[str, Any]] = None,
+                            where_document: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Vector + BM25 keyword search fused with reciprocal-rank fusion."""
+        return (await self.hybrid_search_many(tenant_id, [query], k=k, where=where, where_document=where_document))[0]
+
+    async def hybrid_search_many(self, tenant_id: int, queries: List[str], k: int = 6,
+                                 where: Optional[Dict[str, Any]] = None,
+                                 where_document: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        `hybrid_search` for several queries: one batched vector search plus one
+        keyword pass. `score` in the results is the fused RRF score (higher is better).
+        """
+        candidates = max(k, RAG_HYBRID_CANDIDATES)
+        dense = await self.search_many(tenant_id, queries, k=candidates, where=where, where_document=where_document)
+        lexical = await self.executor.run(
+            self._lexical_search_many, str(tenant_id), queries, candidates, where, where_document
+        )
+        return [self._rrf(d, l, k) for d, l in zip(dense, lexical)]
+
+    def _lexical_search_many(self, tenant_id: str, queries: List[str], k: int,
+                             where: Optional[Dict[str, Any]] = None,
+                             where_document: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        self._ensure_lexical(tenant_id)
+        return [lexical_index.search(tenant_id, q, k, where, where_document) for q in queries]
+
+    @staticmethod
+    def _rrf(dense: List[Dict[str, Any]], lexical: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+        fused: Dict[str, Dict[str, Any]] = {}
+        for ranking in (dense, lexical):
+            for rank, item in enumerate(ranking):
+                key = item.get("id") or item.get("text")
+                entry = fused.setdefault(key, {**item, "score": 0.0})
+                entry["score"] += 1.0 / (RAG_RRF_K + rank + 1)
+        return sorted(fused.values(), key=lambda r: r["score"], reverse=True)[:k]
+
     async def answer(self, tenant_id: str, query: str) -> Dict[str, Any]:
         """
         Extremely simple “answer” — stitches top document text.
@@ -196,46 +374,19 @@ class RAGService:
 rag = RAGService()
 
 async def add_catalog_to_rag(tenant_id: int):
+    """Full incremental sync of the tenant's catalog; only changed rows are re-embedded."""
+    from services.catalog_sync import sync_catalog
+
     db: Session = SessionLocal()
     try:
         print("Adding catalog to RAG for tenant:", tenant_id)
         if not tenant_id:
             return {"ok": False, "message": "tenant ID not provided"}
 
-        catalogs = db.query(BusinessCatalog).filter(
-            BusinessCatalog.tenant_id == tenant_id).all()
-        print(f"Found {len(catalogs)} catalogs for tenant {tenant_id}")
-        if not catalogs:
+        result = await rag.executor.run(sync_catalog, tenant_id)
+        if not (result.upserted or result.unchanged):
             return {"ok": False, "message": "No catalogs found"}
 
-        # Prepare documents for RAG
-        documents = []
-        for catalog in catalogs:
-            txt = (
-                    f"Name: {catalog.name}\n"
-                    f"Description: {catalog.description or 'Not available'}\n"
-                    f"Category: {catalog.category or 'Uncategorized'}\n"
-                    f"Type: {catalog.item_type or 'Unknown'}\n"
-                    f"Price: {catalog.price if catalog.price is not None else 'N/A'} {catalog.currency or 'USD'}\n"
-                    f"Discount: {catalog.discount if catalog.discount is not None else '0%'}\n"
-                    f"Source URL: {catalog.source_url or 'N/A'}\n"
-                    f"Image URL: {catalog.image_url or 'N/A'}\n"
-                    f"Created: {catalog.created_at.strftime('%Y-%m-%d %H:%M') if catalog.created_at else 'Unknown'}\n"
-                    f"Updated: {catalog.updated_at.strftime('%Y-%m-%d %H:%M') if catalog.updated_at else 'Unknown'}"
-                )
-            
-            documents.append({
-                "id": str(catalog.id),  # RAG systems usually expect string IDs
-                "text": txt,
-                "source_url": catalog.source_url,
-                "version": "1.0",  # You can make this dynamic if needed
-                "language": "en",  # Adjust based on tenant or catalog metadata
-            })
-
-        # Add to RAG system
-        tenant_id = catalogs[0].tenant_id  # Assuming all have same tenant_id
-        await rag.add_documents(tenant_id, documents)
-        print(f"Added {len(documents)} documents to RAG for tenant {tenant_id}")
         tenant = db.query(Tenant).filter(Tenant.id == tenant_id).first()
         tenant.rag_enabled = True
         tenant.rag_updated_at = func.now()
@@ -243,7 +394,9 @@ async def add_catalog_to_rag(tenant_id: int):
         db.commit()
         return {
             "ok": True,
-            "added_count": len(documents),
+            "added_count": result.upserted,
+            "deleted_count": result.deleted,
+            "unchanged_count": result.unchanged,
             "tenant_id": tenant_id,
         }
 
@@ -252,4 +405,4 @@ async def add_catalog_to_rag(tenant_id: int):
         db.rollback()
         return {"ok": False, "message": str(e)}
     finally:
-        db.close() 
+        db.close()
@@ -0,0 +1,66 @@
+# server/services/rag_executor.py
+"""
+Bounded thread pool for blocking RAG work (Chroma queries/writes, embedding).
+
+The Chroma client and the ONNX embedding model are synchronous; running
+them on the event loop stalled every webhook in the process behind a single
+search. RAGService submits that work here instead. At most
+RAG_EXECUTOR_WORKERS calls run at once (ONNX and hnswlib release the GIL,
+so they run in parallel); the rest wait in the pool's queue, whose depth is
+exported as rag_executor_queue_depth.
+"""
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from prometheus_client import Gauge
+
+RAG_EXECUTOR_WORKERS = int(os.getenv("RAG_EXECUTOR_WORKERS", "4"))
+
+rag_executor_queue_depth = Gauge("rag_executor_queue_depth", "RAG calls waiting for a worker thread")
+rag_executor_active = Gauge("rag_executor_active", "RAG calls running on worker threads")
+
+
+class RAGExecutor:
+    def __init__(self, max_workers: int = RAG_EXECUTOR_WORKERS):
+        self.max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="rag")
+            return self._pool
+
+    @staticmethod
+    def _tracked(fn: Callable[..., Any]) -> Any:
+        rag_executor_queue_depth.dec()
+        rag_executor_active.inc()
+        try:
+            return fn()
+        finally:
+            rag_executor_active.dec()
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run `fn(*args, **kwargs)` on the pool and await its result."""
+        loop = asyncio.get_running_loop()
+        rag_executor_queue_depth.inc()
+        call = functools.partial(fn, *args, **kwargs)
+        try:
+            future = loop.run_in_executor(self.pool, self._tracked, call)
+        except RuntimeError:
+            # Pool shut down before the call was scheduled
+            rag_executor_queue_depth.dec()
+            raise
+        return await future
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
@@ -0,0 +1,166 @@
+# server/services/rag_query_cache.py
+"""
+Result cache for RAGService.search.
+
+Entries are keyed by (tenant_id, collection version, normalised query, k,
+metadata filters). The version is a Redis counter per tenant that every
+write to the tenant's collection bumps, so stale results are never served
+after an ingest; other processes notice a bump within RAG_VERSION_LOCAL_TTL
+seconds.
+
+With RAG_SEMANTIC_CACHE=true a second tier keeps the query embeddings of
+recent searches per (tenant, version, k, filters) and reuses a result when
+a new query's embedding has cosine similarity >= RAG_SEMANTIC_THRESHOLD.
+"""
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from prometheus_client import Counter
+
+from utils.cache import TTLCache
+from utils.redis_client import get_async_redis, get_sync_redis
+
+RAG_QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", "2048"))
+RAG_QUERY_CACHE_TTL = float(os.getenv("RAG_QUERY_CACHE_TTL", "600"))
+RAG_VERSION_LOCAL_TTL = float(os.getenv("RAG_VERSION_LOCAL_TTL", "2"))
+RAG_SEMANTIC_CACHE = os.getenv("RAG_SEMANTIC_CACHE", "false").lower() == "true"
+RAG_SEMANTIC_THRESHOLD = float(os.getenv("RAG_SEMANTIC_THRESHOLD", "0.95"))
+RAG_SEMANTIC_MAX_PER_TENANT = int(os.getenv("RAG_SEMANTIC_MAX_PER_TENANT", "256"))
+
+VERSION_KEY = "wa_rag_version:{}"
+
+rag_query_cache_total = Counter(
+    "rag_query_cache_total", "RAG search cache lookups", ["result"]
+)
+
+_WHITESPACE = re.compile(r"\s+")
+_EDGE_PUNCT = " \t?!.,;:\"'¿¡।"
+
+Results = List[Dict[str, Any]]
+
+
+def normalize_query(query: str) -> str:
+    q = unicodedata.normalize("NFC", query or "").casefold()
+    return _WHITESPACE.sub(" ", q).strip(_EDGE_PUNCT)
+
+
+def filter_key(where: Optional[dict] = None, where_document: Optional[dict] = None) -> str:
+    """Stable cache-key form of Chroma `where` / `where_document` filters."""
+    if not where and not where_document:
+        return ""
+    return json.dumps([where or {}, where_document or {}], sort_keys=True, separators=(",", ":"), default=str)
+
+
+class RAGQueryCache:
+    def __init__(
+        self,
+        maxsize: int = RAG_QUERY_CACHE_SIZE,
+        ttl: float = RAG_QUERY_CACHE_TTL,
+        semantic: bool = RAG_SEMANTIC_CACHE,
+        threshold: float = RAG_SEMANTIC_THRESHOLD,
+    ):
+        self.ttl = ttl
+        self.semantic = semantic
+        self.threshold = threshold
+        self._results = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._versions = TTLCache(maxsize=maxsize, ttl=RAG_VERSION_LOCAL_TTL)
+        # (tenant, version, k, filters) -> recent (unit query vector, expires_at, results)
+        self._near: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._near_lock = threading.Lock()
+
+    # --- versions ---
+    def version(self, tenant_id: Hashable) -> Optional[Hashable]:
+        """Current collection version, or None when it cannot be read (caching is skipped)."""
+        version = self._versions.get(tenant_id)
+        if version is not None:
+            return version
+        try:
+            version = int(get_sync_redis().get(VERSION_KEY.format(tenant_id)) or 0)
+        except Exception as e:
+            print(f"[RAG CACHE] version read failed for tenant {tenant_id}: {e}")
+            return None
+        self._versions.set(tenant_id, version)
+        return version
+
+    async def aversion(self, tenant_id: Hashable) -> Optional[Hashable]:
+        """`version` for the event loop: the Redis read goes through the async client."""
+        version = self._versions.get(tenant_id)
+        if version is not None:
+            return version
+        try:
+            version = int(await get_async_redis().get(VERSION_KEY.format(tenant_id)) or 0)
+        except Exception as e:
+            print(f"[RAG CACHE] version read failed for tenant {tenant_id}: {e}")
+            return None
+        self._versions.set(tenant_id, version)
+        return version
+
+    def bump(self, tenant_id: Hashable) -> None:
+        """Invalidate every cached search of the tenant after its collection changed."""
+        try:
+            version = get_sync_redis().incr(VERSION_KEY.format(tenant_id))
+        except Exception as e:
+            # Other processes keep their entries until TTL, but this one stops serving them
+            print(f"[RAG CACHE] version bump failed for tenant {tenant_id}: {e}")
+            version = f"local-{uuid.uuid4().hex}"
+        self._versions.set(tenant_id, version)
+
+    # --- exact tier ---
+    def get(self, tenant_id, version, query: str, k: int, filters: str = "") -> Optional[Results]:
+        if version is None:
+            return None
+        hit = self._results.get((tenant_id, version, normalize_query(query), k, filters))
+        if hit is not None:
+            rag_query_cache_total.labels(result="exact").inc()
+        return hit
+
+    # --- semantic tier ---
+    def get_similar(self, tenant_id, version, query_vec: Sequence[float], k: int,
+                    filters: str = "") -> Optional[Results]:
+        if version is None or not self.semantic or query_vec is None:
+            return None
+        import numpy as np
+
+        entries = self._near.get((tenant_id, version, k, filters))
+        if not entries:
+            return None
+        now = time.monotonic()
+        with self._near_lock:
+            live = [(vec, results) for vec, expires_at, results in entries if expires_at > now]
+        if not live:
+            return None
+        q = np.asarray(query_vec, dtype=np.float32)
+        q /= (np.linalg.norm(q) or 1.0)
+        sims = np.vstack([vec for vec, _ in live]) @ q
+        best = int(np.argmax(sims))
+        if sims[best] >= self.threshold:
+            rag_query_cache_total.labels(result="semantic").inc()
+            return live[best][1]
+        return None
+
+    def put(self, tenant_id, version, query: str, k: int, results: Results,
+            query_vec: Optional[Sequence[float]] = None, filters: str = "") -> None:
+        rag_query_cache_total.labels(result="miss").inc()
+        if version is None:
+            return
+        self._results.set((tenant_id, version, normalize_query(query), k, filters), results)
+        if not self.semantic or query_vec is None:
+            return
+        import numpy as np
+
+        vec = np.asarray(query_vec, dtype=np.float32)
+        vec /= (np.linalg.norm(vec) or 1.0)
+        key = (tenant_id, version, k, filters)
+        with self._near_lock:
+            entries: Optional[Deque[Tuple[Any, float, Results]]] = self._near.get(key)
+            if entries is None:
+                entries = deque(maxlen=RAG_SEMANTIC_MAX_PER_TENANT)
+                self._near.set(key, entries)
+            entries.append((vec, time.monotonic() + self.ttl, results))
@@ -0,0 +1,329 @@
+# server/services/rag_storage.py
+"""
+Placement of tenant chunks in Chroma collections.
+
+RAG_STORAGE_MODE=dedicated (default) keeps one collection per tenant
+(`tenant-{id}`), as before. With RAG_STORAGE_MODE=sharded, tenants share
+RAG_SHARD_COUNT collections (`shared-{n}`, chosen by a stable hash of the
+tenant id); their chunk ids are prefixed with the tenant id and every read
+is scoped with a `tenant_id` metadata filter, so the number of HNSW indexes
+(and the client's memory and open time) follows the data, not the tenant
+count. A tenant whose chunk count passes RAG_PROMOTE_THRESHOLD is moved
+to a dedicated collection; an existing `tenant-{id}` collection always
+takes precedence, so both layouts can coexist during a migration
+(see workers/rag_migrate.py). In sharded mode only `promote()` creates
+`tenant-{id}`: a reader with a stale placement must not recreate an empty
+one after a demotion, or it would hide the tenant's shard rows everywhere.
+
+Moves hold a Redis lock per tenant, so only one process copies a tenant at
+a time, and remove from the source only the ids they copied. A writer that
+resolved the old placement just before the move can still land a batch in
+the source; the move sweeps it over in a further pass instead of deleting it.
+
+TenantPartition hides the layout: callers pass and receive plain chunk ids
+and their own `where` filters.
+"""
+import os
+import uuid
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.cache import TTLCache
+from utils.redis_client import get_sync_redis
+
+RAG_STORAGE_MODE = os.getenv("RAG_STORAGE_MODE", "dedicated").lower()  # dedicated|sharded
+RAG_SHARD_COUNT = int(os.getenv("RAG_SHARD_COUNT", "16"))
+RAG_PROMOTE_THRESHOLD = int(os.getenv("RAG_PROMOTE_THRESHOLD", "5000"))
+# How long a process trusts its view of where a tenant lives (promotions by another process)
+RAG_PLACEMENT_TTL = float(os.getenv("RAG_PLACEMENT_TTL", "30"))
+RAG_MIGRATE_PAGE = int(os.getenv("RAG_MIGRATE_PAGE", "500"))
+# Held (and extended per page) while a tenant is copied between layouts
+RAG_MOVE_LOCK_TTL = int(os.getenv("RAG_MOVE_LOCK_TTL", "300"))
+# Copy/delete passes per move; later passes pick up batches written mid-move
+RAG_MOVE_PASSES = int(os.getenv("RAG_MOVE_PASSES", "3"))
+
+TENANT_KEY = "tenant_id"
+MOVE_LOCK_KEY = "wa_rag_move:{}"
+
+# Release / extend the move lock only while it still holds this move's token
+_LOCK_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+_LOCK_EXTEND_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def _not_found_errors() -> tuple:
+    """What Chroma raises for a missing collection: ValueError before 0.6, typed errors after."""
+    try:
+        from chromadb import errors  # type: ignore
+    except ImportError:
+        return (ValueError,)
+    typed = (getattr(errors, n, None) for n in ("NotFoundError", "InvalidCollectionException"))
+    return (ValueError,) + tuple(t for t in typed if t is not None)
+
+
+_NOT_FOUND = _not_found_errors()
+
+
+def dedicated_name(tenant_id) -> str:
+    return f"tenant-{tenant_id}"
+
+
+def shard_name(tenant_id, shards: int = RAG_SHARD_COUNT) -> str:
+    return f"shared-{zlib.crc32(str(tenant_id).encode('utf-8')) % shards:02d}"
+
+
+class TenantPartition:
+    """One tenant's slice of a collection (the whole collection when dedicated)."""
+
+    def __init__(self, tenant_id, collection, shared: bool):
+        self.tenant_id = str(tenant_id)
+        self.collection = collection
+        self.shared = shared
+        self._prefix = f"{self.tenant_id}:"
+
+    # --- id / filter mapping ---
+    def _store_ids(self, ids: List[str]) -> List[str]:
+        return [self._prefix + i for i in ids] if self.shared else list(ids)
+
+    def _doc_ids(self, ids: List[str]) -> List[str]:
+        if not self.shared:
+            return list(ids)
+        n = len(self._prefix)
+        return [i[n:] if i.startswith(self._prefix) else i for i in ids]
+
+    def _store_metadatas(self, metadatas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not self.shared:
+            return metadatas
+        return [{**(m or {}), TENANT_KEY: self.tenant_id} for m in metadatas]
+
+    def scope(self, where: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        if not self.shared:
+            return where or None
+        own = {TENANT_KEY: self.tenant_id}
+        return {"$and": [own, where]} if where else own
+
+    # --- operations ---
+    def upsert(self, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]], embeddings) -> None:
+        self.collection.upsert(
+            ids=self._store_ids(ids), documents=texts,
+            metadatas=self._store_metadatas(metadatas), embeddings=embeddings,
+        )
+
+    def delete(self, ids: List[str]) -> None:
+        self.collection.delete(ids=self._store_ids(ids))
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, **kwargs) -> Dict[str, Any]:
+        if ids is not None:
+            res = self.collection.get(ids=self._store_ids(ids), where=where or None, **kwargs)
+        else:
+            res = self.collection.get(where=self.scope(where), **kwargs)
+        res["ids"] = self._doc_ids(res.get("ids") or [])
+        return res
+
+    def query(self, n: int, query_texts=None, query_embeddings=None,
+              where: Optional[Dict[str, Any]] = None,
+              where_document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {"n_results": n}
+        scoped = self.scope(where)
+        if scoped:
+            kwargs["where"] = scoped
+        if where_document:
+            kwargs["where_document"] = where_document
+        if query_embeddings:
+            res = self.collection.query(query_embeddings=query_embeddings, **kwargs)
+        else:
+            res = self.collection.query(query_texts=query_texts, **kwargs)
+        if res and res.get("ids"):
+            res["ids"] = [self._doc_ids(row) for row in res["ids"]]
+        return res
+
+    def is_empty(self) -> bool:
+        if not self.shared:
+            return self.collection.count() == 0
+        return not self.collection.get(where=self.scope(), limit=1, include=[]).get("ids")
+
+    def count(self) -> int:
+        if not self.shared:
+            return self.collection.count()
+        return len(self.collection.get(where=self.scope(), include=[]).get("ids") or [])
+
+    def holds_at_least(self, n: int) -> bool:
+        """Cheaper than count() for a shared tenant: reads one id at offset n-1."""
+        if not self.shared:
+            return self.collection.count() >= n
+        return bool(self.collection.get(where=self.scope(), offset=n - 1, limit=1, include=[]).get("ids"))
+
+
+class VectorStorage:
+    def __init__(self, client: Callable[[], Any], mode: str = RAG_STORAGE_MODE,
+                 shards: int = RAG_SHARD_COUNT, promote_threshold: int = RAG_PROMOTE_THRESHOLD):
+        self._client = client
+        self.mode = mode
+        self.shards = shards
+        self.promote_threshold = promote_threshold
+        self._placement = TTLCache(maxsize=8192, ttl=RAG_PLACEMENT_TTL)
+
+    @property
+    def client(self):
+        return self._client()
+
+    def _get_collection(self, name: str):
+        """The named collection, or None when it does not exist."""
+        try:
+            return self.client.get_collection(name=name)
+        except _NOT_FOUND:
+            return None
+
+    def _dedicated_exists(self, tenant_id) -> bool:
+        return self._get_collection(dedicated_name(tenant_id)) is not None
+
+    def _shard_partition(self, tenant_id: str) -> TenantPartition:
+        return TenantPartition(tenant_id, self.client.get_or_create_collection(name=shard_name(tenant_id, self.shards)), True)
+
+    def _dedicated_partition(self, tenant_id: str) -> TenantPartition:
+        """Dedicated mode: the tenant's collection, unless a sharded process moved it into a shard."""
+        collection = self._get_collection(dedicated_name(tenant_id))
+        if collection is None:
+            shard = self._get_collection(shard_name(tenant_id, self.shards))
+            if shard is not None:
+                part = TenantPartition(tenant_id, shard, True)
+                if not part.is_empty():
+                    return part
+            collection = self.client.get_or_create_collection(name=dedicated_name(tenant_id))
+        return TenantPartition(tenant_id, collection, False)
+
+    def partition(self, tenant_id, fresh: bool = False) -> TenantPartition:
+        """
+        Where the tenant lives. Writers pass fresh=True so a promotion done by
+        another process is seen immediately rather than after RAG_PLACEMENT_TTL.
+        """
+        tenant_id = str(tenant_id)
+        if self.mode != "sharded":
+            return self._dedicated_partition(tenant_id)
+        shared = None if fresh else self._placement.get(tenant_id)
+        if shared is None:
+            shared = not self._dedicated_exists(tenant_id)
+            self._placement.set(tenant_id, shared)
+        if not shared:
+            collection = self._get_collection(dedicated_name(tenant_id))
+            if collection is not None:
+                return TenantPartition(tenant_id, collection, False)
+            # Demoted since the placement was cached; never recreate it here
+            self._placement.set(tenant_id, True)
+        return self._shard_partition(tenant_id)
+
+    def drop(self, tenant_id) -> None:
+        """Remove every chunk of the tenant, whichever layout holds it."""
+        tenant_id = str(tenant_id)
+        try:
+            self.client.delete_collection(name=dedicated_name(tenant_id))
+        except _NOT_FOUND:
+            pass
+        if self.mode == "sharded":
+            shard = self.client.get_or_create_collection(name=shard_name(tenant_id, self.shards))
+            shard.delete(where={TENANT_KEY: tenant_id})
+        self._placement.pop(tenant_id)
+
+    def maybe_promote(self, part: TenantPartition) -> bool:
+        """Move a shared tenant to its own collection once it outgrows the shard."""
+        if not part.shared or self.promote_threshold <= 0 or not part.holds_at_least(self.promote_threshold):
+            return False
+        if self.promote(part.tenant_id) is None:
+            return False  # another process is moving it; its sweep picks up this batch
+        # Later batches written through the same partition go to the new collection
+        part.collection = self.client.get_collection(name=dedicated_name(part.tenant_id))
+        part.shared = False
+        return True
+
+    def _copy(self, source: TenantPartition, target: TenantPartition, extend: Callable[[], Any]) -> List[str]:
+        """Copy every chunk of `source` into `target`; returns the copied ids."""
+        copied: List[str] = []
+        while True:
+            page = source.get(include=["documents", "metadatas", "embeddings"],
+                              limit=RAG_MIGRATE_PAGE, offset=len(copied))
+            ids = page.get("ids") or []
+            if not ids:
+                return copied
+            metadatas = [{k: v for k, v in (m or {}).items() if k != TENANT_KEY} for m in page.get("metadatas") or []]
+            target.upsert(ids, page.get("documents") or [], metadatas, page.get("embeddings"))
+            copied.extend(ids)
+            extend()
+
+    def _move(self, tenant_id: str, source: TenantPartition, target: TenantPartition,
+              extend: Callable[[], Any]) -> int:
+        """Copy, then delete exactly the copied ids, until the source holds nothing of the tenant."""
+        moved = 0
+        for _ in range(RAG_MOVE_PASSES):
+            ids = self._copy(source, target, extend)
+            if not ids:
+                break
+            for i in range(0, len(ids), RAG_MIGRATE_PAGE):
+                source.delete(ids[i:i + RAG_MIGRATE_PAGE])
+            moved += len(ids)
+        else:
+            if not source.is_empty():
+                print(f"[RAG STORAGE] tenant {tenant_id} still receiving writes in its old layout after {RAG_MOVE_PASSES} passes")
+        return moved
+
+    def _locked_move(self, tenant_id: str, move: Callable[[Callable[[], Any]], int]) -> Optional[int]:
+        """Run `move(extend)` under the tenant's move lock; None if another process holds it."""
+        r = get_sync_redis()
+        key = MOVE_LOCK_KEY.format(tenant_id)
+        token = uuid.uuid4().hex
+        if not r.set(key, token, nx=True, ex=RAG_MOVE_LOCK_TTL):
+            print(f"[RAG STORAGE] tenant {tenant_id} is being moved by another process; skipping")
+            return None
+        extend_lock = r.register_script(_LOCK_EXTEND_LUA)
+        try:
+            return move(lambda: extend_lock(keys=[key], args=[token, RAG_MOVE_LOCK_TTL]))
+        finally:
+            r.register_script(_LOCK_RELEASE_LUA)(keys=[key], args=[token])
+
+    def promote(self, tenant_id) -> Optional[int]:
+        """
+        Copy a tenant from its shard into `tenant-{id}`, then remove the copied
+        rows from the shard. None if another process is already moving it.
+        """
+        tenant_id = str(tenant_id)
+
+        def move(extend) -> int:
+            shard = self._shard_partition(tenant_id)
+            # From here on writers that resolve placement (fresh) go to the new collection
+            dedicated = TenantPartition(tenant_id, self.client.get_or_create_collection(name=dedicated_name(tenant_id)), False)
+            copied = self._move(tenant_id, shard, dedicated, extend)
+            self._placement.set(tenant_id, False)
+            return copied
+
+        copied = self._locked_move(tenant_id, move)
+        if copied is not None:
+            print(f"[RAG STORAGE] promoted tenant {tenant_id} to {dedicated_name(tenant_id)} ({copied} chunks)")
+        return copied
+
+    def demote(self, tenant_id) -> Optional[int]:
+        """
+        Copy a dedicated collection into the tenant's shard, then delete the
+        collection. None if another process is already moving the tenant.
+        """
+        tenant_id = str(tenant_id)
+
+        def move(extend) -> int:
+            dedicated = TenantPartition(tenant_id, self.client.get_collection(name=dedicated_name(tenant_id)), False)
+            shard = self._shard_partition(tenant_id)
+            copied = self._move(tenant_id, dedicated, shard, extend)
+            self.client.delete_collection(name=dedicated_name(tenant_id))
+            self._placement.set(tenant_id, True)
+            return copied
+
+        copied = self._locked_move(tenant_id, move)
+        if copied is not None:
+            print(f"[RAG STORAGE] moved tenant {tenant_id} into {shard_name(tenant_id, self.shards)} ({copied} chunks)")
+        return copied
@@ -0,0 +1,152 @@
+# server/services/tenant_resolver.py
+"""
+Business WhatsApp number → tenant_id resolution for inbound messages.
+
+Read-through: process-local TTL cache → Redis hash → Postgres. Numbers are
+keyed by their last 10 digits so "+91 98xxxx", "9198xxxx" and "98xxxx" all
+land on the same entry. Unknown numbers return None (and are remembered
+locally for TENANT_MISS_TTL seconds) instead of falling back to a tenant.
+
+`invalidate_business_number` bumps a version key in Redis; every process
+compares it with the version its local cache was filled under at most once
+per TENANT_VERSION_CHECK seconds and clears the local tier when it moved,
+so a changed number stops routing to its old tenant within that interval
+in the webhook worker too, not only in the API process that changed it.
+"""
+import asyncio
+import os
+import re
+import time
+from typing import Dict, Optional
+
+from prometheus_client import Counter
+from sqlalchemy import func
+
+from database import SessionLocal
+from models import BusinessProfile
+from utils.cache import TTLCache
+from utils.redis_client import get_async_redis, get_sync_redis
+
+TENANT_MAP_KEY = os.getenv("TENANT_MAP_KEY", "wa_tenant_by_number")
+TENANT_LOCAL_TTL = float(os.getenv("TENANT_LOCAL_TTL", "300"))
+TENANT_MISS_TTL = float(os.getenv("TENANT_MISS_TTL", "60"))
+TENANT_VERSION_KEY = os.getenv("TENANT_VERSION_KEY", "wa_tenant_by_number:version")
+TENANT_VERSION_CHECK = float(os.getenv("TENANT_VERSION_CHECK", "1"))
+
+tenant_lookup_total = Counter(
+    "tenant_lookup_total", "Receiver number to tenant lookups", ["result"]
+)
+
+_MISS = 0  # tenant ids start at 1, so 0 marks a cached miss
+_local = TTLCache(maxsize=50000, ttl=TENANT_LOCAL_TTL)
+# Version of TENANT_VERSION_KEY the local cache was filled under, and when it was last compared
+_local_version: Optional[str] = None
+_version_checked_at = 0.0
+
+
+def normalize_number(number: Optional[str]) -> str:
+    digits = re.sub(r"\D", "", number or "")
+    return digits[-10:]
+
+
+async def _sync_local_version(r) -> None:
+    """Drop the local tier if any process invalidated a number since it was filled."""
+    global _local_version, _version_checked_at
+    now = time.monotonic()
+    if now - _version_checked_at < TENANT_VERSION_CHECK:
+        return
+    _version_checked_at = now
+    version = await r.get(TENANT_VERSION_KEY)
+    if version != _local_version:
+        _local.clear()
+        _local_version = version
+
+
+def _load_from_db(key: str) -> Optional[int]:
+    db = SessionLocal()
+    try:
+        # Stored numbers vary in formatting ("+91 98765 43210"); matches idx_business_profiles_whatsapp10
+        profile = (
+            db.query(BusinessProfile.tenant_id)
+            .filter(func.right(func.regexp_replace(BusinessProfile.business_whatsapp, r"\D", "", "g"), 10) == key)
+            .first()
+        )
+        return profile.tenant_id if profile else None
+    finally:
+        db.close()
+
+
+async def resolve_tenant_id(receiver: str) -> Optional[int]:
+    """Return the tenant that owns `receiver`, or None if no business profile uses it."""
+    key = normalize_number(receiver)
+    if not key:
+        tenant_lookup_total.labels(result="miss").inc()
+        return None
+
+    r = get_async_redis()
+    await _sync_local_version(r)
+    cached = _local.get(key)
+    if cached is not None:
+        tenant_lookup_total.labels(result="local" if cached != _MISS else "miss").inc()
+        return cached or None
+
+    value = await r.hget(TENANT_MAP_KEY, key)
+    if value is not None:
+        tenant_id = int(value)
+        _local.set(key, tenant_id)
+        tenant_lookup_total.labels(result="redis").inc()
+        return tenant_id
+
+    tenant_id = await asyncio.to_thread(_load_from_db, key)
+    if tenant_id is None:
+        _local.set(key, _MISS, ttl=TENANT_MISS_TTL)
+        tenant_lookup_total.labels(result="miss").inc()
+        print(f"[TENANT] No business profile for receiver {receiver}")
+        return None
+    _local.set(key, tenant_id)
+    await r.hset(TENANT_MAP_KEY, key, tenant_id)
+    tenant_lookup_total.labels(result="db").inc()
+    return tenant_id
+
+
+async def warm_tenant_cache() -> int:
+    """Load every business number into the local and Redis maps; returns the count."""
+
+    def load_all() -> Dict[str, int]:
+        db = SessionLocal()
+        try:
+            rows = db.query(BusinessProfile.business_whatsapp, BusinessProfile.tenant_id).all()
+        finally:
+            db.close()
+        mapping = {}
+        for number, tenant_id in rows:
+            key = normalize_number(number)
+            if key:
+                mapping[key] = tenant_id
+        return mapping
+
+    mapping = await asyncio.to_thread(load_all)
+    for key, tenant_id in mapping.items():
+        _local.set(key, tenant_id)
+    if mapping:
+        await get_async_redis().hset(TENANT_MAP_KEY, mapping=mapping)
+    print(f"[TENANT] Warmed {len(mapping)} business numbers")
+    return len(mapping)
+
+
+def invalidate_business_number(*numbers: Optional[str]) -> None:
+    """
+    Forget cached mappings after a business profile's WhatsApp number is
+    created or changed, here and (via TENANT_VERSION_KEY) in every other process.
+    """
+    keys = [k for k in (normalize_number(n) for n in numbers) if k]
+    if not keys:
+        return
+    for key in keys:
+        _local.pop(key)
+    try:
+        r = get_sync_redis()
+        r.hdel(TENANT_MAP_KEY, *keys)
+        r.incr(TENANT_VERSION_KEY)
+    except Exception as e:
+        print(f"[TENANT] Failed to invalidate {keys}: {e}")
@@ -4,6 +4,7 @@ from models import Workflow
 from data_models.workflow_models import WorkflowCreate, WorkflowUpdate
 from fastapi import HTTPException
 from typing import Optional
+from utils.prompt_cache import invalidate_tenant_prompt
 
 def check_workflow_name_exists(db: Session, name: str, workflow_id: int):
     query = db.query(Workflow).filter(Workflow.name == name and Workflow.id != workflow_id)
@@ -22,6 +23,7 @@ def create_workflow(db: Session, tenant_id: int, workflow: WorkflowCreate):
     db.add(db_workflow)
     db.commit()
     db.refresh(db_workflow)
+    invalidate_tenant_prompt(tenant_id)
     return db_workflow
 
 def get_workflows_by_tenant(db: Session, tenant_id: int):
@@ -58,11 +60,14 @@ def update_workflow(db: Session, workflow_id: int, workflow: WorkflowUpdate):
 
     db.commit()
     db.refresh(db_workflow)
+    invalidate_tenant_prompt(db_workflow.tenant_id)
     return db_workflow
 
 def delete_workflow(db: Session, workflow_id: int):
     db_workflow = get_workflow(db, workflow_id)
+    tenant_id = db_workflow.tenant_id
     db.delete(db_workflow)
     db.commit()
+    invalidate_tenant_prompt(tenant_id)
     return {"message": "Workflow deleted successfully"}
 
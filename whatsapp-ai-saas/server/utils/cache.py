@@ -0,0 +1,113 @@
+# server/utils/cache.py
+"""
+Small caching primitives shared by hot read paths.
+
+TTLCache is a process-local LRU with per-entry expiry. TieredCache puts one
+in front of Redis so every API/webhook process shares the same entries,
+while the local tier absorbs repeat reads between Redis round trips.
+Redis errors degrade to a cache miss; callers always have a loader to fall
+back on.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class TieredCache:
+    """
+    Local TTLCache (short TTL) in front of Redis (long TTL) for str values.
+
+    `delete` clears Redis and the local tier of the calling process; other
+    processes drop their local copy within `local_ttl` seconds.
+    """
+
+    def __init__(self, namespace: str, ttl: int, local_ttl: float = 30.0, local_maxsize: int = 1024):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=local_maxsize, ttl=min(local_ttl, ttl))
+
+    def _key(self, key) -> str:
+        return f"{self.namespace}:{key}"
+
+    @staticmethod
+    def _redis():
+        from utils.redis_client import get_sync_redis
+        return get_sync_redis()
+
+    def get(self, key) -> Optional[str]:
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        try:
+            value = self._redis().get(self._key(key))
+        except Exception as e:
+            logger.warning("[Cache] redis get failed for %s: %s", self._key(key), e)
+            return None
+        if value is not None:
+            self.local.set(key, value)
+        return value
+
+    def set(self, key, value: str) -> None:
+        self.local.set(key, value)
+        try:
+            self._redis().set(self._key(key), value, ex=self.ttl)
+        except Exception as e:
+            logger.warning("[Cache] redis set failed for %s: %s", self._key(key), e)
+
+    def delete(self, key) -> None:
+        self.local.pop(key)
+        try:
+            self._redis().delete(self._key(key))
+        except Exception as e:
+            logger.warning("[Cache] redis delete failed for %s: %s", self._key(key), e)
+
+    def get_or_load(self, key, loader: Callable[[], str]) -> str:
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.set(key, value)
+        return value
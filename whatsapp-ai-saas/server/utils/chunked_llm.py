@@ -0,0 +1,102 @@
+# server/utils/chunked_llm.py
+"""
+Helpers for running LLM extraction over documents larger than one request.
+
+`split_text` cuts text into pieces of at most `max_tokens` tokens (tiktoken,
+see utils.context_builder), on paragraph and then sentence boundaries where
+possible, repeating up to `overlap_tokens` of trailing context at the start
+of the next piece so facts spanning a boundary are not lost.
+
+`map_chunks` runs an async function over the pieces concurrently, at most
+LLM_EXTRACT_CONCURRENCY at a time per event loop, keeping input order.
+"""
+import asyncio
+import os
+import re
+import weakref
+from typing import Awaitable, Callable, List, Sequence, TypeVar
+
+from utils.context_builder import count_tokens, truncate_tokens
+
+DOC_CHUNK_TOKENS = int(os.getenv("DOC_CHUNK_TOKENS", "2500"))
+DOC_CHUNK_OVERLAP = int(os.getenv("DOC_CHUNK_OVERLAP", "150"))
+LLM_EXTRACT_CONCURRENCY = int(os.getenv("LLM_EXTRACT_CONCURRENCY", "4"))
+
+_PARAGRAPHS = re.compile(r"\n\s*\n")
+_SENTENCES = re.compile(r"(?<=[.!?।])\s+")
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# One limiter per event loop (API process, RQ jobs running their own loops)
+_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _units(text: str, max_tokens: int) -> List[str]:
+    """Paragraphs, with any paragraph over `max_tokens` broken into sentences, then hard token cuts."""
+    units: List[str] = []
+    for para in _PARAGRAPHS.split(text):
+        para = para.strip()
+        if not para:
+            continue
+        if count_tokens(para) <= max_tokens:
+            units.append(para)
+            continue
+        for sentence in _SENTENCES.split(para):
+            while sentence:
+                if count_tokens(sentence) <= max_tokens:
+                    units.append(sentence)
+                    break
+                # Decoding a token prefix can end in half a character
+                head = truncate_tokens(sentence, max_tokens).rstrip("\ufffd")
+                if not head or not sentence.startswith(head):
+                    head = sentence[: max_tokens * 2]
+                units.append(head)
+                sentence = sentence[len(head):].lstrip()
+    return units
+
+
+def split_text(text: str, max_tokens: int = DOC_CHUNK_TOKENS, overlap_tokens: int = DOC_CHUNK_OVERLAP) -> List[str]:
+    if not text or not text.strip():
+        return []
+    overlap_tokens = min(overlap_tokens, max_tokens // 4)
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for unit in _units(text, max_tokens):
+        cost = count_tokens(unit) + 1
+        if current and current_tokens + cost > max_tokens:
+            chunks.append("\n\n".join(current))
+            # Carry the trailing units that fit in the overlap into the next chunk
+            carried, carried_tokens = [], 0
+            for prev in reversed(current):
+                prev_tokens = count_tokens(prev) + 1
+                if carried_tokens + prev_tokens > overlap_tokens:
+                    break
+                carried.insert(0, prev)
+                carried_tokens += prev_tokens
+            current, current_tokens = carried, carried_tokens
+        current.append(unit)
+        current_tokens += cost
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def _limiter() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = _limiters[loop] = asyncio.Semaphore(LLM_EXTRACT_CONCURRENCY)
+    return limiter
+
+
+async def map_chunks(chunks: Sequence[T], fn: Callable[[int, T], Awaitable[R]]) -> List[R]:
+    """`fn(index, chunk)` for every chunk, concurrently under the shared limit; results in order."""
+    limiter = _limiter()
+
+    async def run(i: int, chunk: T) -> R:
+        async with limiter:
+            return await fn(i, chunk)
+
+    return list(await asyncio.gather(*(run(i, c) for i, c in enumerate(chunks))))
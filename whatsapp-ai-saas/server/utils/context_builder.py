@@ -0,0 +1,185 @@
+# server/utils/context_builder.py
+"""
+Token-budgeted prompt assembly for the chat agent.
+
+The stored session is [system prompt, *turns] and grows up to
+SESSION_MAX_MESSAGES; sending it whole made prompt size follow the
+conversation length. `build_context` fits each model call into
+PROMPT_TOKEN_BUDGET tokens (counted with tiktoken):
+
+1. the system prompt, capped at SYSTEM_PROMPT_TOKENS;
+2. the session's knowledge snippets, de-duplicated and capped at
+   RAG_CONTEXT_TOKENS, as one system message built fresh every turn;
+3. the most recent turns that still fit. Older turns are dropped and
+   replaced by a short note that quotes the user's earlier messages,
+   capped at HISTORY_SUMMARY_TOKENS.
+
+Tool calls and results of the current turn are added by the caller on top
+(bounded by MAX_TOOL_ROUNDS).
+"""
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+SYSTEM_PROMPT_TOKENS = int(os.getenv("SYSTEM_PROMPT_TOKENS", "3000"))
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "1200"))
+RAG_CONTEXT_SNIPPETS = int(os.getenv("RAG_CONTEXT_SNIPPETS", "8"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "200"))
+CONTEXT_MODEL = os.getenv("CONTEXT_MODEL", "gpt-4o")
+
+# Per-message framing tokens in the chat format (role, separators)
+_MESSAGE_OVERHEAD = 4
+_WHITESPACE = re.compile(r"\s+")
+
+Message = Dict[str, Any]
+
+
+@lru_cache(maxsize=4)
+def _encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # BPE files are fetched on first use; estimate rather than fail the reply
+        print(f"[CONTEXT] tiktoken unavailable, estimating token counts: {e}")
+        return None
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if content is None:
+        return ""
+    return json.dumps(content, ensure_ascii=False, default=str)
+
+
+def count_tokens(text: str, model: str = CONTEXT_MODEL) -> int:
+    enc = _encoding(model)
+    if enc is None:
+        return len(text) // 4 + 1
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def message_tokens(message: Message, model: str = CONTEXT_MODEL) -> int:
+    return count_tokens(_text(message.get("content")), model) + _MESSAGE_OVERHEAD
+
+
+def truncate_tokens(text: str, limit: int, model: str = CONTEXT_MODEL) -> str:
+    """Cut `text` to at most `limit` tokens."""
+    if limit <= 0:
+        return ""
+    enc = _encoding(model)
+    if enc is None:
+        return text[: limit * 4]
+    tokens = enc.encode(text, disallowed_special=())
+    return text if len(tokens) <= limit else enc.decode(tokens[:limit])
+
+
+def _snippet_key(snippet: str) -> str:
+    return _WHITESPACE.sub(" ", snippet).strip().casefold()
+
+
+def dedupe_snippets(snippets: Sequence[str]) -> List[str]:
+    """Keep the first of each repeated snippet and drop ones contained in an earlier snippet."""
+    kept: List[str] = []
+    keys: List[str] = []
+    for snippet in snippets:
+        key = _snippet_key(snippet or "")
+        if not key or any(key in k for k in keys):
+            continue
+        kept.append(snippet.strip())
+        keys.append(key)
+    return kept
+
+
+def merge_snippets(new: Sequence[str], previous: Sequence[str], limit: int = RAG_CONTEXT_SNIPPETS) -> List[str]:
+    """Newest search results first, then still-unique earlier ones, capped at `limit`."""
+    return dedupe_snippets([*new, *previous])[:limit]
+
+
+def _knowledge_message(snippets: Sequence[str], budget: int, model: str) -> Optional[Message]:
+    lines, used = [], count_tokens("Relevant knowledge:\n", model) + _MESSAGE_OVERHEAD
+    for snippet in dedupe_snippets(snippets):
+        line = f"• {snippet}"
+        cost = count_tokens(line + "\n", model)
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    if not lines:
+        return None
+    return {"role": "system", "content": "Relevant knowledge:\n" + "\n".join(lines)}
+
+
+def _summary_message(dropped: Sequence[Message], budget: int, model: str) -> Optional[Message]:
+    """Extractive note for turns that no longer fit: the user's own earlier words, newest kept last."""
+    said = [_WHITESPACE.sub(" ", _text(m.get("content"))).strip() for m in dropped if m.get("role") == "user"]
+    said = [s for s in said if s]
+    header = f"Earlier in this conversation ({len(dropped)} messages omitted) the user said: "
+    if not said or budget <= count_tokens(header, model) + _MESSAGE_OVERHEAD:
+        return None
+    body = truncate_tokens(" | ".join(reversed(said)), budget - count_tokens(header, model) - _MESSAGE_OVERHEAD, model)
+    return {"role": "system", "content": header + body}
+
+
+def build_context(
+    history: Sequence[Message],
+    snippets: Sequence[str] = (),
+    budget: int = PROMPT_TOKEN_BUDGET,
+    model: str = CONTEXT_MODEL,
+) -> List[Message]:
+    """
+    Messages for one model call from a stored session ([system, *turns]) and
+    the session's knowledge snippets. System notes found inside the turns
+    (older sessions stored RAG results there) are treated as snippets.
+    """
+    if not history:
+        return []
+    system_prompt = _text(history[0].get("content")) if history[0].get("role") == "system" else ""
+    turns = list(history[1:] if system_prompt else history)
+
+    inline = [
+        line.lstrip("• ").strip()
+        for m in turns if m.get("role") == "system"
+        for line in _text(m.get("content")).splitlines()
+    ]
+    turns = [m for m in turns if m.get("role") != "system"]
+
+    system = {"role": "system", "content": truncate_tokens(system_prompt, SYSTEM_PROMPT_TOKENS, model)}
+    if len(system["content"]) < len(system_prompt):
+        # utils.sessions fits the tenant config so this should not happen; the cut drops the prompt's tail
+        print(f"[CONTEXT] system prompt over {SYSTEM_PROMPT_TOKENS} tokens, truncated")
+    remaining = budget - message_tokens(system, model)
+
+    knowledge = _knowledge_message([*snippets, *reversed(inline)], min(RAG_CONTEXT_TOKENS, remaining), model)
+    if knowledge is not None:
+        remaining -= message_tokens(knowledge, model)
+
+    # Newest turns first; the latest user message is always kept
+    kept: List[Message] = []
+    reserve = min(HISTORY_SUMMARY_TOKENS, max(remaining // 4, 0))
+    for message in reversed(turns):
+        cost = message_tokens(message, model)
+        if kept and cost > remaining - reserve:
+            break
+        kept.append(message)
+        remaining -= cost
+    kept.reverse()
+
+    dropped = turns[: len(turns) - len(kept)]
+    summary = _summary_message(dropped, reserve, model) if dropped else None
+
+    messages: List[Message] = [system]
+    if knowledge is not None:
+        messages.append(knowledge)
+    if summary is not None:
+        messages.append(summary)
+    return messages + kept
@@ -1,13 +1,125 @@
 import asyncio
 import base64
+import re
+import uuid
+from collections import Counter
+from database import SessionLocal
+from models import BusinessProfile, Tenant
 from services.llm import analysis
+from utils.chunked_llm import map_chunks, split_text
 from utils.file_extractor import FileExtractor
+from utils.structural_chunker import chunk_file, chunk_markdown
 from utils.json_parser import LLMJsonParser
 from utils.web_crawler import scrape_single_page
 # from utils.log import append_usage
 
+CHUNKING_LOCAL = "local"
+CHUNKING_LLM = "llm"
+
+
+def knowledge_settings(tenant_id) -> tuple:
+    """
+    (chunking mode, language) for the tenant's knowledge: local structural
+    chunks or LLM refinement, and the profile language local chunks are tagged with.
+    """
+    db = SessionLocal()
+    try:
+        mode = db.query(Tenant.knowledge_chunking).filter(Tenant.id == tenant_id).scalar()
+        language = db.query(BusinessProfile.language).filter(BusinessProfile.tenant_id == tenant_id).scalar()
+    finally:
+        db.close()
+    mode = CHUNKING_LLM if mode == CHUNKING_LLM else CHUNKING_LOCAL
+    return mode, (language or "en").strip().lower() or "en"
+
+
+REDUCE_PROMPT = """ You will receive the summaries of consecutive parts of one document, in order.
+                    Write one detailed but concise summary of the whole document (key ideas, themes and purpose,
+                    keeping prices, fees, dates and URLs that matter) and 2-3 tags that best describe it.
+                    Return strictly JSON: {"summary": "...", "tags": ["tag1", "tag2"]}
+                    """
+
+
+async def _map_document(tenant_id, text: str, prompt: str):
+    """Map step: run the refinement prompt on each token-bounded part of `text` concurrently."""
+    chunks = split_text(text)
+
+    async def extract(i, chunk):
+        query = chunk if len(chunks) == 1 else f"[Part {i + 1} of {len(chunks)} of the document]\n{chunk}"
+        response = await analysis(tenant_id, query, prompt)
+        print(f"LLM response (part {i + 1}/{len(chunks)}): {response[:200]}...")
+        parsed = LLMJsonParser(strict=True).parse(response)
+        if parsed is None:
+            print(f"[ANALYZER] part {i + 1}/{len(chunks)} returned no usable JSON")
+        return parsed or {}
+
+    return await map_chunks(chunks, extract)
+
+
+def _chunk_key(text: str) -> str:
+    return re.sub(r"\s+", " ", text or "").strip().casefold()
+
+
+async def _reduce_document(tenant_id, parts, id_prefix: str):
+    """
+    Reduce step: concatenate the parts' chunks in order (dropping repeats from
+    the overlap, giving each a unique id) and build the document summary and
+    tags from the parts' summaries.
+    """
+    if len(parts) == 1 and parts[0].get("document"):
+        return parts[0]
+
+    documents, seen_ids, seen_text = [], set(), set()
+    for i, part in enumerate(parts):
+        for doc in part.get("document") or []:
+            if not isinstance(doc, dict) or not doc.get("text"):
+                continue
+            key = _chunk_key(doc["text"])
+            if key in seen_text:
+                continue
+            seen_text.add(key)
+            doc_id = str(doc.get("id") or "")
+            # Every part's model invents ids from the same template; make them unique
+            if not doc_id or doc_id in seen_ids or "uuid" in doc_id:
+                doc_id = f"{id_prefix}-{uuid.uuid4()}"
+            seen_ids.add(doc_id)
+            metadata = dict(doc.get("metadata") or {})
+            metadata.setdefault("part", i + 1)
+            documents.append({**doc, "id": doc_id, "metadata": metadata})
+
+    summaries = [p.get("summary") for p in parts if p.get("summary")]
+    tag_counts = Counter(t for p in parts for t in (p.get("tags") or []) if isinstance(t, str))
+    summary, tags = " ".join(summaries), [t for t, _ in tag_counts.most_common(3)]
+    if len(summaries) > 1:
+        response = await analysis(
+            tenant_id,
+            "\n\n".join(f"Part {i + 1}: {s}" for i, s in enumerate(summaries)),
+            REDUCE_PROMPT,
+        )
+        reduced = LLMJsonParser(strict=False).parse(response) or {}
+        summary = reduced.get("summary") or summary
+        tags = reduced.get("tags") or tags
+    return {"summary": summary, "tags": tags, "document": documents}
+
+
+async def _refine_document(tenant_id, text: str, prompt: str, id_prefix: str):
+    """Map-reduce refinement: parts are processed in parallel, so time follows concurrency, not length."""
+    parts = await _map_document(tenant_id, text, prompt)
+    if not any(isinstance(p.get("document"), list) and p["document"] for p in parts):
+        # Nothing to ingest; let the caller mark the source FAILED rather than COMPLETED
+        raise ValueError(f"LLM refinement of {id_prefix} produced no chunks ({len(parts)} part(s) unparseable or empty)")
+    result = await _reduce_document(tenant_id, parts, id_prefix)
+    print(f"parsed_output: {len(parts)} part(s), {len(result.get('document') or [])} chunk(s)")
+    return result
+
 async def analyze_file_from_bytes(tenant_id :int,file_name:str,file_bytes: bytes, ) -> str:
     
+    mode, language = knowledge_settings(tenant_id)
+    if mode == CHUNKING_LOCAL:
+        result = await asyncio.to_thread(chunk_file, file_bytes, file_name, language)
+        if not result["document"]:
+            return "No extractable text found in the file."
+        return result
+
     file_txt = FileExtractor.extract_text(file_bytes, file_name)
     if file_txt.strip() == "":
         return "No extractable text found in the file."
@@ -62,13 +174,7 @@ async def analyze_file_from_bytes(tenant_id :int,file_name:str,file_bytes: bytes
                         }
                         """
 
-    response = await analysis(tenant_id,file_txt.strip(),FILE_PROMPT)
-    
-    print(f"LLM response: {response[:200]}...")  # Print the first 500 characters of the response for debugging
-    parser = LLMJsonParser(strict=True)
-    parsed_output = parser.parse(response)
-    print(f"parsed_output: {parsed_output}") # Print the parsed output for debugging
-    return parsed_output
+    return await _refine_document(tenant_id, file_txt.strip(), FILE_PROMPT, file_name)
 
 
 
@@ -77,6 +183,9 @@ async def analyze_Web(tenant_id :int,source_url:str, ) -> str:
     file_txt =await scrape_single_page(source_url)
     if file_txt.strip() == "":
         return "No extractable text found in the file."
+    mode, language = knowledge_settings(tenant_id)
+    if mode == CHUNKING_LOCAL:
+        return chunk_markdown(file_txt, source_url, language)
     FILE_PROMPT = """ You are an intelligent document refinement assistant.
 
                         Your task:
@@ -129,12 +238,6 @@ async def analyze_Web(tenant_id :int,source_url:str, ) -> str:
                         }
                         """
 
-    print(f"Extracted text : {file_txt.strip()}")  # Debugging line to check extracted text length
-    response = await analysis(tenant_id,file_txt.strip(),FILE_PROMPT)
-    
-    print(f"LLM response: {response[:200]}...")  # Print the first 500 characters of the response for debugging
-    parser = LLMJsonParser(strict=True)
-    parsed_output = parser.parse(response)
-    print(f"parsed_output: {parsed_output}") # Print the parsed output for debugging
-    return parsed_output
+    print(f"Extracted text : {len(file_txt.strip())} chars")  # Debugging line to check extracted text length
+    return await _refine_document(tenant_id, file_txt.strip(), FILE_PROMPT, source_url)
     
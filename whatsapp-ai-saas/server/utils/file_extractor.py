@@ -6,14 +6,36 @@ A centralized, static class to extract raw text content from various file types.
 This service is used by the RAG processing worker to convert binary files
 (PDFs, DOCX, Excel, etc.) into a simple string format that can be
 chunked and fed to an LLM.
+
+`extract_sections` keeps the document structure instead (PDF pages and
+headings, DOCX heading styles, spreadsheet row groups, markdown headers)
+for the local chunker in utils/structural_chunker.py.
 """
 
 import os
 import io
+import re
+import csv
+from collections import Counter
+from dataclasses import dataclass
 import pandas as pd
 import fitz  # PyMuPDF
 import docx  # python-docx
-from typing import Dict, Callable
+from typing import Dict, Callable, List, Optional
+
+# Spreadsheet/CSV rows per section, each rendered as "column: value" pairs
+ROWS_PER_SECTION = int(os.getenv("KNOWLEDGE_ROWS_PER_SECTION", "20"))
+
+_MD_HEADER = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+
+
+@dataclass
+class Section:
+    """A structurally coherent piece of a document and where it came from."""
+    text: str
+    section: str = ""
+    page_number: Optional[int] = None
+    source_type: str = "text"
 
 class UnsupportedFileTypeError(Exception):
     """Custom exception for files we can't process."""
@@ -89,6 +111,191 @@ class FileExtractor:
             print(f"Error processing DOCX file: {e}")
             return ""
 
+    # --- Structured (section) extraction ---
+
+    @staticmethod
+    def _sections_pdf(file_bytes: bytes) -> List[Section]:
+        """
+        Page- and heading-aware sections from PyMuPDF text blocks. A line is a
+        heading when its font is clearly larger than the body font, or it is a
+        short bold line that doesn't end like a sentence.
+        """
+        sections: List[Section] = []
+        try:
+            with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+                pages = [page.get_text("dict") for page in doc]
+        except Exception as e:
+            print(f"Error processing PDF: {e}")
+            return sections
+
+        sizes = Counter()
+        for page in pages:
+            for block in page.get("blocks", []):
+                for line in block.get("lines", []):
+                    for span in line.get("spans", []):
+                        sizes[round(span.get("size", 0), 1)] += len(span.get("text", "").strip())
+        body_size = sizes.most_common(1)[0][0] if sizes else 0
+
+        heading = ""
+        for page_no, page in enumerate(pages, start=1):
+            lines: List[str] = []
+
+            def flush():
+                text = "\n".join(lines).strip()
+                if text:
+                    sections.append(Section(text=text, section=heading, page_number=page_no, source_type="pdf"))
+                lines.clear()
+
+            for block in page.get("blocks", []):
+                if block.get("type", 0) != 0:  # images
+                    continue
+                for line in block.get("lines", []):
+                    spans = [sp for sp in line.get("spans", []) if sp.get("text", "").strip()]
+                    text = " ".join(sp["text"].strip() for sp in spans)
+                    if not text:
+                        continue
+                    size = max(sp.get("size", 0) for sp in spans)
+                    bold = all(sp.get("flags", 0) & 16 for sp in spans)
+                    is_heading = len(text) <= 120 and (
+                        size >= body_size * 1.15 or (bold and not text.rstrip().endswith((".", ",", ";", ":")))
+                    )
+                    if is_heading:
+                        flush()
+                        heading = text
+                    lines.append(text)
+            flush()
+        return sections
+
+    @staticmethod
+    def _sections_docx(file_bytes: bytes) -> List[Section]:
+        """Sections split at Title/Heading paragraph styles; tables become their own sections."""
+        sections: List[Section] = []
+        try:
+            with io.BytesIO(file_bytes) as f:
+                doc = docx.Document(f)
+        except Exception as e:
+            print(f"Error processing DOCX file: {e}")
+            return sections
+
+        heading, lines = "", []
+        for para in doc.paragraphs:
+            text = para.text.strip()
+            if not text:
+                continue
+            style = (para.style.name if para.style is not None else "") or ""
+            if style.startswith("Heading") or style == "Title":
+                if lines:
+                    sections.append(Section(text="\n".join(lines), section=heading, source_type="docx"))
+                heading, lines = text, []
+            lines.append(text)
+        if lines:
+            sections.append(Section(text="\n".join(lines), section=heading, source_type="docx"))
+
+        for n, table in enumerate(doc.tables, start=1):
+            rows = [[cell.text.strip() for cell in row.cells] for row in table.rows]
+            sections.extend(FileExtractor._row_sections(rows, f"Table {n}", "docx"))
+        return sections
+
+    @staticmethod
+    def _row_sections(rows: List[List[str]], name: str, source_type: str) -> List[Section]:
+        """Groups of ROWS_PER_SECTION rows, each row written as `header: value` pairs."""
+        rows = [r for r in rows if any(str(c).strip() for c in r)]
+        if not rows:
+            return []
+        header, body = [str(c).strip() for c in rows[0]], rows[1:] or rows
+        sections = []
+        for start in range(0, len(body), ROWS_PER_SECTION):
+            group = body[start:start + ROWS_PER_SECTION]
+            lines = [
+                "; ".join(
+                    f"{header[i] if i < len(header) and header[i] else f'Column {i + 1}'}: {str(v).strip()}"
+                    for i, v in enumerate(row) if str(v).strip()
+                )
+                for row in group
+            ]
+            label = f"{name} (rows {start + 2}-{start + len(group) + 1})"
+            sections.append(Section(text="\n".join(lines), section=label, source_type=source_type))
+        return sections
+
+    @staticmethod
+    def _sections_excel(file_bytes: bytes) -> List[Section]:
+        sections: List[Section] = []
+        try:
+            with io.BytesIO(file_bytes) as f:
+                xls = pd.ExcelFile(f)
+                for sheet_name in xls.sheet_names:
+                    df = pd.read_excel(xls, sheet_name=sheet_name, header=None, dtype=str).fillna("")
+                    sections.extend(FileExtractor._row_sections(df.values.tolist(), str(sheet_name), "excel"))
+        except Exception as e:
+            print(f"Error processing Excel file: {e}")
+        return sections
+
+    @staticmethod
+    def _sections_csv(file_bytes: bytes) -> List[Section]:
+        text = FileExtractor._extract_simple_text(file_bytes)
+        return FileExtractor._row_sections(list(csv.reader(io.StringIO(text))), "Rows", "csv")
+
+    @staticmethod
+    def sections_from_markdown(markdown: str, source_type: str = "markdown") -> List[Section]:
+        """Sections at markdown ATX headers; `section` is the header path ("Pricing > Plans")."""
+        sections: List[Section] = []
+        path: List[str] = []
+        lines: List[str] = []
+
+        def flush():
+            text = "\n".join(lines).strip()
+            if text:
+                sections.append(Section(text=text, section=" > ".join(path), source_type=source_type))
+            lines.clear()
+
+        for line in (markdown or "").splitlines():
+            match = _MD_HEADER.match(line)
+            if match:
+                flush()
+                level = len(match.group(1))
+                path[:] = path[:level - 1] + [match.group(2)]
+            lines.append(line)
+        flush()
+        return sections
+
+    @staticmethod
+    def _sections_text(file_bytes: bytes) -> List[Section]:
+        text = FileExtractor._extract_simple_text(file_bytes)
+        return [Section(text=text.strip())] if text.strip() else []
+
+    @staticmethod
+    def _sections_markdown(file_bytes: bytes) -> List[Section]:
+        return FileExtractor.sections_from_markdown(FileExtractor._extract_simple_text(file_bytes))
+
+    SECTION_EXTENSION_MAP: Dict[str, Callable[[bytes], List[Section]]] = {
+        '.txt': _sections_text,
+        '.json': _sections_text,
+        '.py': _sections_text,
+        '.md': _sections_markdown,
+        '.csv': _sections_csv,
+        '.pdf': _sections_pdf,
+        '.xlsx': _sections_excel,
+        '.xls': _sections_excel,
+        '.docx': _sections_docx,
+    }
+
+    @staticmethod
+    def extract_sections(file_bytes: bytes, filename: str) -> List[Section]:
+        """
+        Structure-preserving counterpart of `extract_text`.
+
+        Raises:
+            UnsupportedFileTypeError: If the file type is not supported.
+        """
+        extension = os.path.splitext(filename)[1].lower()
+        handler = FileExtractor.SECTION_EXTENSION_MAP.get(extension)
+        if not handler:
+            raise UnsupportedFileTypeError(
+                f"Unsupported file type: {filename}"
+            )
+        print(f"Extracting sections using handler: {handler.__name__}")
+        return handler(file_bytes)
+
     # --- Type-to-Method Mapping ---
     # This acts as a router.
     
@@ -22,6 +22,11 @@ def extract_gpt_reply(choice) -> str:
                         reply = t
                         break
 
+    return clean_reply_text(reply)
+
+
+def clean_reply_text(reply) -> str:
+    """Strip non-printable characters and convert markdown bold to WhatsApp bold."""
     if not isinstance(reply, str):
         reply = str(reply or "")
 
@@ -0,0 +1,123 @@
+# server/utils/prompt_cache.py
+"""
+Per-tenant cache of the static part of the agent system prompt.
+
+BusinessProfile, AgentConfiguration, Workflow and the inbound Template only
+change through the config routers, so their serialised JSON (plus the
+agent's stream_replies flag) is cached per tenant and dropped by
+`invalidate_tenant_prompt` whenever one of those routers writes. Only the
+lead fragment is fetched per sender.
+"""
+import json
+import os
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import AgentConfiguration, BusinessProfile, Template, Workflow
+from utils.cache import TieredCache
+from utils.context_builder import count_tokens, truncate_tokens
+from utils.enums import TemplateStatusEnum, TemplateTypeEnum
+
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "3600"))
+# Upper bound on how long another process may serve a config after invalidation
+PROMPT_CACHE_LOCAL_TTL = float(os.getenv("PROMPT_CACHE_LOCAL_TTL", "30"))
+
+_cache = TieredCache("wa_prompt", ttl=PROMPT_CACHE_TTL, local_ttl=PROMPT_CACHE_LOCAL_TTL)
+
+
+def dumps_compact(obj) -> str:
+    return json.dumps(obj, default=str, indent=None, separators=(',', ':'))
+
+
+def safe_to_dict(obj):
+    """Safely converts a SQLAlchemy model instance to a dictionary, handling None."""
+    if obj is None:
+        return {}
+    return {c.name: getattr(obj, c.name) for c in obj.__table__.columns if not c.name.startswith('_')}
+
+
+def _load_fragments(db: Session, tenant_id: int) -> str:
+    bp = db.query(BusinessProfile).filter(BusinessProfile.tenant_id == tenant_id).first()
+    ac = db.query(AgentConfiguration).filter(AgentConfiguration.tenant_id == tenant_id).first()
+    wk = db.query(Workflow).filter(Workflow.tenant_id == tenant_id and Workflow.is_default == True).first()
+    tm = db.query(Template).filter(
+        Template.tenant_id == tenant_id,
+        Template.type == TemplateTypeEnum.INBOUND,
+        Template.status == TemplateStatusEnum.SUBMITTED,
+    ).first()
+    head = (
+        '"business":' + dumps_compact(bp.description if bp else "")
+        + ',"agent_config":' + dumps_compact(safe_to_dict(ac))
+        + ',"workflow":' + dumps_compact(safe_to_dict(wk))
+    )
+    return dumps_compact({
+        "head": head,
+        "template": dumps_compact(safe_to_dict(tm)),
+        "stream_replies": bool(ac.stream_replies) if ac else False,
+    })
+
+
+def _get_fragments(tenant_id: int, db: Optional[Session] = None) -> dict:
+    def load() -> str:
+        if db is not None:
+            return _load_fragments(db, tenant_id)
+        own_db = SessionLocal()
+        try:
+            return _load_fragments(own_db, tenant_id)
+        finally:
+            own_db.close()
+
+    return json.loads(_cache.get_or_load(tenant_id, load))
+
+
+def _fit_config(config: str, max_tokens: int, tenant_id) -> str:
+    """
+    Shrink the largest sections until the config fits `max_tokens`. A cut
+    section becomes a JSON string of its truncated text, so the config stays
+    valid JSON and every section keeps its beginning.
+    """
+    sections = {k: dumps_compact(v) for k, v in json.loads(config).items()}
+    cut = []
+    for _ in range(2 * len(sections)):
+        sizes = {k: count_tokens(v) for k, v in sections.items()}
+        excess = sum(sizes.values()) + 2 * len(sections) - max_tokens
+        if excess <= 0:
+            break
+        key = max(sizes, key=sizes.get)
+        # Escaping the cut text as a JSON string costs a little; the loop re-checks
+        keep = max(sizes[key] - excess - 16, 0)
+        sections[key] = dumps_compact(truncate_tokens(sections[key], keep) + " …[truncated]")
+        cut.append(key)
+    print(f"[PROMPT] tenant {tenant_id} config over {max_tokens} tokens; truncated {sorted(set(cut))}")
+    return "{" + ",".join(f"{dumps_compact(k)}:{v}" for k, v in sections.items()) + "}"
+
+
+def get_config_str(db: Session, tenant_id: int, lead: Optional[dict] = None,
+                   max_tokens: Optional[int] = None) -> str:
+    """
+    Return the tenant config JSON embedded in the system prompt.
+
+    Matches json.dumps of {"business", "agent_config", "workflow", "template",
+    "lead"}; the inbound template is only included when there is no lead.
+    With `max_tokens`, oversized sections are truncated to fit (see _fit_config).
+    """
+    fragments = _get_fragments(tenant_id, db)
+    template = "{}" if lead else fragments["template"]
+    config = "{" + fragments["head"] + ',"template":' + template + ',"lead":' + dumps_compact(lead or {}) + "}"
+    if max_tokens is not None and count_tokens(config) > max_tokens:
+        return _fit_config(config, max_tokens, tenant_id)
+    return config
+
+
+def tenant_streams_replies(tenant_id: int) -> bool:
+    """Whether the tenant's agent opted in to streamed, segmented replies."""
+    return bool(_get_fragments(tenant_id).get("stream_replies"))
+
+
+def invalidate_tenant_prompt(tenant_id) -> None:
+    """Drop the cached prompt config after a tenant's agent settings change."""
+    if tenant_id is None:
+        return
+    _cache.delete(int(tenant_id))
@@ -0,0 +1,34 @@
+# server/utils/redis_client.py
+"""
+Process-wide Redis clients.
+
+Creating a client per request opens a fresh connection pool every time, so
+hot paths (webhooks, workers) share the lazily created instances below.
+"""
+from typing import Optional
+
+import redis
+import redis.asyncio as aioredis
+
+from settings import settings
+
+_async_client: Optional[aioredis.Redis] = None
+
+
+def get_async_redis() -> aioredis.Redis:
+    """Return the shared asyncio Redis client (decoded str responses)."""
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _async_client
+
+
+_sync_client: Optional[redis.Redis] = None
+
+
+def get_sync_redis() -> redis.Redis:
+    """Return the shared blocking Redis client for sync call sites (decoded str responses)."""
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _sync_client
@@ -0,0 +1,73 @@
+# server/utils/reply_segmenter.py
+"""
+Splits a streamed LLM reply into WhatsApp-sized messages as it generates.
+
+The first segment goes out at the first sentence end after
+FIRST_SEGMENT_MIN_CHARS, so the user sees something quickly. Later segments
+break on paragraphs (or on a sentence once SEGMENT_MAX_CHARS is exceeded) to
+avoid flooding the chat with one message per sentence. A break is never
+placed inside an open *bold* span.
+"""
+import os
+import re
+from typing import Awaitable, Callable, List
+
+FIRST_SEGMENT_MIN_CHARS = int(os.getenv("FIRST_SEGMENT_MIN_CHARS", "40"))
+SEGMENT_MAX_CHARS = int(os.getenv("SEGMENT_MAX_CHARS", "700"))
+
+_PARAGRAPH = re.compile(r"\n\s*\n")
+# Sentence end: punctuation (incl. Devanagari danda) followed by whitespace
+_SENTENCE_END = re.compile(r"[.!?।](?=\s)|\n")
+
+
+def _balanced(text: str) -> bool:
+    return text.count("*") % 2 == 0
+
+
+class ReplySegmenter:
+    def __init__(self, send: Callable[[str], Awaitable[None]]):
+        self._send = send
+        self._buffer = ""
+        self.sent: List[str] = []
+
+    async def feed(self, delta: str) -> None:
+        self._buffer = (self._buffer + delta).lstrip()
+        while True:
+            cut = self._next_cut()
+            if cut is None:
+                return
+            segment, self._buffer = self._buffer[:cut], self._buffer[cut:].lstrip()
+            await self._emit(segment)
+
+    async def flush(self) -> None:
+        segment, self._buffer = self._buffer, ""
+        await self._emit(segment)
+
+    async def _emit(self, segment: str) -> None:
+        segment = segment.strip()
+        if segment:
+            self.sent.append(segment)
+            await self._send(segment)
+
+    def _next_cut(self):
+        buf = self._buffer
+        if not self.sent:
+            for m in _SENTENCE_END.finditer(buf):
+                if m.end() >= FIRST_SEGMENT_MIN_CHARS and _balanced(buf[:m.end()]):
+                    return m.end()
+            return None
+
+        cut = None
+        for m in _PARAGRAPH.finditer(buf):
+            if _balanced(buf[:m.start()]):
+                cut = m.start()
+                break
+        if cut is not None and cut > 0:
+            return cut
+        if len(buf) > SEGMENT_MAX_CHARS:
+            last = None
+            for m in _SENTENCE_END.finditer(buf):
+                if _balanced(buf[:m.end()]):
+                    last = m.end()
+            return last
+        return None
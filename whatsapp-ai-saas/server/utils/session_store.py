@@ -0,0 +1,222 @@
+# server/utils/session_store.py
+"""
+Conversation session backends used by utils.sessions.
+
+A session is one system prompt plus a bounded window of recent turns, and
+it expires SESSION_EXPIRY_SECONDS after the last read or write. It also
+holds the latest retrieved knowledge snippets, which utils.context_builder
+injects into each turn's prompt instead of the history.
+
+- memory: process-local LRU + TTL. Fine for a single process and for dev.
+- redis:  one list per sender, shared by every API and webhook worker.
+          SESSION_BACKEND=redis
+
+Store methods are coroutines: the Redis backend uses the asyncio client so
+session reads and writes never block the event loop.
+"""
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_EXPIRY_SECONDS = int(os.getenv("SESSION_EXPIRY_SECONDS", "600"))
+# Turns kept after the system prompt; older ones fall off the front
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "40"))
+# Memory backend only: senders kept before the least recently used is evicted
+SESSION_MAX_SENDERS = int(os.getenv("SESSION_MAX_SENDERS", "10000"))
+SESSION_KEY_PREFIX = os.getenv("SESSION_KEY_PREFIX", "wa_sess")
+
+Message = Dict[str, str]
+
+
+class SessionStore(ABC):
+    @abstractmethod
+    async def load(self, sender: str) -> Optional[List[Message]]:
+        """Return [system, *turns] and refresh the TTL, or None if absent/expired."""
+
+    @abstractmethod
+    async def start(self, sender: str, system_prompt: str, turns: List[Message]) -> None:
+        """Replace whatever is stored for `sender` with a fresh session."""
+
+    @abstractmethod
+    async def append(self, sender: str, message: Message) -> None:
+        """Add one turn, trimming to the window and refreshing the TTL."""
+
+    @abstractmethod
+    async def clear(self, sender: str) -> None:
+        """Forget everything stored for `sender`."""
+
+    @abstractmethod
+    async def load_snippets(self, sender: str) -> List[str]:
+        """Knowledge snippets kept for the session (most relevant first)."""
+
+    @abstractmethod
+    async def save_snippets(self, sender: str, snippets: List[str]) -> None:
+        """Replace the session's snippets; ignored if the session has expired."""
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, ttl: int, max_messages: int, max_senders: int):
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.max_senders = max_senders
+        # sender -> [expires_at, system_prompt, deque(turns), snippets], oldest first
+        self._sessions: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, sender: str) -> Optional[list]:
+        entry = self._sessions.get(sender)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self._sessions[sender]
+            return None
+        entry[0] = time.time() + self.ttl
+        self._sessions.move_to_end(sender)
+        return entry
+
+    async def load(self, sender):
+        with self._lock:
+            entry = self._live(sender)
+            if entry is None:
+                return None
+            return [{"role": "system", "content": entry[1]}, *entry[2]]
+
+    async def start(self, sender, system_prompt, turns):
+        with self._lock:
+            self._sessions[sender] = [
+                time.time() + self.ttl,
+                system_prompt,
+                deque(turns, maxlen=self.max_messages),
+                [],
+            ]
+            self._sessions.move_to_end(sender)
+            while len(self._sessions) > self.max_senders:
+                self._sessions.popitem(last=False)
+
+    async def append(self, sender, message):
+        with self._lock:
+            entry = self._live(sender)
+            if entry is None:
+                # Expired between load and append: the turn is dropped and the next load starts a fresh session
+                return
+            entry[2].append(message)
+
+    async def clear(self, sender):
+        with self._lock:
+            self._sessions.pop(sender, None)
+
+    async def load_snippets(self, sender):
+        with self._lock:
+            entry = self._sessions.get(sender)
+            return list(entry[3]) if entry is not None and entry[0] >= time.time() else []
+
+    async def save_snippets(self, sender, snippets):
+        with self._lock:
+            entry = self._live(sender)
+            if entry is not None:
+                entry[3] = list(snippets)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    `{prefix}:{sender}:sys` holds the system prompt, `{prefix}:{sender}`
+    is a list of compact JSON turns capped with LTRIM and
+    `{prefix}:{sender}:ctx` the JSON list of snippets. All keys carry the
+    same server-side TTL, so idle senders need no cleanup job.
+    """
+
+    # Snippets are only written while the session's system prompt exists
+    _SAVE_SNIPPETS = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[2])
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self, client, ttl: int, max_messages: int, prefix: str):
+        self.r = client
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.prefix = prefix
+        self._save_snippets = client.register_script(self._SAVE_SNIPPETS)
+
+    def _keys(self, sender: str):
+        base = f"{self.prefix}:{sender}"
+        return f"{base}:sys", base
+
+    @staticmethod
+    def _dump(message: Message) -> str:
+        return json.dumps(message, ensure_ascii=False, separators=(",", ":"), default=str)
+
+    async def load(self, sender):
+        sys_key, turns_key = self._keys(sender)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.get(sys_key)
+        pipe.lrange(turns_key, 0, -1)
+        pipe.expire(sys_key, self.ttl)
+        pipe.expire(turns_key, self.ttl)
+        pipe.expire(self._snippets_key(sender), self.ttl)
+        system_prompt, turns, _, _, _ = await pipe.execute()
+        if system_prompt is None:
+            return None
+        return [{"role": "system", "content": system_prompt}, *(json.loads(t) for t in turns)]
+
+    async def start(self, sender, system_prompt, turns):
+        sys_key, turns_key = self._keys(sender)
+        pipe = self.r.pipeline(transaction=True)
+        pipe.delete(turns_key, self._snippets_key(sender))
+        pipe.set(sys_key, system_prompt, ex=self.ttl)
+        if turns:
+            pipe.rpush(turns_key, *(self._dump(t) for t in turns[-self.max_messages:]))
+            pipe.expire(turns_key, self.ttl)
+        await pipe.execute()
+
+    async def append(self, sender, message):
+        sys_key, turns_key = self._keys(sender)
+        pipe = self.r.pipeline(transaction=True)
+        pipe.rpush(turns_key, self._dump(message))
+        pipe.ltrim(turns_key, -self.max_messages, -1)
+        pipe.expire(turns_key, self.ttl)
+        pipe.expire(sys_key, self.ttl)
+        await pipe.execute()
+
+    async def clear(self, sender):
+        await self.r.delete(*self._keys(sender), self._snippets_key(sender))
+
+    def _snippets_key(self, sender: str) -> str:
+        return f"{self.prefix}:{sender}:ctx"
+
+    async def load_snippets(self, sender):
+        raw = await self.r.get(self._snippets_key(sender))
+        return json.loads(raw) if raw else []
+
+    async def save_snippets(self, sender, snippets):
+        sys_key, _ = self._keys(sender)
+        await self._save_snippets(
+            keys=[sys_key, self._snippets_key(sender)],
+            args=[json.dumps(list(snippets), ensure_ascii=False), self.ttl],
+        )
+
+
+_store: Optional[SessionStore] = None
+
+
+def get_session_store() -> SessionStore:
+    global _store
+    if _store is None:
+        if SESSION_BACKEND == "redis":
+            from utils.redis_client import get_async_redis
+            _store = RedisSessionStore(
+                get_async_redis(), SESSION_EXPIRY_SECONDS, SESSION_MAX_MESSAGES, SESSION_KEY_PREFIX
+            )
+        else:
+            _store = MemorySessionStore(
+                SESSION_EXPIRY_SECONDS, SESSION_MAX_MESSAGES, SESSION_MAX_SENDERS
+            )
+    return _store
@@ -1,89 +1,21 @@
+import asyncio
 import json
 import re
-import time
-from collections import defaultdict
-from typing import Optional
+from typing import List, Optional
 
 from fastapi import logger
 from fastapi.responses import JSONResponse
 from deps import SessionLocal
 from utils.enums import Role , TemplateTypeEnum , TemplateStatusEnum
-from services.rag import rag
 from deps import get_db_session
-from models import Lead, Template, BusinessProfile, AgentConfiguration, Workflow
+from models import Lead
 from sqlalchemy import func
+from utils.session_store import get_session_store, SESSION_EXPIRY_SECONDS
+from utils.prompt_cache import get_config_str, safe_to_dict
+from utils.context_builder import SYSTEM_PROMPT_TOKENS, count_tokens, merge_snippets
 
-SESSION_EXPIRY_SECONDS = 600  # 5 minutes
-
-# In-memory session stores
-user_sessions = defaultdict(list)  # {sender: [messages]}
-last_message_time = {}
-
-
-def safe_to_dict(obj):
-    """Safely converts a SQLAlchemy model instance to a dictionary, handling None."""
-    if obj is None:
-        return {}
-    # Assuming models have a dict-like interface or we convert manually,
-    # and excluding private attributes starting with '_'.
-    return {c.name: getattr(obj, c.name) for c in obj.__table__.columns if not c.name.startswith('_')}
-
-def System_Prompt(tenant_id: int,sender: Optional[str] = None) -> str:
-    """
-    Constructs the dynamic System Prompt for the LLM based on tenant configuration.
-    """
-    business_profile = {}
-    agent_config = {}
-    workflow = {}
-    template = {}
-    lead = {}
-    db = SessionLocal()
-    try:
-        # Use the reusable context manager to acquire a database session
-        # 1. Fetch Business Profile
-        bp = db.query(BusinessProfile).filter(BusinessProfile.tenant_id == tenant_id).first()
-        business_profile = bp.description if bp else ""
-        # 2. Fetch Agent Configuration
-        ac = db.query(AgentConfiguration).filter(AgentConfiguration.tenant_id == tenant_id).first()
-        agent_config = safe_to_dict(ac)
-        
-        # 3. Fetch Workflow
-        wk = db.query(Workflow).filter(Workflow.tenant_id == tenant_id and Workflow.is_default == True).first()
-        workflow = safe_to_dict(wk)
-        
-        if sender and len(sender) >= 10:
-           phone_number = re.sub(r"\D", "", sender) if sender else ""
-           phone_number = phone_number[-10:] if len(phone_number) >= 10 else phone_number
-           lead = db.query(Lead).filter(Lead.tenant_id == tenant_id,  func.right(func.regexp_replace(Lead.phone, r'\D', '', 'g'), 10) == phone_number).first()
-           if lead:
-              summary = lead.summary if lead else None
-              if summary and isinstance(summary, str) and summary.strip():
-                  user_sessions[sender].append({"role": "user", "content": summary})
-
-              lead = safe_to_dict(lead)
-              
-           else:
-            tm = db.query(Template).filter(Template.tenant_id == tenant_id,Template.type == TemplateTypeEnum.INBOUND,Template.status == TemplateStatusEnum.SUBMITTED).first()
-            template = safe_to_dict(tm)
-        else:
-            tm = db.query(Template).filter(Template.tenant_id == tenant_id,Template.type == TemplateTypeEnum.INBOUND,Template.status == TemplateStatusEnum.SUBMITTED).first()
-            template = safe_to_dict(tm) 
-                           
-        config_data = {
-                "business": business_profile,
-                "agent_config": agent_config,
-                "workflow": workflow,
-                "template": template,
-                "lead": lead
-            }
-
-
-            # Use json.dumps to convert the Python dict to a string. 
-            # Use 'indent=None, separators=(',', ':')' for conciseness.
-        config_str = json.dumps(config_data, default=str, indent=None, separators=(',', ':'))
-        print(f"""Config str :-----",{config_str}""")
-            # Construct the final, highly defined system prompt for the LLM
-        prompt = f"""
+# Final, highly defined system prompt for the LLM; {config_str} is the tenant config JSON
+_SYSTEM_PROMPT_TEMPLATE = """
                 You are a highly professional and results-oriented WhatsApp Chat Agent. Your primary objective is to engage users effectively, qualify their interest, and guide them toward a successful conversion (e.g., purchasing a product, signing up for a service, enrolling in a course, or completing another desired action) based strictly on the provided configuration.
 
                 **ROLE & CONFIGURATION (JSON):**
@@ -113,6 +45,35 @@ def System_Prompt(tenant_id: int,sender: Optional[str] = None) -> str:
 
                 Your success is measured by conversion rate—always aim to conclude the chat with an actionable outcome.
                 """
+
+
+def System_Prompt(tenant_id: int,sender: Optional[str] = None, seed_turns: Optional[List[dict]] = None) -> str:
+    """
+    Constructs the dynamic System Prompt for the LLM based on tenant configuration.
+    The tenant's static config comes from utils.prompt_cache; only the lead is queried per sender.
+    The lead's stored summary, if any, is added to `seed_turns` as the opening turn.
+    """
+    lead = {}
+    db = SessionLocal()
+    try:
+        if sender and len(sender) >= 10:
+           phone_number = re.sub(r"\D", "", sender) if sender else ""
+           phone_number = phone_number[-10:] if len(phone_number) >= 10 else phone_number
+           lead = db.query(Lead).filter(Lead.tenant_id == tenant_id,  func.right(func.regexp_replace(Lead.phone, r'\D', '', 'g'), 10) == phone_number).first()
+           if lead:
+              summary = lead.summary if lead else None
+              if summary and isinstance(summary, str) and summary.strip() and seed_turns is not None:
+                  seed_turns.append({"role": "user", "content": summary})
+
+              lead = safe_to_dict(lead)
+
+        # Pre-serialised business/agent_config/workflow/template fragments + this lead
+        # Fit the config into what SYSTEM_PROMPT_TOKENS leaves after the rules, so
+        # build_context never has to cut the prompt (and the rules after the config)
+        budget = SYSTEM_PROMPT_TOKENS - count_tokens(_SYSTEM_PROMPT_TEMPLATE.replace("{config_str}", ""))
+        config_str = get_config_str(db, tenant_id, lead, max_tokens=budget)
+        print(f"""Config str :-----",{config_str}""")
+        prompt = _SYSTEM_PROMPT_TEMPLATE.replace("{config_str}", config_str)
         return prompt.strip()
              
     except Exception as e:
@@ -125,22 +86,26 @@ def System_Prompt(tenant_id: int,sender: Optional[str] = None) -> str:
     
 
 
-def get_history(sender: str,tenant_id: Optional[int] = None):
-    now = time.time()
-    if sender in user_sessions:
-        if now - last_message_time.get(sender, 0) > SESSION_EXPIRY_SECONDS:
-            user_sessions[sender] = []  # expired
-    if not user_sessions[sender]:
-        if Role.TECHNICAN.value in sender:
-            user_sessions[sender].append({"role": "system", "content": System_Prompt(tenant_id,sender)})
-        else:
-            user_sessions[sender].append({"role": "system", "content": System_Prompt(tenant_id,sender)})
-    last_message_time[sender] = now
-    return user_sessions[sender]
+async def get_history(sender: str,tenant_id: Optional[int] = None):
+    """
+    Return the sender's conversation ([system, *turns]), starting a new session
+    with a fresh system prompt if none exists or it has expired.
+    The list is a snapshot: use append_user/append_assistant to add turns.
+    """
+    store = get_session_store()
+    history = await store.load(sender)
+    if history:
+        return history
+    seed_turns = []
+    # System_Prompt queries the database; keep it off the event loop
+    system_prompt = await asyncio.to_thread(System_Prompt, tenant_id, sender, seed_turns) or ""
+    await store.start(sender, system_prompt, seed_turns)
+    return [{"role": "system", "content": system_prompt}, *seed_turns]
 
 
 async def append_user(sender: str, content , tenant_id: Optional[int] = None):
-    get_history(sender,tenant_id).append({"role": "user", "content": content})
+    await get_history(sender,tenant_id)
+    await get_session_store().append(sender, {"role": "user", "content": content})
     # rag_context = ""
     # if content and tenant_id:
     #     rag_results = await rag.search(tenant_id=tenant_id, query=content, k=4)
@@ -152,15 +117,24 @@ async def append_user(sender: str, content , tenant_id: Optional[int] = None):
     #     get_history(sender,tenant_id).append({"role": "system", "content": rag_context})       
 
 
-def append_assistant(sender: str, content: str):
-    get_history(sender).append({"role": "assistant", "content": content})
-    last_message_time[sender] = time.time()
+async def append_assistant(sender: str, content: str):
+    await get_history(sender)
+    await get_session_store().append(sender, {"role": "assistant", "content": content})
+
+
+async def get_snippets(sender: str) -> List[str]:
+    """Knowledge snippets retrieved earlier in the session, injected into every prompt."""
+    return await get_session_store().load_snippets(sender)
+
+
+async def remember_snippets(sender: str, snippets: List[str]):
+    """Keep the latest search results for follow-up turns without adding them to the history."""
+    store = get_session_store()
+    await store.save_snippets(sender, merge_snippets(snippets, await store.load_snippets(sender)))
 
 
 async def clear_user_session(sender: str):
     """
-    Clears the in-memory session history and timing for a specific sender.
-    Uses pop with None to safely remove keys without raising KeyErrors.
+    Clears the stored session history for a specific sender.
     """
-    user_sessions.pop(sender, None)
-    last_message_time.pop(sender, None)
\ No newline at end of file
+    await get_session_store().clear(sender)
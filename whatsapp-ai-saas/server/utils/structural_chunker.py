@@ -0,0 +1,98 @@
+# server/utils/structural_chunker.py
+"""
+Deterministic local chunking for knowledge files and pages.
+
+Turns FileExtractor sections (or crawl4ai markdown) into the same
+{"summary", "tags", "document": [{id, text, metadata}]} shape the LLM
+refinement in utils/file_analyzer.py returns, without any model call:
+each section is split into KNOWLEDGE_CHUNK_TOKENS pieces and carries
+page_number / section / source_type metadata. Ids are derived from the
+source name and content, so re-ingesting an unchanged file rewrites the
+same vectors instead of adding copies. Every chunk carries a `language`
+(the tenant's profile language), like the LLM path's chunks, so
+find_rag_info's language filter does not exclude them.
+
+Tenants choose between this ("local", the default) and LLM refinement
+("llm") with tenants.knowledge_chunking.
+"""
+import hashlib
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from utils.chunked_llm import split_text
+from utils.file_extractor import FileExtractor, Section
+
+KNOWLEDGE_CHUNK_TOKENS = int(os.getenv("KNOWLEDGE_CHUNK_TOKENS", "400"))
+KNOWLEDGE_CHUNK_OVERLAP = int(os.getenv("KNOWLEDGE_CHUNK_OVERLAP", "40"))
+SUMMARY_CHARS = 600
+
+_WORD = re.compile(r"[^\W\d_]{4,}", re.UNICODE)
+_STOPWORDS = {
+    "this", "that", "with", "from", "your", "have", "will", "their", "they", "there", "which",
+    "about", "into", "more", "than", "also", "such", "these", "those", "when", "where", "what",
+    "been", "were", "would", "could", "should", "other", "each", "only", "over", "after", "before",
+    "page", "column", "rows", "none", "true", "false", "http", "https", "www",
+}
+
+
+def _chunk_id(source_name: str, order: int, text: str) -> str:
+    digest = hashlib.sha1(f"{source_name}|{order}|{text}".encode("utf-8")).hexdigest()[:16]
+    return f"{source_name}-{digest}"
+
+
+def _metadata(section: Section, order: int, title: str, extra: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    metadata: Dict[str, Any] = {"order": order, "source_type": section.source_type}
+    if title:
+        metadata["title"] = title
+    if section.section:
+        metadata["section"] = section.section
+    if section.page_number is not None:
+        metadata["page_number"] = section.page_number
+    # Chroma rejects None metadata values
+    metadata.update({k: v for k, v in (extra or {}).items() if v is not None})
+    return metadata
+
+
+def _summary(sections: List[Section]) -> str:
+    headings = list(dict.fromkeys(s.section for s in sections if s.section))[:8]
+    lead = re.sub(r"\s+", " ", " ".join(s.text for s in sections[:3]))[:SUMMARY_CHARS].strip()
+    if headings:
+        return f"Sections: {'; '.join(headings)}. {lead}"
+    return lead
+
+
+def _tags(sections: List[Section], n: int = 3) -> List[str]:
+    counts = Counter(
+        w for s in sections for w in (m.casefold() for m in _WORD.findall(s.text)) if w not in _STOPWORDS
+    )
+    return [w for w, _ in counts.most_common(n)]
+
+
+def chunk_sections(sections: List[Section], source_name: str,
+                   extra_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    sections = [s for s in sections if s.text and s.text.strip()]
+    title = next((s.section for s in sections if s.section), "")
+    documents = []
+    for section in sections:
+        for piece in split_text(section.text, KNOWLEDGE_CHUNK_TOKENS, KNOWLEDGE_CHUNK_OVERLAP):
+            order = len(documents) + 1
+            documents.append({
+                "id": _chunk_id(source_name, order, piece),
+                "text": piece,
+                "metadata": _metadata(section, order, title, extra_metadata),
+            })
+    return {"summary": _summary(sections), "tags": _tags(sections), "document": documents}
+
+
+def chunk_file(file_bytes: bytes, file_name: str, language: str = "en") -> Dict[str, Any]:
+    """Chunks of a knowledge file from its structure. Blocking (parsing); run in a thread."""
+    sections = FileExtractor.extract_sections(file_bytes, file_name)
+    return chunk_sections(sections, file_name, {"language": language})
+
+
+def chunk_markdown(markdown: str, source_url: str, language: str = "en") -> Dict[str, Any]:
+    """Chunks of a crawled page's markdown, split at its headers."""
+    sections = FileExtractor.sections_from_markdown(markdown, source_type="web")
+    return chunk_sections(sections, source_url, {"source_url": source_url, "language": language})
@@ -19,6 +19,14 @@ find_rag_info_tool = {
                 "query": {
                     "type": "string",
                     "description": "The specific question or topic to search for in the knowledge base."
+                },
+                "catalog_only": {
+                    "type": "boolean",
+                    "description": "Set true for product, price, SKU or availability questions to search only the product catalog."
+                },
+                "language": {
+                    "type": "string",
+                    "description": "Optional ISO 639-1 code (e.g. 'en', 'hi') to search only documents written in that language."
                 }
             },
             "required": ["query"]
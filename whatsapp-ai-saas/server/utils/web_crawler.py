@@ -1,7 +1,12 @@
 import asyncio
 from crawl4ai import AsyncWebCrawler, CrawlerRunConfig, VirtualScrollConfig
+from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
 
-async def scrape_single_page(url: str) -> str:
+from services.page_fetcher import get_page_fetcher
+
+
+async def _render(url: str) -> tuple:
+    """Full browser render with virtual scrolling; returns (html, markdown)."""
     scroll_config = VirtualScrollConfig(
         container_selector=".product-wrap",  # or try: "[data-product]", ".product-card", etc.
         scroll_count=10,                     # scroll 10 times to load more products
@@ -18,4 +23,25 @@ async def scrape_single_page(url: str) -> str:
 
     async with AsyncWebCrawler(verbose=True) as crawler:
         result = await crawler.arun(url=url, config=run_config)
-        return result.markdown
+        return result.html or "", result.markdown
+
+
+async def scrape_single_page(url: str) -> str:
+    """
+    Page content as markdown. Server-rendered pages are fetched with a plain
+    GET and converted locally; the browser (crawl4ai) is only started when the
+    static HTML looks incomplete (see services/page_fetcher.py).
+    """
+    rendered = {}
+
+    async def render(target: str) -> str:
+        rendered["html"], rendered["markdown"] = await _render(target)
+        return rendered["html"]
+
+    page = await get_page_fetcher().fetch(url, render)
+    if page.rendered and "markdown" in rendered:
+        return rendered["markdown"]
+    markdown = await asyncio.to_thread(
+        DefaultMarkdownGenerator().generate_markdown, page.html, base_url=url
+    )
+    return markdown.raw_markdown
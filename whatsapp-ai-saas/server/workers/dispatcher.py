@@ -0,0 +1,80 @@
+# server/workers/dispatcher.py
+
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[None]]
+
+
+class KeyedDispatcher:
+    """
+    Runs jobs concurrently across keys while keeping strict submission order
+    within a key (e.g. one customer's messages to one business).
+
+    Each active key owns a lane (FIFO deque) drained by a single runner task,
+    so at most one job per key is in flight. `concurrency` caps how many jobs
+    run at once across all lanes; `max_pending` caps jobs accepted but not yet
+    finished, which is what callers use for backpressure.
+    """
+
+    def __init__(self, concurrency: int, max_pending: Optional[int] = None):
+        self.concurrency = concurrency
+        self.max_pending = max_pending or concurrency * 4
+        self._running = asyncio.Semaphore(concurrency)
+        self._lanes: Dict[Hashable, Deque[Job]] = {}
+        self._runners: set = set()
+        self._pending = 0
+        self._has_capacity = asyncio.Event()
+        self._has_capacity.set()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def free_slots(self) -> int:
+        return max(0, self.max_pending - self._pending)
+
+    async def wait_for_capacity(self) -> None:
+        """Block until at least one more job can be accepted."""
+        while self._pending >= self.max_pending:
+            self._has_capacity.clear()
+            await self._has_capacity.wait()
+
+    def submit(self, key: Hashable, job: Job) -> None:
+        """Queue `job` behind any earlier jobs with the same key."""
+        self._pending += 1
+        lane = self._lanes.get(key)
+        if lane is not None:
+            lane.append(job)
+            return
+        self._lanes[key] = deque([job])
+        task = asyncio.create_task(self._drain(key))
+        self._runners.add(task)
+        task.add_done_callback(self._runners.discard)
+
+    async def _drain(self, key: Hashable) -> None:
+        lane = self._lanes[key]
+        try:
+            while lane:
+                job = lane[0]
+                async with self._running:
+                    try:
+                        await job()
+                    except Exception:
+                        logger.exception("[Dispatcher] job failed for key=%s", key)
+                lane.popleft()
+                self._pending -= 1
+                self._has_capacity.set()
+        finally:
+            # No await between the empty check and this delete, so submit() can't race it
+            del self._lanes[key]
+
+    async def join(self) -> None:
+        """Wait for every accepted job to finish."""
+        while self._runners:
+            await asyncio.gather(*list(self._runners))
@@ -0,0 +1,198 @@
+# server/workers/dlr_worker.py
+"""
+Consumes the Exotel DLR stream written by routers/whatsapp_webhook.py and
+applies delivery statuses to leads in batches (see services/dlr_ingest.py).
+
+A batch is ACKed only after its UPDATE commits. When a batch fails, its
+entries are retried one at a time so one bad report does not hold back the
+rest; the ones that fail on their own stay pending and are retried via
+XAUTOCLAIM. Only entries that still fail on their own after
+DLR_MAX_DELIVERIES are moved to the dead-letter stream. While the database
+is unreachable nothing is isolated or dead-lettered: entries just stay
+pending until it is back.
+"""
+import os, json, asyncio, logging, socket, time
+from collections import Counter
+from prometheus_client import start_http_server
+import redis.asyncio as redis
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from services.dlr_ingest import apply_dlr_batch
+from services.metrics import deliveries_total
+
+logging.basicConfig(level=logging.INFO)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+DLR_QUEUE_KEY = os.getenv("EXOTEL_DLR_QUEUE", "wa_exotel_dlr")
+DEAD_LETTER_KEY = os.getenv("WEBHOOK_DEAD_LETTER", "wh_dead_letter")
+GROUP = os.getenv("DLR_GROUP", "dlr_grp")
+CONSUMER = os.getenv("DLR_CONSUMER") or f"{socket.gethostname()}-{os.getpid()}"
+DLR_BATCH_SIZE = int(os.getenv("DLR_BATCH_SIZE", "1000"))
+# After the first entries arrive, wait this long for more to fill the batch
+DLR_BATCH_LINGER_MS = int(os.getenv("DLR_BATCH_LINGER_MS", "200"))
+CLAIM_IDLE_MS = int(os.getenv("DLR_CLAIM_IDLE_MS", "60000"))
+CLAIM_INTERVAL_S = float(os.getenv("DLR_CLAIM_INTERVAL_S", "15"))
+MAX_DELIVERIES = int(os.getenv("DLR_MAX_DELIVERIES", "5"))
+METRICS_PORT = int(os.getenv("DLR_METRICS_PORT", "0"))
+
+
+def parse_entry(fields: dict):
+    try:
+        return json.loads(fields.get("payload", "{}"))
+    except ValueError:
+        return None
+
+
+async def read_batch(r) -> list:
+    entries = []
+    block = 5000
+    while len(entries) < DLR_BATCH_SIZE:
+        resp = await r.xreadgroup(
+            groupname=GROUP,
+            consumername=CONSUMER,
+            streams={DLR_QUEUE_KEY: ">"},
+            count=DLR_BATCH_SIZE - len(entries),
+            block=block,
+        )
+        if not resp:
+            break
+        entries.extend(resp[0][1])
+        if not DLR_BATCH_LINGER_MS:
+            break
+        block = DLR_BATCH_LINGER_MS
+    return entries
+
+
+def db_unreachable(e: Exception) -> bool:
+    """Connection-level failure: says nothing about the reports themselves."""
+    return isinstance(e, (OperationalError, InterfaceError)) or getattr(e, "connection_invalidated", False)
+
+
+async def dead_letter(r, msg_id: str, fields: dict, deliveries: int):
+    await r.xadd(DEAD_LETTER_KEY, {
+        **fields,
+        "source_stream": DLR_QUEUE_KEY,
+        "source_id": msg_id,
+        "deliveries": str(deliveries),
+        "dead_at": str(int(time.time())),
+    })
+    await r.xack(DLR_QUEUE_KEY, GROUP, msg_id)
+    logging.error("[DLQ] %s/%s moved to %s after %s deliveries", DLR_QUEUE_KEY, msg_id, DEAD_LETTER_KEY, deliveries)
+
+
+async def claim_stale(r):
+    """
+    XAUTOCLAIM abandoned or failed entries. Returns (retry, exhausted): entries
+    to retry as a batch, and (msg_id, fields, deliveries) past MAX_DELIVERIES.
+    """
+    resp = await r.xautoclaim(
+        DLR_QUEUE_KEY, GROUP, CONSUMER,
+        min_idle_time=CLAIM_IDLE_MS,
+        start_id="0-0",
+        count=DLR_BATCH_SIZE,
+    )
+    retry, exhausted = [], []
+    for msg_id, fields in (resp[1] if resp else []):
+        if not fields:  # trimmed from the stream while pending
+            await r.xack(DLR_QUEUE_KEY, GROUP, msg_id)
+            continue
+        info = await r.xpending_range(DLR_QUEUE_KEY, GROUP, min=msg_id, max=msg_id, count=1)
+        deliveries = info[0]["times_delivered"] if info else 1
+        if deliveries > MAX_DELIVERIES:
+            exhausted.append((msg_id, fields, deliveries))
+        else:
+            retry.append((msg_id, fields))
+    return retry, exhausted
+
+
+def record(reports: list):
+    for status, n in Counter(p.get("status", "") for p in reports).items():
+        deliveries_total.labels(provider="exotel", code=status).inc(n)
+
+
+async def apply_one(r, msg_id: str, fields: dict) -> None:
+    """Apply and ACK a single entry; raises if its UPDATE fails."""
+    report = parse_entry(fields)
+    if report:
+        await asyncio.to_thread(apply_dlr_batch, [report])
+        record([report])
+    await r.xack(DLR_QUEUE_KEY, GROUP, msg_id)
+
+
+async def isolate(r, entries: list) -> None:
+    """Retry a failed batch entry by entry; failures stay pending for XAUTOCLAIM."""
+    failed = 0
+    for msg_id, fields in entries:
+        try:
+            await apply_one(r, msg_id, fields)
+        except Exception as e:
+            if db_unreachable(e):
+                logging.warning("[DLR] database unreachable, leaving %s entries pending: %s", len(entries), e)
+                return
+            failed += 1
+            logging.warning("[DLR] %s failed on its own, left pending: %s", msg_id, e)
+    logging.info("[DLR] isolated batch of %s: %s failed", len(entries), failed)
+
+
+async def process_batch(r, entries: list):
+    ids = [msg_id for msg_id, _ in entries]
+    reports = [p for p in (parse_entry(fields) for _, fields in entries) if p]
+    try:
+        updated = await asyncio.to_thread(apply_dlr_batch, reports)
+    except Exception as e:
+        if db_unreachable(e):
+            logging.warning("[DLR] database unreachable, batch of %s left pending: %s", len(entries), e)
+            return
+        logging.exception("[DLR] batch of %s failed, retrying entries one at a time: %s", len(entries), e)
+        await isolate(r, entries)
+        return
+    await r.xack(DLR_QUEUE_KEY, GROUP, *ids)
+    record(reports)
+    logging.info("[DLR] applied %s reports to %s leads", len(entries), updated)
+
+
+async def process_exhausted(r, entries: list):
+    """Last attempt, one entry at a time; only entries that fail on their own are dead-lettered."""
+    for msg_id, fields, deliveries in entries:
+        try:
+            await apply_one(r, msg_id, fields)
+        except Exception as e:
+            if db_unreachable(e):
+                logging.warning("[DLR] database unreachable, not dead-lettering %s entries: %s", len(entries), e)
+                return
+            logging.error("[DLR] %s failed after %s deliveries: %s", msg_id, deliveries, e)
+            await dead_letter(r, msg_id, fields, deliveries)
+
+
+async def main():
+    r = redis.from_url(REDIS_URL, decode_responses=True)
+    try:
+        await r.xgroup_create(name=DLR_QUEUE_KEY, groupname=GROUP, id="$", mkstream=True)
+    except Exception:
+        pass  # group already exists
+
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    logging.info("[DLR Worker] consumer=%s group=%s batch=%s stream=%s",
+                 CONSUMER, GROUP, DLR_BATCH_SIZE, DLR_QUEUE_KEY)
+
+    last_claim = float("-inf")
+    while True:
+        if time.monotonic() - last_claim >= CLAIM_INTERVAL_S:
+            last_claim = time.monotonic()
+            try:
+                stale, exhausted = await claim_stale(r)
+                if exhausted:
+                    await process_exhausted(r, exhausted)
+                if stale:
+                    await process_batch(r, stale)
+            except Exception as e:
+                logging.exception("XAUTOCLAIM pass failed: %s", e)
+
+        entries = await read_batch(r)
+        if entries:
+            await process_batch(r, entries)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -3,8 +3,6 @@ from datetime import time
 import json
 from typing import List
 import httpx
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 from deps import get_db
@@ -12,76 +10,24 @@ from services import rag, llm
 from models import BusinessCatalog
 import logging
 from services.rag import rag
-from playwright.async_api import async_playwright
+from services.crawler import Crawler, CrawledPage, get_browser_pool
+from services.page_fetcher import get_page_fetcher
+from utils.html_extract import parse_page
+from utils.chunked_llm import map_chunks, split_text
 
 
 logger = logging.getLogger(__name__)
 
 CRAWL_LIMIT = 100  # max pages per request
-LLM_BATCH_SIZE = 2000  # chars per chunk for LLM parsing
+LLM_CHUNK_TOKENS = 1500  # tokens per part for LLM parsing (long pages are split, not cut)
 CATALOG_LIMIT = 30  # max items to ingest per request
 
 async def fetch_html(url: str) -> str:
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(
-            headless=True,
-            args=[
-                "--no-sandbox",
-                "--disable-setuid-sandbox",
-                "--disable-dev-shm-usage",
-                "--disable-gpu",
-            ]
-        )
-        page = await browser.new_page()
-        await page.goto(url, wait_until="networkidle", timeout=30000)
-        html = await page.content()
-        await browser.close()
-        return html
-
-def extract_links(base_url: str, html: str) -> list[str]:
-    soup = BeautifulSoup(html, "html.parser")
-    links = []
-    for tag in soup.find_all("a", href=True):
-        link = urljoin(base_url, tag["href"])
-        # restrict to same domain
-        if urlparse(link).netloc == urlparse(base_url).netloc:
-            links.append(link)
-    return links
-
-def clean_text(html: str) -> str:
-    soup = BeautifulSoup(html, "html.parser")
-    
-    # Remove unwanted tags
-    for tag in soup(["script", "style", "noscript", "svg", "head", "meta", "link"]):
-        tag.decompose()
-    for img in soup.find_all("img"):
-        alt = img.get("alt", "").strip()
-        src = img.get("src", "")
-        # Create a natural-language description
-        desc = f"[Image: {alt} | {src}]" if alt else f"[Image: {src}]"
-        img.replace_with(desc)
-    
-    # Extract text with reasonable spacing
-    text = soup.get_text(separator=" ", strip=True)
-    import re
-    text = re.sub(r"\s+", " ", text)
-    
-    return text
-
-def extract_images(base_url: str, html: str) -> list[str]:
-    soup = BeautifulSoup(html, "html.parser")
-    image_urls = []
-    for img in soup.find_all("img", src=True):
-        url = urljoin(base_url, img["src"])
-        image_urls.append(url)
-    return image_urls
+    # Plain GET first; the shared browser only renders pages that need JavaScript
+    result = await get_page_fetcher().fetch(url, get_browser_pool().fetch)
+    return result.html
 
-async def parse_structured_with_llm(text: str, source_url: str,tenant_id:str) -> list[dict]:
-    """
-    Use a standardized prompt to extract business catalog items from any webpage text.
-    Returns a list of dictionaries with consistent schema.
-    """
-    prompt = f"""You are an expert data extractor.Respond ONLY with a JSON array. Do not include any other text, markdown, or explanation. The output must be parseable by json.loads(). Analyze the following text and extract all business offerings such as products, services, courses, packages, rooms, or plans.
+CATALOG_PROMPT = """You are an expert data extractor.Respond ONLY with a JSON array. Do not include any other text, markdown, or explanation. The output must be parseable by json.loads(). Analyze the following text and extract all business offerings such as products, services, courses, packages, rooms, or plans.
 
 Return a JSON list of items. Each item must be a JSON object with EXACTLY these fields:
 - "item_type": one of ["product", "service", "course", "package", "room", "plan", "other"]
@@ -104,83 +50,90 @@ IGNORE:
 - Items that appear only in headers, footers, or side banners
 
 Each item must represent a real product with a name and price that can be purchased.
-
-Text:
-{text[:LLM_BATCH_SIZE]}
 """
 
+
+def _parse_items(raw_response: str, source_url: str) -> list[dict]:
+    # Ensure response is a list of dicts
     try:
-        raw_response = await llm.analysis(tenant_id,prompt)
-        # Ensure response is a list of dicts
-        # Parse the JSON string
+        response = json.loads(raw_response)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Failed to parse LLM JSON response from {source_url}: {e}")
+        logger.debug(f"Raw LLM response: {raw_response[:500]}...")
+        return []
+
+    if isinstance(response, list):
+        return [item for item in response if isinstance(item, dict)]
+    elif isinstance(response, dict) and "items" in response:
+        return response["items"]
+    else:
+        logger.warning(f"Unexpected LLM response format from {source_url}")
+        return []
+
+
+async def parse_structured_with_llm(text: str, source_url: str,tenant_id:str) -> list[dict]:
+    """
+    Use a standardized prompt to extract business catalog items from any webpage text.
+    Long pages are split into LLM_CHUNK_TOKENS parts that are extracted concurrently
+    and merged (items repeated across parts are kept once).
+    Returns a list of dictionaries with consistent schema.
+    """
+    async def extract(i, chunk):
         try:
-            response = json.loads(raw_response)
-        except json.JSONDecodeError as e:
-            logger.warning(f"Failed to parse LLM JSON response from {source_url}: {e}")
-            logger.debug(f"Raw LLM response: {raw_response[:500]}...")
-            return []
-        
-        if isinstance(response, list):
-            return response
-        elif isinstance(response, dict) and "items" in response:
-            return response["items"]
-        else:
-            logger.warning(f"Unexpected LLM response format from {source_url}")
+            raw_response = await llm.analysis(tenant_id, f"Text:\n{chunk}", CATALOG_PROMPT)
+            return _parse_items(raw_response, source_url)
+        except Exception as e:
+            logger.error(f"LLM parsing failed for {source_url} (part {i + 1}): {e}")
             return []
-    except Exception as e:
-        logger.error(f"LLM parsing failed for {source_url}: {e}")
-        return []
+
+    items, seen = [], set()
+    for part in await map_chunks(split_text(text, max_tokens=LLM_CHUNK_TOKENS), extract):
+        for item in part:
+            key = (str(item.get("name") or "").strip().casefold(), item.get("price"))
+            if key in seen:
+                continue
+            seen.add(key)
+            items.append(item)
+    return items
+
+def _catalog_entry(item: dict, tenant_id: str, url: str) -> BusinessCatalog:
+    # Normalize and validate fields
+    return BusinessCatalog(
+        tenant_id=tenant_id,
+        item_type=item.get("item_type") or "other",
+        name=item.get("name") or "Unnamed Item",
+        description=item.get("description") or "",
+        category=item.get("category") or "General",
+        price=item.get("price"),
+        discount=item.get("discount"),
+        currency=item.get("currency") or "USD",  # or use settings.CURRENCY if available
+        source_url=item.get("source_url") or url,
+        image_url=item.get("image_url") or None,
+    )
+
 
 async def crawl_and_ingest(session: Session, tenant_id: str, start_url: str):
-    visited, to_visit = set(), [start_url]
-    pages_processed = 0
+    """
+    Crawl the site (same domain, up to CRAWL_LIMIT pages) with the concurrent
+    crawler: pages are fetched in parallel and each one's LLM extraction
+    overlaps with the next downloads. Stops once CATALOG_LIMIT items are found.
+    """
     print(f"Starting crawl for tenant {tenant_id} from {start_url}")
-    catalog_list: List[BusinessCatalog] = []
 
-    while to_visit and pages_processed < CRAWL_LIMIT:
-        url = to_visit.pop()
-        if url in visited:
-            continue
-        try:
-            html = await fetch_html(url)
-            print(f"Fetched {url} ({len(html)} bytes)")
-            text = clean_text(html)
-            print(f"Cleaned text from {url}: {len(text)} chars")
-
-            # Step: Parse structured catalog via LLM (NO RAG)
-            items = await parse_structured_with_llm(text, url,tenant_id)
-
-            for item in items:
-                # Normalize and validate fields
-                catalog_entry = BusinessCatalog(
-                    tenant_id=tenant_id,
-                    item_type=item.get("item_type") or "other",
-                    name=item.get("name") or "Unnamed Item",
-                    description=item.get("description") or "",
-                    category=item.get("category") or "General",
-                    price=item.get("price"),
-                    discount=item.get("discount"),
-                    currency=item.get("currency") or "USD",  # or use settings.CURRENCY if available
-                    source_url=item.get("source_url") or url,
-                    image_url=item.get("image_url") or None,
-                )
-                #session.add(catalog_entry)
-                catalog_list.append(catalog_entry)
-                
-            # Discover new links (same domain only)
-            for link in extract_links(url, html):
-                if link not in visited and link not in to_visit:
-                    to_visit.append(link)
-
-            visited.add(url)
-            pages_processed += 1
-            if len(catalog_list) >= CATALOG_LIMIT:
-                return catalog_list
-            #session.commit()
-        except Exception as e:
-            logger.error(f"Error processing {url}: {e}")
-            #session.rollback()
-    return catalog_list
+    def process(page: CrawledPage) -> None:
+        # One parse yields the text for the LLM and the links for the frontier
+        content = parse_page(page.url, page.html)
+        page.text, page.links = content.text, content.links
+        page.data["images"] = content.images
+        print(f"Fetched {page.url} ({len(page.html)} bytes, {len(page.text)} chars of text)")
+
+    async def extract(page: CrawledPage) -> List[BusinessCatalog]:
+        # Step: Parse structured catalog via LLM (NO RAG)
+        items = await parse_structured_with_llm(page.text, page.url, tenant_id)
+        return [_catalog_entry(item, tenant_id, page.url) for item in items]
+
+    crawler = Crawler(fetch_html, process, extract, max_pages=CRAWL_LIMIT, stop_after=CATALOG_LIMIT)
+    return await crawler.run(start_url)
 
 async def background_crawl(tenant_id: int, url: str):
     """Sync function called in background"""
@@ -0,0 +1,108 @@
+# server/workers/rag_migrate.py
+"""
+Move tenants between the dedicated and sharded Chroma layouts
+(see services/rag_storage.py).
+
+    python -m workers.rag_migrate --to sharded            # pack small tenants into shards
+    python -m workers.rag_migrate --to dedicated          # one collection per tenant again
+    python -m workers.rag_migrate --to sharded --tenant 42 --dry-run
+
+--to sharded leaves tenants at or above RAG_PROMOTE_THRESHOLD in their own
+collection unless --force is given. Vectors are copied as stored (no
+re-embedding); only the copied rows are removed from the source, after the
+copy finished, and the tenant's search cache is invalidated. A tenant that
+another process is moving right now is skipped. Run it with RAG_STORAGE_MODE set to
+the target layout on the API/worker processes, or right before switching it.
+"""
+import argparse
+import logging
+from typing import List, Set
+
+from services.rag import rag
+from services.rag_storage import (
+    RAG_MIGRATE_PAGE, TENANT_KEY, TenantPartition, VectorStorage, dedicated_name,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+
+def _collection_names(client) -> List[str]:
+    # chromadb < 0.6 returns Collection objects, newer versions return names
+    return [getattr(c, "name", c) for c in client.list_collections()]
+
+
+def dedicated_tenants(client) -> List[str]:
+    return [name[len("tenant-"):] for name in _collection_names(client) if name.startswith("tenant-")]
+
+
+def sharded_tenants(client) -> List[str]:
+    tenants: Set[str] = set()
+    for name in _collection_names(client):
+        if not name.startswith("shared-"):
+            continue
+        col = client.get_collection(name=name)
+        offset = 0
+        while True:
+            page = col.get(include=["metadatas"], limit=RAG_MIGRATE_PAGE, offset=offset)
+            ids = page.get("ids") or []
+            if not ids:
+                break
+            tenants.update(str((m or {}).get(TENANT_KEY)) for m in page.get("metadatas") or [] if m)
+            offset += len(ids)
+    tenants.discard("None")
+    return sorted(tenants)
+
+
+def to_sharded(storage: VectorStorage, tenants: List[str], force: bool, dry_run: bool) -> int:
+    moved = 0
+    for tenant_id in tenants:
+        part = TenantPartition(tenant_id, storage.client.get_collection(name=dedicated_name(tenant_id)), False)
+        size = part.count()
+        if not force and storage.promote_threshold > 0 and size >= storage.promote_threshold:
+            print(f"[RAG MIGRATE] tenant {tenant_id}: {size} chunks, above threshold, kept dedicated")
+            continue
+        print(f"[RAG MIGRATE] tenant {tenant_id}: {size} chunks -> shard{' (dry run)' if dry_run else ''}")
+        if not dry_run:
+            if storage.demote(tenant_id) is None:
+                continue
+            rag.query_cache.bump(tenant_id)
+        moved += 1
+    return moved
+
+
+def to_dedicated(storage: VectorStorage, tenants: List[str], dry_run: bool) -> int:
+    moved = 0
+    for tenant_id in tenants:
+        print(f"[RAG MIGRATE] tenant {tenant_id}: shard -> {dedicated_name(tenant_id)}{' (dry run)' if dry_run else ''}")
+        if not dry_run:
+            if storage.promote(tenant_id) is None:
+                continue
+            rag.query_cache.bump(tenant_id)
+        moved += 1
+    return moved
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migrate RAG tenants between Chroma storage layouts")
+    parser.add_argument("--to", choices=["sharded", "dedicated"], required=True)
+    parser.add_argument("--tenant", action="append", help="Only this tenant id (repeatable)")
+    parser.add_argument("--force", action="store_true", help="--to sharded: also move tenants above the threshold")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    # Always resolve placement as sharded here so both layouts are visible
+    storage = VectorStorage(lambda: rag.client, mode="sharded")
+    client = storage.client
+    if args.to == "sharded":
+        candidates = dedicated_tenants(client)
+        tenants = [t for t in candidates if not args.tenant or t in args.tenant]
+        moved = to_sharded(storage, tenants, args.force, args.dry_run)
+    else:
+        candidates = sharded_tenants(client)
+        tenants = [t for t in candidates if not args.tenant or t in args.tenant]
+        moved = to_dedicated(storage, tenants, args.dry_run)
+    print(f"[RAG MIGRATE] {'would move' if args.dry_run else 'moved'} {moved} tenant(s) to {args.to} layout")
+
+
+if __name__ == "__main__":
+    main()